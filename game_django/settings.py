@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import importlib.util  # 用于检查可选依赖是否已安装
 import os
 from dotenv import load_dotenv  # 导入 load_dotenv 用于加载 .env 文件
 from urllib.parse import urlparse  # 导入 urlparse 用于解析URL
@@ -111,14 +112,36 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "game_django.wsgi.application"
+ASGI_APPLICATION = "game_django.asgi.application"
+
+# 是否让 gamecore 的 API 使用异步视图（gamecore/async_views.py，依赖 adrf）。
+# 通过 ASGI（uvicorn）部署时开启：等待上游 AI 服务期间不占用线程，单个进程可以同时处理更多回合。
+GAMECORE_ASYNC_VIEWS = os.getenv('GAMECORE_ASYNC_VIEWS', 'False') == 'True'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# --- 数据库连接复用 ---
+# 持久连接：每个线程的连接在请求结束后保留 DB_CONN_MAX_AGE 秒供后续请求复用，复用前先做健康检查。
+# 异步视图（ASGI）下每个请求在不同的线程中访问数据库，线程级的持久连接无法复用，默认关闭。
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '0' if GAMECORE_ASYNC_VIEWS else '60'))
+# 连接池：进程内所有线程和异步任务共享一个连接池（依赖 django-db-connection-pool），ASGI 部署时推荐开启。
+# 每个进程最多占用 DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW 个连接，进程数乘以该值应小于 MySQL 的 max_connections。
+DB_POOL = os.getenv('DB_POOL', 'False') == 'True'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', '10'))
+# 连接池耗尽时等待空闲连接的最长时间（秒），以及连接的最长存活时间（秒，需小于 MySQL 的 wait_timeout）
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '900'))
+
+if DB_POOL and importlib.util.find_spec('dj_db_conn_pool') is None:
+    print("警告：DB_POOL=True 但未安装 django-db-connection-pool，退回到持久连接模式。")
+    DB_POOL = False
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'dj_db_conn_pool.backends.mysql' if DB_POOL else 'django.db.backends.mysql',
         'NAME': os.getenv('DB_NAME'),             # 从环境变量读取
         'USER': os.getenv('DB_USER'),             # 从环境变量读取
         'PASSWORD': os.getenv('DB_PASSWORD'),       # 从环境变量读取
@@ -127,8 +150,20 @@ DATABASES = {
         'OPTIONS': {
             'charset': 'utf8mb4',
         },
+        # 使用连接池时，请求结束后把连接还给池子，而不是由线程继续持有
+        'CONN_MAX_AGE': 0 if DB_POOL else DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+if DB_POOL:
+    DATABASES['default']['POOL_OPTIONS'] = {
+        'POOL_SIZE': DB_POOL_SIZE,
+        'MAX_OVERFLOW': DB_POOL_MAX_OVERFLOW,
+        'TIMEOUT': DB_POOL_TIMEOUT,
+        'RECYCLE': DB_POOL_RECYCLE,
+        # 取出连接时先 ping 一次，丢弃已被 MySQL 断开的连接
+        'PRE_PING': True,
+    }
 
 
 # Password validation
@@ -177,6 +212,150 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# --- 图片处理配置 ---
+# 生成衍生图（WebP/JPEG，多种尺寸）的进程池大小，设为 0 则在请求线程内直接处理
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', '2'))
+# 单张图片处理的最长等待时间（秒）
+IMAGE_PROCESSING_TIMEOUT = float(os.getenv('IMAGE_PROCESSING_TIMEOUT', '30'))
+# 上传图片的大小上限（字节）与像素数上限（防止解压炸弹）
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', str(32 * 1024 * 1024)))
+MAX_UPLOAD_PIXELS = int(os.getenv('MAX_UPLOAD_PIXELS', str(60_000_000)))
+# 同时进行的图片下载数量上限，以及临时错误的重试次数和退避基数（秒）
+IMAGE_DOWNLOAD_CONCURRENCY = int(os.getenv('IMAGE_DOWNLOAD_CONCURRENCY', '8'))
+IMAGE_DOWNLOAD_RETRIES = int(os.getenv('IMAGE_DOWNLOAD_RETRIES', '2'))
+IMAGE_DOWNLOAD_BACKOFF = float(os.getenv('IMAGE_DOWNLOAD_BACKOFF', '0.5'))
+# 是否在后台把生成的图片转存到本站存储（服务商返回的 URL 会过期）
+MIRROR_GENERATED_IMAGES = os.getenv('MIRROR_GENERATED_IMAGES', 'True') == 'True'
+# 后台任务线程池大小
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', '4'))
+# 耗时的批量后台任务（锦标赛预先计算）同时执行的数量，多出的排队等待，不占用上面的后台线程
+BACKGROUND_BATCH_WORKERS = int(os.getenv('BACKGROUND_BATCH_WORKERS', '2'))
+
+# --- Ark 调用的容错配置 ---
+# Ark 服务地址，测试时可以指向本地的故障注入桩服务
+ARK_BASE_URL = os.getenv('ARK_BASE_URL', 'https://ark.cn-beijing.volces.com/api/v3')
+# 单次调用的超时上限（秒）与临时错误的重试次数、退避基数（秒）
+ARK_TIMEOUT = float(os.getenv('ARK_TIMEOUT', '90'))
+ARK_RETRIES = int(os.getenv('ARK_RETRIES', '2'))
+ARK_RETRY_BACKOFF = float(os.getenv('ARK_RETRY_BACKOFF', '0.5'))
+# 连续失败多少次后熔断，以及熔断后多久（秒）放行一个试探请求
+ARK_BREAKER_FAILURES = int(os.getenv('ARK_BREAKER_FAILURES', '5'))
+ARK_BREAKER_RECOVERY = float(os.getenv('ARK_BREAKER_RECOVERY', '30'))
+# 启用对冲请求的调用类型（逗号分隔，可选 vision、image_generation）：超过 p95 耗时仍未返回时再发一个相同请求
+# 对冲请求另外占用一个上游调用名额（UPSTREAM_MAX_CONCURRENT），没有空闲名额时不对冲
+ARK_HEDGE_OPERATIONS = [op.strip() for op in os.getenv('ARK_HEDGE_OPERATIONS', 'vision').split(',') if op.strip()]
+# 一个游戏回合的端到端时间预算（秒），比前端 150 秒的请求超时略短
+TURN_DEADLINE = float(os.getenv('TURN_DEADLINE', '140'))
+
+# --- 投机执行 AI 一方 ---
+# 开局发出原图后立即在后台执行 AI 一方（识图、生图、打分），玩家提交时只剩玩家一方
+SPECULATIVE_AI_BRANCH = os.getenv('SPECULATIVE_AI_BRANCH', 'True') == 'True'
+# 结果的保留时间（秒），超过后视为玩家已放弃本局
+SPECULATION_TTL = int(os.getenv('SPECULATION_TTL', '900'))
+# 每个进程同时进行的投机任务上限，以及任务在后台队列中最长的等待时间（秒），超过则放弃
+SPECULATION_MAX_PENDING = int(os.getenv('SPECULATION_MAX_PENDING', '16'))
+SPECULATION_MAX_QUEUE_DELAY = float(os.getenv('SPECULATION_MAX_QUEUE_DELAY', '60'))
+# 玩家提交时任务仍在进行，最多等待它完成的时间（秒），超时则照常完整执行
+SPECULATION_WAIT = float(os.getenv('SPECULATION_WAIT', '60'))
+
+# --- 图片相似度打分 ---
+# 使用的 CLIP 模型（sentence-transformers 的模型名）。更换后用 python manage.py rescore_rounds 重新计算历史得分
+CLIP_MODEL_NAME = os.getenv('CLIP_MODEL_NAME', 'clip-ViT-B-32')
+# CLIP 打分进程池（gamecore/scoring.py）：每个 Web 进程启动 SCORING_WORKERS 个打分进程，各自加载一次模型，
+# Web 进程本身不加载模型，打分的 CPU 计算也不再与请求线程争抢 GIL。设为 0 则在 Web 进程中加载模型并直接计算。
+# 注意内存占用：总共会加载 Web 进程数 x SCORING_WORKERS 份模型。
+SCORING_WORKERS = int(os.getenv('SCORING_WORKERS', '1'))
+# 每个 Web 进程同时提交给打分进程池的任务上限（排队 + 执行中），以及队列已满时等待空位的最长时间（秒）
+SCORING_QUEUE_SIZE = int(os.getenv('SCORING_QUEUE_SIZE', '8'))
+SCORING_QUEUE_TIMEOUT = float(os.getenv('SCORING_QUEUE_TIMEOUT', '5'))
+# 单个打分任务的最长等待时间（秒）
+SCORING_TIMEOUT = float(os.getenv('SCORING_TIMEOUT', '30'))
+
+# --- 锦标赛模式 ---
+# 一次锦标赛最多的轮数
+TOURNAMENT_MAX_ROUNDS = int(os.getenv('TOURNAMENT_MAX_ROUNDS', '10'))
+# 后台预先计算 AI 一方时，同时处理的轮数
+TOURNAMENT_PREPARE_WORKERS = int(os.getenv('TOURNAMENT_PREPARE_WORKERS', '4'))
+# 预先计算整场锦标赛 AI 一方的时间预算（秒）
+TOURNAMENT_PREPARE_DEADLINE = float(os.getenv('TOURNAMENT_PREPARE_DEADLINE', '300'))
+# 准备失败的轮次最多尝试的次数（在上述时间预算内）
+TOURNAMENT_PREPARE_ATTEMPTS = int(os.getenv('TOURNAMENT_PREPARE_ATTEMPTS', '3'))
+# 一次提交多轮时，同时生成玩家图片的轮数
+TOURNAMENT_TURN_WORKERS = int(os.getenv('TOURNAMENT_TURN_WORKERS', '3'))
+
+# --- 每日挑战 ---
+# 每日挑战排行榜显示的人数
+CHALLENGE_LEADERBOARD_SIZE = int(os.getenv('CHALLENGE_LEADERBOARD_SIZE', '20'))
+
+# --- 数据导出 ---
+# 导出时每批读取的行数（按主键分批，内存占用与表的大小无关）
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+
+# --- AI 接口准入控制 ---
+# 限流状态和并发名额都保存在本机共享目录中，同一台机器上的所有 Web 进程共用
+ADMISSION_STATE_DIR = os.getenv('ADMISSION_STATE_DIR', str(BASE_DIR / '.admission'))
+# 每个用户调用 AI 接口的速率（令牌桶，写法同 DRF：次数/时间单位）与突发上限
+AI_USER_RATE = os.getenv('AI_USER_RATE', '6/min')
+AI_USER_BURST = int(os.getenv('AI_USER_BURST', '3'))
+# 每个模型的全局调用速率，按 Ark 配额设置
+ARK_MODEL_RATES = {
+    'vision': os.getenv('ARK_VISION_RATE', '120/min'),
+    'image_generation': os.getenv('ARK_IMAGE_RATE', '240/min'),
+}
+# 所有 Web 进程合计同时处理的 AI 请求数、每个进程的等待队列长度和最长排队时间（秒）
+AI_MAX_CONCURRENT = int(os.getenv('AI_MAX_CONCURRENT', '8'))
+AI_MAX_QUEUE = int(os.getenv('AI_MAX_QUEUE', '8'))
+AI_QUEUE_TIMEOUT = float(os.getenv('AI_QUEUE_TIMEOUT', '10'))
+
+# --- 上游 AI 调用调度（见 gamecore/scheduling.py） ---
+# 每个进程同时进行的识图、文生图调用数；0 表示不调度。按 Ark 并发配额除以 Web 进程数设置
+UPSTREAM_MAX_CONCURRENT = int(os.getenv('UPSTREAM_MAX_CONCURRENT', '8'))
+# 各通道最多占用的名额比例：玩家回合 > 开局后的投机执行 > 锦标赛预先计算、每日挑战发布
+UPSTREAM_LANE_SHARES = {
+    'interactive': float(os.getenv('UPSTREAM_INTERACTIVE_SHARE', '1.0')),
+    'speculative': float(os.getenv('UPSTREAM_SPECULATIVE_SHARE', '0.5')),
+    'batch': float(os.getenv('UPSTREAM_BATCH_SHARE', '0.25')),
+}
+
+# 缓存配置：'admission' 缓存存放令牌桶状态，使用文件缓存以便多个进程共享
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'admission': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(ADMISSION_STATE_DIR, 'cache'),
+    },
+    # 开局后预先执行的 AI 一方的结果（见 gamecore/speculation.py），同一台机器上的所有进程共享
+    'speculation': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(ADMISSION_STATE_DIR, 'speculation'),
+    },
+}
+
+# --- 指标与追踪 ---
+# 访问 /metrics 所需的令牌（留空则不校验，生产环境建议配置或在 Nginx 中限制访问）
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# 是否把每个请求各阶段的耗时输出为一行 JSON 日志（gamecore.trace）
+METRICS_TRACE_LOG = os.getenv('METRICS_TRACE_LOG', 'False') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'gamecore.trace': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # --- django-allauth 配置 ---
 SITE_ID = 1
 
@@ -189,10 +368,16 @@ ACCOUNT_SIGNUP_FIELDS = ['email*', 'username*', 'password1*', 'password2*']
 # 在开发阶段，我们暂时关闭邮件验证流程
 ACCOUNT_EMAIL_VERIFICATION = 'none'
 
+# Token 认证缓存的容量（条）与过期时间（秒）。
+# 登出和停用用户会立即清除当前进程的缓存，其他进程最多在过期时间之后失效。
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', '10000'))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv('AUTH_TOKEN_CACHE_TTL', '60'))
+
 # 配置 dj-rest-auth 认证方式为 token 认证
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        # 带进程内缓存的 TokenAuthentication，见 gamecore/authentication.py
+        'gamecore.authentication.CachedTokenAuthentication',
     ],
     # 配置 API 文档生成工具
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
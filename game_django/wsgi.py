@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "game_django.settings")
 
 application = get_wsgi_application()
+
+# 服务启动时就创建 CLIP 打分进程池并加载模型（SCORING_WORKERS = 0 时不做任何事）
+from gamecore import scoring  # noqa: E402
+
+scoring.start()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import GameRound, GameEvent # 从当前应用的 models.py 文件中导入 GameRound 模型
+from .models import GameRound, GameEvent, TournamentSession, DailyChallenge # 从当前应用的 models.py 文件中导入 GameRound 模型
 
 # 使用 @admin.register(GameRound) 装饰器来注册模型，这是更现代的写法
 @admin.register(GameRound)
@@ -30,4 +30,17 @@ class GameRoundAdmin(admin.ModelAdmin):
 @admin.register(GameEvent)
 class GameEventAdmin(admin.ModelAdmin):
     list_display = ('timestamp', 'event_type', 'user', 'session_id')
-    list_filter = ('event_type', 'user')
\ No newline at end of file
+    list_filter = ('event_type', 'user')
+
+# 注册锦标赛模型
+@admin.register(TournamentSession)
+class TournamentSessionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'round_count', 'rounds_played', 'winner', 'created_at')
+    list_filter = ('status', 'winner')
+    search_fields = ('user__username',)
+
+# 注册每日挑战模型
+@admin.register(DailyChallenge)
+class DailyChallengeAdmin(admin.ModelAdmin):
+    list_display = ('date', 'ai_similarity_score', 'play_count', 'created_at')
+    exclude = ('original_embedding',)
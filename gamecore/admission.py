@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+try:
+    import fcntl  # 仅 POSIX 系统可用，用于跨进程的文件锁
+except ImportError:
+    fcntl = None
+
+
+class ServiceOverloaded(APIException):
+    """
+    服务过载时快速拒绝请求，返回 503 并通过 Retry-After 告诉客户端多久后重试。
+    DRF 的异常处理器会把 wait 属性写入 Retry-After 响应头。
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'AI 服务繁忙，请稍后重试。'
+    default_code = 'service_overloaded'
+
+    def __init__(self, detail=None, wait=None):
+        super().__init__(detail)
+        self.wait = math.ceil(wait) if wait else None
+
+
+class UpstreamTimeout(APIException):
+    """
+    请求的端到端时间预算在等待上游 AI 服务时耗尽。
+    """
+    status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail = 'AI 服务响应超时，请稍后重试。'
+    default_code = 'upstream_timeout'
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    """
+    解析 '10/min' 这样的速率字符串（与 DRF 的写法一致），返回 (次数, 秒数)。
+    """
+    num, period = rate.split('/')
+    duration = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+    return int(num), duration
+
+
+# --- 跨进程文件锁 ---
+# 所有 Web 进程共享同一个本地目录（ADMISSION_STATE_DIR）中的锁文件。
+# 文件锁在进程退出时由操作系统自动释放，不会因为进程崩溃而泄漏名额。
+# 没有 fcntl 的平台（Windows）退化为进程内的线程锁。
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _lock_path(name: str) -> str:
+    os.makedirs(settings.ADMISSION_STATE_DIR, exist_ok=True)
+    return os.path.join(settings.ADMISSION_STATE_DIR, f"{name}.lock")
+
+
+@contextmanager
+def _exclusive(name: str):
+    """
+    以阻塞方式独占一个命名锁。
+    """
+    if fcntl is None:
+        with _thread_locks_guard:
+            lock = _thread_locks.setdefault(name, threading.Lock())
+        with lock:
+            yield
+        return
+
+    with open(_lock_path(name), 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# --- 令牌桶 ---
+
+class TokenBucket:
+    """
+    令牌桶限流。桶的状态 (剩余令牌数, 上次更新时间) 存在 'admission' 缓存中，
+    更新时持有按 key 分片的文件锁，因此多个 Web 进程看到的是同一个桶。
+    """
+    LOCK_STRIPES = 64
+
+    def __init__(self, rate: str, burst: int | None = None):
+        num, duration = parse_rate(rate)
+        self.refill_per_second = num / duration
+        self.capacity = burst or num
+
+    def _lock_name(self, key: str) -> str:
+        stripe = int(hashlib.sha1(key.encode()).hexdigest(), 16) % self.LOCK_STRIPES
+        return f"bucket-{stripe}"
+
+    def _store(self, cache, key: str, tokens: float, now: float) -> None:
+        # 桶回满所需的时间之后，缓存条目自然过期即可
+        timeout = math.ceil(self.capacity / self.refill_per_second) + 1
+        cache.set(key, (tokens, now), timeout=timeout)
+
+    def consume(self, key: str, cost: int = 1) -> float:
+        """
+        尝试从桶中取出 cost 个令牌。成功返回 0，失败返回需要等待的秒数（不扣除令牌）。
+        """
+        cache = caches['admission']
+        with _exclusive(self._lock_name(key)):
+            now = time.time()
+            tokens, updated_at = cache.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+            if tokens < cost:
+                return (cost - tokens) / self.refill_per_second
+            self._store(cache, key, tokens - cost, now)
+            return 0
+
+    def refund(self, key: str, cost: int = 1) -> None:
+        """
+        归还 cost 个令牌（不超过桶的容量），用于已经扣除、但最终没有发起对应调用的情况。
+        """
+        cache = caches['admission']
+        with _exclusive(self._lock_name(key)):
+            now = time.time()
+            tokens, updated_at = cache.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second + cost)
+            self._store(cache, key, tokens, now)
+
+
+def model_bucket(model: str) -> TokenBucket:
+    """
+    保护 Ark 配额的按模型全局令牌桶（速率见 ARK_MODEL_RATES）。
+    """
+    return TokenBucket(settings.ARK_MODEL_RATES[model])
+
+
+def consume_model_quota(calls: dict[str, int]) -> float:
+    """
+    按 calls（模型 -> 调用次数）从各模型的全局令牌桶中取出令牌。
+    全部成功返回 0；任何一个桶不足时归还已经取出的令牌，返回需要等待的秒数。
+    """
+    taken = {}
+    for model, cost in calls.items():
+        if not cost:
+            continue
+        wait = model_bucket(model).consume(f"ai-model:{model}", cost)
+        if wait:
+            refund_model_quota(taken)
+            return wait
+        taken[model] = cost
+    return 0
+
+
+def refund_model_quota(calls: dict[str, int]) -> None:
+    """
+    把 calls 对应的令牌还给各模型的全局令牌桶。
+    """
+    for model, cost in calls.items():
+        if cost:
+            model_bucket(model).refund(f"ai-model:{model}", cost)
+
+
+# --- 并发闸门 ---
+
+class ConcurrencyGate:
+    """
+    跨进程的并发上限：在共享目录中放置 capacity 个名额锁文件，持有其中一个文件锁即占用一个名额。
+    拿不到名额的请求在有界队列中等待，队列已满或等待超时都立即以 503 拒绝，
+    这样过载时尾延迟是有界的，而不是所有请求一起排队直到超时。
+    """
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, name: str, capacity: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.capacity = capacity
+        self.queue_timeout = queue_timeout
+        # 每个进程内的等待队列长度上限
+        self._queue_slots = threading.BoundedSemaphore(max_queue)
+        # 没有 fcntl 时退化为进程内的信号量
+        self._local_slots = threading.BoundedSemaphore(capacity) if fcntl is None else None
+
+    def _try_acquire(self):
+        if self._local_slots is not None:
+            return self if self._local_slots.acquire(blocking=False) else None
+        for index in range(self.capacity):
+            f = open(_lock_path(f"{self.name}-slot-{index}"), 'a+')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except BlockingIOError:
+                f.close()
+        return None
+
+    def _release(self, slot):
+        if self._local_slots is not None:
+            self._local_slots.release()
+            return
+        fcntl.flock(slot, fcntl.LOCK_UN)
+        slot.close()
+
+    @contextmanager
+    def slot(self):
+        slot = self._try_acquire()
+        if slot is None:
+            # 需要排队：先占一个等待位，等待位也满了就立即拒绝
+            if not self._queue_slots.acquire(blocking=False):
+                raise ServiceOverloaded(wait=self.queue_timeout)
+            try:
+                deadline = time.monotonic() + self.queue_timeout
+                while slot is None:
+                    if time.monotonic() >= deadline:
+                        raise ServiceOverloaded(wait=self.queue_timeout)
+                    time.sleep(self.POLL_INTERVAL)
+                    slot = self._try_acquire()
+            finally:
+                self._queue_slots.release()
+        try:
+            yield
+        finally:
+            self._release(slot)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """
+        slot 的异步版本：排队时用 asyncio.sleep 轮询，等待期间不占用线程。
+        """
+        slot = self._try_acquire()
+        if slot is None:
+            if not self._queue_slots.acquire(blocking=False):
+                raise ServiceOverloaded(wait=self.queue_timeout)
+            try:
+                deadline = time.monotonic() + self.queue_timeout
+                while slot is None:
+                    if time.monotonic() >= deadline:
+                        raise ServiceOverloaded(wait=self.queue_timeout)
+                    await asyncio.sleep(self.POLL_INTERVAL)
+                    slot = self._try_acquire()
+            finally:
+                self._queue_slots.release()
+        try:
+            yield
+        finally:
+            self._release(slot)
+
+
+_gates = {}
+_gates_guard = threading.Lock()
+
+
+def gate(name: str = 'ai') -> ConcurrencyGate:
+    """
+    获取指定名称的并发闸门（每个进程内每个名称只创建一次）。
+    """
+    with _gates_guard:
+        if name not in _gates:
+            _gates[name] = ConcurrencyGate(
+                name,
+                capacity=settings.AI_MAX_CONCURRENT,
+                max_queue=settings.AI_MAX_QUEUE,
+                queue_timeout=settings.AI_QUEUE_TIMEOUT,
+            )
+        return _gates[name]
@@ -1,18 +1,35 @@
+import asyncio
 import os
-import requests
-from PIL import Image
-from io import BytesIO
+import random
+import threading
+import weakref
+import numpy as np
 import traceback
 
-from volcenginesdkarkruntime import Ark
-from sentence_transformers import SentenceTransformer, util
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from volcenginesdkarkruntime import Ark, AsyncArk
+from volcenginesdkarkruntime._exceptions import ArkAPIConnectionError, ArkAPIStatusError
+
+from . import image_processing
+from . import metrics
+from . import resilience
+from . import scheduling
+from . import scoring
+from .resilience import CircuitOpenError, Deadline, DeadlineExceeded
 
 # --- 全局初始化 ---
 try:
     ARK_API_KEY = os.getenv('ARK_API_KEY')
     if not ARK_API_KEY:
         print("警告：未在环境变量中找到 ARK_API_KEY。豆包 API 将无法工作。")
-    client = Ark(api_key=ARK_API_KEY)
+    # 重试由 resilience 模块统一负责，关闭 SDK 自带的重试，避免重试次数相乘。
+    # ARK_BASE_URL 可以指向本地的故障注入桩服务（python manage.py run_stub_ark）。
+    client = Ark(
+        base_url=settings.ARK_BASE_URL,
+        api_key=ARK_API_KEY,
+        max_retries=0,
+    )
     vision_model = "doubao-seed-1.6-250615"
     image_generation_model = "doubao-seedream-3-0-t2i-250415"
     print("客户端已成功配置。")
@@ -20,116 +37,366 @@ except Exception as e:
     client = None
     print(f"客户端配置时发生错误: {e}")
 
-try:
-    clip_model = SentenceTransformer('clip-ViT-B-32')
-    print("CLIP 图像相似度模型 'clip-ViT-B-32' 已成功加载。")
-except Exception as e:
-    clip_model = None
-    print(f"加载 CLIP 模型时发生错误: {e}")
+# 模型名称同时作为得分的版本号记录在 GameRound.score_model 中，更换模型后可用 rescore_rounds 命令重新打分
+clip_model_name = settings.CLIP_MODEL_NAME
+# 本进程中的 CLIP 模型，第一次在本进程中打分时才加载（见 get_clip_model）。
+# 启用打分进程池（SCORING_WORKERS > 0）时模型只在打分进程中加载，Web 进程不加载。
+# 测试和压测可以直接把它替换为替身模型，此时总是在本进程中使用替身模型打分。
+clip_model = None
+_clip_load_attempted = False
+_clip_lock = threading.Lock()
+
+
+def get_clip_model():
+    """
+    返回本进程中的 CLIP 模型，第一次调用时加载；加载失败返回 None（之后不再重试）。
+    """
+    global clip_model, _clip_load_attempted
+    if clip_model is not None or _clip_load_attempted:
+        return clip_model
+    with _clip_lock:
+        if clip_model is None and not _clip_load_attempted:
+            _clip_load_attempted = True
+            try:
+                from sentence_transformers import SentenceTransformer
+                clip_model = SentenceTransformer(clip_model_name)
+                print(f"CLIP 图像相似度模型 '{clip_model_name}' 已成功加载。")
+            except Exception as e:
+                print(f"加载 CLIP 模型时发生错误: {e}")
+    return clip_model
+
+
+def _use_scoring_pool() -> bool:
+    return clip_model is None and scoring.enabled()
+
+
+# --- 异步客户端（ASGI 模式） ---
+# AsyncArk 内部的连接池绑定在事件循环上，按事件循环分别创建；
+# 以 (base_url, api_key) 区分，便于压测时临时指向本地桩服务。
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncArk | None:
+    if not client:
+        return None
+    loop = asyncio.get_running_loop()
+    key = (settings.ARK_BASE_URL, ARK_API_KEY)
+    cached = _async_clients.get(loop)
+    if cached is None or cached[0] != key:
+        cached = _async_clients[loop] = (key, AsyncArk(base_url=key[0], api_key=key[1], max_retries=0))
+    return cached[1]
 
 
 # --- 服务函数定义 ---
 
-def get_ai_prompt_from_image(image_url: str, language: str = 'en', char_limit: int = 20) -> str | None:
+def _is_transient_ark_error(error: Exception) -> bool:
+    """
+    判断 Ark 调用的错误是否值得重试：连接错误、超时、429 限流和 5xx 服务端错误。
+    """
+    if isinstance(error, ArkAPIStatusError):
+        return error.status_code in (408, 429) or error.status_code >= 500
+    return isinstance(error, (ArkAPIConnectionError, TimeoutError, ConnectionError))
+
+
+def random_start_prompt() -> str:
+    """
+    随机开局时用于生成原图的提示词：随机组合风格、主题、媒介和情绪。
+    """
+    styles = [
+        "写实", "抽象", "印象派", "超现实主义", "复古", "现代", "简约",
+        "时尚", "浪漫", "暗黑", "梦幻", "蒸汽朋克", "赛博朋克"
+    ]
+    subjects = [
+        "自然风光", "城市街景", "建筑奇观", "动物世界", "美食佳肴",
+        "时尚穿搭", "历史场景", "科技产品", "运动瞬间", "节日庆典",
+        "人物肖像", "静物特写", "抽象图案"
+    ]
+    mediums = [
+        "油画", "水彩画", "丙烯画", "素描", "数字绘画", "摄影作品",
+        "3D 渲染", "插画", "拼贴画", "版画"
+    ]
+    moods = [
+        "欢快", "宁静", "神秘", "温馨", "悲伤", "震撼", "幽默",
+        "优雅", "紧张", "浪漫", "孤独", "励志"
+    ]
+
+    random_style = random.choice(styles)
+    random_subject = random.choice(subjects)
+    random_medium = random.choice(mediums)
+    random_mood = random.choice(moods)
+
+    return (
+        f"一张{random_style}风格的{random_subject}主题{random_medium}作品，传达出{random_mood}的情绪，画面细节和构图随机"
+    )
+
+
+def _vision_messages(image_url: str, language: str, char_limit: int) -> list[dict]:
+    """
+    构建识图请求的消息体（同步和异步版本共用）。
+    """
+    if language == 'en':
+        prompt_instruction = f"You are an expert at writing descriptive prompts for text - to - image AI models. You have {char_limit} characters to describe the following image. Describe the image with strictly under {char_limit} characters. "
+    else:
+        prompt_instruction = f"你是一位为文生图 AI 模型撰写描述性提示词的专家。请严格在 {char_limit} 个字符内描述该图片。"
+
+    # 构建符合豆包API要求的、使用 image_url 的请求体
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": image_url}},
+                {"type": "text", "text": prompt_instruction}
+            ]
+        }
+    ]
+
+
+def _print_service_error(function_name: str, e: Exception):
+    print("=" * 80)
+    print(f"!!!!!! AI SERVICE CRITICAL ERROR in {function_name} !!!!!!")
+    print(f"Error Type: {type(e).__name__}")
+    print(f"Error Message: {e}")
+    traceback.print_exc()
+    print("=" * 80)
+
+
+def get_ai_prompt_from_image(image_url: str, language: str = 'en', char_limit: int = 20,
+                             deadline: Deadline | None = None) -> str | None:
     """
     调用豆包API，根据图片URL和指定语言生成描述性提示词。
     （已还原为使用 image_url 的正确版本）
+    deadline 为本次调用可用的时间预算；熔断器打开时抛出 CircuitOpenError。
     """
     if not client:
         return "[错误：客户端未初始化]"
 
     try:
-        if language == 'en':
-            prompt_instruction = f"You are an expert at writing descriptive prompts for text - to - image AI models. You have {char_limit} characters to describe the following image. Describe the image with strictly under {char_limit} characters. "
-        else:
-            prompt_instruction = f"你是一位为文生图 AI 模型撰写描述性提示词的专家。请严格在 {char_limit} 个字符内描述该图片。"
-
-        # 构建符合豆包API要求的、使用 image_url 的请求体
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image_url", "image_url": {"url": image_url}},
-                    {"type": "text", "text": prompt_instruction}
-                ]
-            }
-        ]
-        response = client.chat.completions.create(
-            model=vision_model,
-            messages=messages,
-            timeout=180.0
-        )
+        messages = _vision_messages(image_url, language, char_limit)
+        # 先按通道和用户排队占用上游调用名额（见 scheduling.py），排队时间不计入 vision 阶段
+        with scheduling.slot(deadline), metrics.timed('vision', vision_model):
+            response = resilience.call(
+                'vision',
+                lambda timeout: client.chat.completions.create(
+                    model=vision_model,
+                    messages=messages,
+                    timeout=timeout
+                ),
+                deadline=deadline,
+                is_transient=_is_transient_ark_error,
+                timeout=settings.ARK_TIMEOUT,
+                hedge='vision' in settings.ARK_HEDGE_OPERATIONS,
+            )
         return response.choices[0].message.content
 
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
     except Exception as e:
-        print("=" * 80)
-        print("!!!!!! AI SERVICE CRITICAL ERROR in get_ai_prompt_from_image !!!!!!")
-        print(f"Error Type: {type(e).__name__}")
-        print(f"Error Message: {e}")
-        traceback.print_exc()
-        print("=" * 80)
+        _print_service_error('get_ai_prompt_from_image', e)
         return None
 
 
-def get_image_from_prompt(prompt: str) -> str | None:
+def get_image_from_prompt(prompt: str, deadline: Deadline | None = None) -> str | None:
     """
     调用文生图模型，根据提示词生成图片， 并返回图片 URL。
+    deadline 为本次调用可用的时间预算；熔断器打开时抛出 CircuitOpenError。
     """
     if not client:
         return "[错误：客户端未初始化]"
     try:
-        response = client.images.generate(
-            model=image_generation_model,
-            prompt=prompt,
-            timeout=180.0
-        )
+        with scheduling.slot(deadline), metrics.timed('image_generation', image_generation_model):
+            response = resilience.call(
+                'image_generation',
+                lambda timeout: client.images.generate(
+                    model=image_generation_model,
+                    prompt=prompt,
+                    timeout=timeout
+                ),
+                deadline=deadline,
+                is_transient=_is_transient_ark_error,
+                timeout=settings.ARK_TIMEOUT,
+                hedge='image_generation' in settings.ARK_HEDGE_OPERATIONS,
+            )
         return response.data[0].url
 
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
     except Exception as e:
-        print("=" * 80)
-        print("!!!!!! AI SERVICE CRITICAL ERROR in get_image_from_prompt !!!!!!")
-        print(f"Error Type: {type(e).__name__}")
-        print(f"Error Message: {e}")
-        traceback.print_exc()
-        print("=" * 80)
+        _print_service_error('get_image_from_prompt', e)
         return None
 
 
-def calculate_image_similarity(image_url_1: str, image_url_2: str) -> float | None:
+def _image_bytes(source: str | bytes) -> bytes:
+    return source if isinstance(source, bytes) else image_processing.fetch_image_bytes(source)
+
+
+def calculate_image_similarity(image_1: str | bytes, image_2: str | bytes) -> float | None:
     """
-    使用本地加载的 CLIP 模型，计算两张图片的语义相似度。
+    使用 CLIP 模型计算两张图片的语义相似度。启用打分进程池时在打分进程中计算，否则使用本进程加载的模型。
+    参数可以是图片 URL，也可以是已经下载好的图片内容（避免重复下载）。
+    打分进程池忙（ScoringBusy、ScoringTimeout）时直接抛出，由视图返回 503，其他错误返回 None。
     """
-    if not clip_model:
+    use_pool = _use_scoring_pool()
+    if not use_pool and not get_clip_model():
         return 0.0
 
-    if not image_url_1 or not image_url_2:
+    if not image_1 or not image_2:
         return None
 
     try:
-        def load_and_preprocess_image(url: str) -> Image.Image:
-            with requests.get(url, stream=True, timeout=120) as response:
-                response.raise_for_status()
-                img = Image.open(BytesIO(response.content))
-                img = img.convert("RGB")
-                img = img.resize((224, 224))
-                return img
+        image_1 = _image_bytes(image_1)
+        image_2 = _image_bytes(image_2)
 
-        image_1 = load_and_preprocess_image(image_url_1)
-        image_2 = load_and_preprocess_image(image_url_2)
+        with metrics.timed('clip_encode', clip_model_name):
+            if use_pool:
+                return scoring.run(scoring.similarity_task, image_1, image_2)
+            return scoring.similarity_with(clip_model, image_1, image_2)
 
-        if not image_1 or not image_2:
-            return None
+    except (scoring.ScoringBusy, scoring.ScoringTimeout):
+        raise
+    except Exception as e:
+        print(f"计算图片相似度时发生错误: {e}")
+        traceback.print_exc()
+        return None
 
-        embeddings = clip_model.encode(
-            [image_1, image_2],
-            convert_to_tensor=True,
-        )
-        cosine_scores = util.cos_sim(embeddings[0], embeddings[1])
-        similarity_score = cosine_scores.item() * 100
 
-        return round(max(0.0, min(similarity_score, 100.0)), 2)
 
+def encode_images(images: list[str | bytes], model=None, batch_size: int | None = None) -> np.ndarray | None:
+    """
+    用一次 encode 调用批量计算多张图片的 CLIP 嵌入，返回 L2 归一化后的 float32 矩阵（每行一张图片）。
+    批量编码比逐对调用 calculate_image_similarity 少了重复的原图编码，也能更好地利用矩阵运算。
+    model 默认为当前的 CLIP 模型（启用打分进程池时在打分进程中编码；重新打分时可以传入新模型，在本进程中编码）；
+    batch_size 默认把所有图片放进同一批。CLIP 模型未加载时返回 None。
+    """
+    if model is None and images and _use_scoring_pool():
+        contents = [_image_bytes(image) for image in images]
+        with metrics.timed('clip_encode', clip_model_name):
+            return scoring.run(scoring.encode_task, contents, batch_size)
+
+    model = model or get_clip_model()
+    if not model or not images:
+        return None
+    contents = [_image_bytes(image) for image in images]
+    with metrics.timed('clip_encode', clip_model_name if model is clip_model else type(model).__name__):
+        return scoring.encode_with(model, contents, batch_size)
+
+
+def score_tag(model_name: str) -> str:
+    """
+    写入 score_model / embedding_model 的标记：模型名称加上打分输入的版本（image_processing.SCORE_INPUT_VERSION）。
+    模型或打分输入任何一个变化，得分都不再直接可比，需要重新打分。
+    """
+    return f"{model_name}/{image_processing.SCORE_INPUT_VERSION}"
+
+
+def score_model_name() -> str:
+    """
+    当前打分使用的模型和输入版本（见 score_tag），写入 GameRound.score_model。CLIP 模型未加载（得分恒为 0）时为空字符串。
+    """
+    if _use_scoring_pool():
+        # 以打分进程报告的状态为准；还没有打分进程确认模型已加载时按未加载处理，
+        # 这样模型加载失败时记录的 0 分回合不会被标记为已打分，之后仍会被 rescore_rounds 重新计算
+        return score_tag(clip_model_name) if scoring.model_loaded else ''
+    return score_tag(clip_model_name) if get_clip_model() else ''
+
+
+def similarity_from_embeddings(embedding_1: np.ndarray, embedding_2: np.ndarray) -> float:
+    """
+    由两个归一化的嵌入计算相似度得分，换算方式与 calculate_image_similarity 一致（余弦相似度 x 100，截断到 0~100）。
+    """
+    similarity_score = float(np.dot(embedding_1, embedding_2)) * 100
+    return round(max(0.0, min(similarity_score, 100.0)), 2)
+
+# --- 异步版本（ASGI 模式下的异步视图使用） ---
+
+async def aget_ai_prompt_from_image(image_url: str, language: str = 'en', char_limit: int = 20,
+                                    deadline: Deadline | None = None) -> str | None:
+    """
+    get_ai_prompt_from_image 的异步版本，等待上游响应时不占用线程。
+    """
+    async_client = get_async_client()
+    if not async_client:
+        return "[错误：客户端未初始化]"
+    try:
+        messages = _vision_messages(image_url, language, char_limit)
+        async with scheduling.aslot(deadline):
+            with metrics.timed('vision', vision_model):
+                response = await resilience.acall(
+                    'vision',
+                    lambda timeout: async_client.chat.completions.create(
+                        model=vision_model,
+                        messages=messages,
+                        timeout=timeout
+                    ),
+                    deadline=deadline,
+                    is_transient=_is_transient_ark_error,
+                    timeout=settings.ARK_TIMEOUT,
+                    hedge='vision' in settings.ARK_HEDGE_OPERATIONS,
+                )
+        return response.choices[0].message.content
+
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        _print_service_error('aget_ai_prompt_from_image', e)
+        return None
+
+
+async def aget_image_from_prompt(prompt: str, deadline: Deadline | None = None) -> str | None:
+    """
+    get_image_from_prompt 的异步版本。
+    """
+    async_client = get_async_client()
+    if not async_client:
+        return "[错误：客户端未初始化]"
+    try:
+        async with scheduling.aslot(deadline):
+            with metrics.timed('image_generation', image_generation_model):
+                response = await resilience.acall(
+                    'image_generation',
+                    lambda timeout: async_client.images.generate(
+                        model=image_generation_model,
+                        prompt=prompt,
+                        timeout=timeout
+                    ),
+                    deadline=deadline,
+                    is_transient=_is_transient_ark_error,
+                    timeout=settings.ARK_TIMEOUT,
+                    hedge='image_generation' in settings.ARK_HEDGE_OPERATIONS,
+                )
+        return response.data[0].url
+
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        _print_service_error('aget_image_from_prompt', e)
+        return None
+
+
+async def acalculate_image_similarity(image_1: str | bytes, image_2: str | bytes) -> float | None:
+    """
+    calculate_image_similarity 的异步版本：CLIP 编码是 CPU 密集的计算，启用打分进程池时直接等待打分进程的结果，
+    否则放到线程中执行，不阻塞事件循环。传入 URL 时先异步下载，下载失败与同步版本一样返回 None。
+    """
+    if not image_1 or not image_2:
+        return None
+    try:
+        if isinstance(image_1, str):
+            image_1 = await image_processing.afetch_image_bytes(image_1)
+        if isinstance(image_2, str):
+            image_2 = await image_processing.afetch_image_bytes(image_2)
     except Exception as e:
         print(f"计算图片相似度时发生错误: {e}")
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+    if not _use_scoring_pool():
+        return await sync_to_async(calculate_image_similarity, thread_sensitive=False)(image_1, image_2)
+
+    try:
+        with metrics.timed('clip_encode', clip_model_name):
+            return await scoring.arun(scoring.similarity_task, image_1, image_2)
+    except (scoring.ScoringBusy, scoring.ScoringTimeout):
+        raise
+    except Exception as e:
+        print(f"计算图片相似度时发生错误: {e}")
+        traceback.print_exc()
+        return None
@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class GamecoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "gamecore"
+
+    def ready(self):
+        # 统计数据库连接的建立次数，并注册连接池占用的指标
+        from . import db
+        connection_created.connect(db.on_connection_created)
+
+        # token 被删除（登出）或用户被修改（停用）时清除 token 认证缓存
+        from rest_framework.authtoken.models import Token
+        from . import authentication
+        post_delete.connect(authentication.invalidate_token, sender=Token)
+        post_save.connect(authentication.on_user_saved, sender=settings.AUTH_USER_MODEL)
+        post_delete.connect(authentication.invalidate_user, sender=settings.AUTH_USER_MODEL)
+
+        # 创建或删除游戏回合时更新用户的战绩汇总
+        from . import stats
+        from .models import GameRound
+        post_save.connect(stats.on_round_saved, sender=GameRound)
+        post_delete.connect(stats.on_round_deleted, sender=GameRound)
@@ -0,0 +1,340 @@
+"""
+gamecore API 的异步视图，供 ASGI 部署（uvicorn）使用，设置 GAMECORE_ASYNC_VIEWS=True 后由 urls.py 启用。
+目前覆盖开局、回合、历史记录、排行榜和埋点接口；锦标赛、每日挑战、用户统计和数据导出接口仍是同步视图，
+ASGI 部署时由 Django 放到线程中执行。
+
+与 views.py 中的同步视图接口和返回结果完全一致，区别在于：
+- 调用 Ark、下载图片时使用异步客户端，等待上游响应期间不占用线程；
+- 一个回合中互不依赖的步骤并发执行（玩家生图与 AI 识图+生图、三张图片的下载）；
+- 数据库读写使用 Django 的异步 ORM（acreate、async for）；
+- CLIP 编码、生成衍生图等 CPU 密集的步骤放到线程中执行，不阻塞事件循环。
+
+依赖 adrf（DRF 的异步视图扩展）：pip install adrf
+"""
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from adrf.views import APIView
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import status
+from rest_framework.parsers import FormParser, JSONParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from . import ai_services
+from . import image_processing
+from . import metrics
+from . import mirroring
+from . import scheduling
+from . import speculation
+from .admission import gate, refund_model_quota, ServiceOverloaded
+from .throttles import refund_admission
+from .models import GameRound, GameEvent, decide_winner
+from .resilience import CircuitOpenError, Deadline, DeadlineExceeded
+from .serializers import PlayerTurnInputSerializer, GameRoundResultSerializer, GameStartSerializer, GameEventSerializer
+from .uploads import StreamingImageMultiPartParser
+from .fast_serializers import game_round_rows, leaderboard_rows
+from .views import FAST_RENDERER_CLASSES, AIUpstreamMixin, leaderboard_queryset, round_renditions, \
+    start_game_upstream_calls
+
+
+async def gather_or_cancel(*aws):
+    """
+    并发执行多个协程并按顺序返回结果；任何一个抛出异常时取消其余的协程，不让它们在后台继续消耗配额。
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def parsed_data(request):
+    """
+    在线程中解析请求体：multipart 上传需要把文件写入临时文件，不应阻塞事件循环。
+    """
+    return await sync_to_async(lambda: request.data, thread_sensitive=False)()
+
+
+class AsyncInstrumentedViewMixin:
+    """
+    InstrumentedViewMixin 的异步版本。追踪在事件循环所在的上下文中开始和结束，
+    认证、限流等在线程中执行的步骤记录的阶段也会汇总到同一个追踪里。
+    """
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        trace = metrics.start_trace()
+        response = await super().async_dispatch(request, *args, **kwargs)
+        # 只读取已经认证好的用户，避免在事件循环中触发认证（认证需要查询数据库）
+        user = getattr(self.request, '_user', None)
+        metrics.finish_trace(
+            trace,
+            view=type(self).__name__,
+            status_code=response.status_code,
+            user=getattr(user, 'pk', None),
+        )
+        return response
+
+
+class AsyncAIAdmissionMixin(AIUpstreamMixin):
+    """
+    AIAdmissionMixin 的异步版本：令牌桶限流仍在 initial 中完成，
+    并发名额由处理函数通过 admission_slot() 异步获取，排队等待期间不占用线程。
+    """
+
+    @asynccontextmanager
+    async def admission_slot(self, request):
+        async with AsyncExitStack() as stack:
+            if any(self.get_upstream_calls(request).values()):
+                try:
+                    with metrics.timed('admission_wait'):
+                        await stack.enter_async_context(gate('ai').aslot())
+                except ServiceOverloaded:
+                    # 拿不到名额时归还限流扣除的令牌
+                    await sync_to_async(refund_admission)(request)
+                    raise
+                # 本次请求发起的上游调用按玩家回合的优先级、以当前用户排队（见 scheduling.py）
+                stack.enter_context(scheduling.lane(scheduling.INTERACTIVE, user=request.user.pk))
+            yield
+
+
+class AsyncStartGameAPIView(AsyncInstrumentedViewMixin, AsyncAIAdmissionMixin, APIView):
+    """
+    StartGameAPIView 的异步版本。
+    """
+    parser_classes = [StreamingImageMultiPartParser, FormParser, JSONParser]
+    permission_classes = [IsAuthenticated]
+
+    def get_upstream_calls(self, request):
+        return start_game_upstream_calls(request)
+
+    async def post(self, request, *args, **kwargs):
+        serializer = GameStartSerializer(data=await parsed_data(request))
+        if not await sync_to_async(serializer.is_valid, thread_sensitive=False)():
+            # 在线程中归还限流扣除的令牌，finalize_response 看到已经归还后不会重复处理
+            await sync_to_async(refund_admission, thread_sensitive=False)(request)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        uploaded_image = serializer.validated_data.get('uploaded_image')
+
+        async with self.admission_slot(request):
+            try:
+                if uploaded_image:
+                    if hasattr(uploaded_image, 'temporary_file_path'):
+                        image_source = uploaded_image.temporary_file_path()
+                    else:
+                        uploaded_image.seek(0)
+                        image_source = uploaded_image.read()
+                else:
+                    deadline = Deadline(settings.TURN_DEADLINE)
+                    image_url_from_ai = await ai_services.aget_image_from_prompt(
+                        ai_services.random_start_prompt(), deadline=deadline.split(0.85)
+                    )
+                    if not image_url_from_ai:
+                        return Response(
+                            {"error": "Failed to generate image from AI."},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                        )
+                    image_source = await image_processing.afetch_image_bytes(
+                        image_url_from_ai, deadline=deadline
+                    )
+
+                saved_paths = await image_processing.asave_renditions(image_source)
+                renditions = {
+                    name: image_processing.media_url(path, request) for name, path in saved_paths.items()
+                }
+                await sync_to_async(speculation.start, thread_sensitive=False)(
+                    renditions[image_processing.MAIN_RENDITION],
+                    serializer.validated_data['language'],
+                    serializer.validated_data['char_limit'],
+                    user=request.user.pk,
+                )
+                return Response(
+                    {
+                        "original_image_url": renditions[image_processing.MAIN_RENDITION],
+                        "renditions": renditions,
+                    },
+                    status=status.HTTP_200_OK
+                )
+
+            except (CircuitOpenError, DeadlineExceeded):
+                raise
+            except Exception as e:
+                return Response({"error": f"An error occurred while processing the image: {str(e)}"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AsyncPlayTurnAPIView(AsyncInstrumentedViewMixin, AsyncAIAdmissionMixin, APIView):
+    """
+    PlayTurnAPIView 的异步版本。玩家生图与 AI 的识图+生图互不依赖，并发执行，
+    一个回合的耗时从三次上游调用之和缩短为两条分支中较慢的一条。
+    """
+    permission_classes = [IsAuthenticated]
+    upstream_calls = {'vision': 1, 'image_generation': 2}
+    serializer_class = PlayerTurnInputSerializer
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=await parsed_data(request))
+        if not await sync_to_async(serializer.is_valid, thread_sensitive=False)():
+            await sync_to_async(refund_admission, thread_sensitive=False)(request)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        validated_data = serializer.validated_data
+        original_image_url = validated_data['original_image_url']
+        player_prompt = validated_data['player_prompt']
+        language = validated_data['language']
+        char_limit = validated_data['char_limit']
+
+        async with self.admission_slot(request):
+            deadline = Deadline(settings.TURN_DEADLINE)
+
+            async def ai_turn():
+                # AI 回合：开局时已经在后台执行过的，直接取结果；否则识图 -> 生图，两步有先后依赖
+                speculated = await speculation.aclaim(
+                    original_image_url, language, char_limit,
+                    wait=min(settings.SPECULATION_WAIT, deadline.remaining() * 0.5)
+                )
+                if speculated:
+                    # AI 一方的调用已经在开局时计入，归还本回合多扣的令牌
+                    await sync_to_async(refund_model_quota, thread_sensitive=False)(speculation.AI_BRANCH_CALLS)
+                    return speculated['ai_generated_prompt_from_image'], speculated['ai_generated_image_url'], speculated
+                prompt = await ai_services.aget_ai_prompt_from_image(
+                    image_url=original_image_url,
+                    language=language,
+                    char_limit=char_limit,
+                    deadline=deadline.split(0.4)
+                )
+                if prompt is None:
+                    return None, None, None
+                return prompt, await ai_services.aget_image_from_prompt(prompt, deadline=deadline.split(0.85)), None
+
+            # 1 & 2. 玩家回合与 AI 回合并发执行
+            player_generated_image_url, (ai_prompt_from_image, ai_generated_image_url, speculated) = await gather_or_cancel(
+                ai_services.aget_image_from_prompt(player_prompt, deadline=deadline.split(0.85)),
+                ai_turn(),
+            )
+            if ai_prompt_from_image is None:
+                return Response(
+                    {"error": "AI failed to generate a prompt from the images. Check server logs for details."},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            if not all([player_generated_image_url, ai_generated_image_url]):
+                return Response(
+                    {"error": "AI failed to generate one or more images. Check server logs for details."},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+
+            # 3. 并发下载三张图片并计算相似度
+            original_renditions = await sync_to_async(
+                image_processing.rendition_urls_for, thread_sensitive=False
+            )(original_image_url)
+            scoring_image_url = original_renditions.get(image_processing.SCORE_RENDITION, original_image_url)
+            downloads = [
+                image_processing.afetch_image_bytes(scoring_image_url, deadline=deadline),
+                image_processing.afetch_image_bytes(player_generated_image_url, deadline=deadline),
+            ]
+            # 投机执行时 AI 图片已经打过分并转存到本站，不需要再下载
+            if not speculated:
+                downloads.append(
+                    image_processing.afetch_image_bytes(ai_generated_image_url, deadline=deadline)
+                )
+            try:
+                original_image_bytes, player_image_bytes, *rest = await gather_or_cancel(*downloads)
+                ai_image_bytes = rest[0] if rest else None
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                print(f"下载图片时发生错误: {e}")
+                return Response(
+                    {"error": "Failed to download images for scoring. Check server logs for details."},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+
+            if speculated:
+                player_similarity_score = await ai_services.acalculate_image_similarity(
+                    original_image_bytes, player_image_bytes
+                )
+                ai_similarity_score = speculated['ai_similarity_score']
+            else:
+                player_similarity_score, ai_similarity_score = await gather_or_cancel(
+                    ai_services.acalculate_image_similarity(original_image_bytes, player_image_bytes),
+                    ai_services.acalculate_image_similarity(original_image_bytes, ai_image_bytes),
+                )
+            if player_similarity_score is None or ai_similarity_score is None:
+                return Response(
+                    {"error": "Failed to calculate images similarity. Check server logs for details."},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+
+        # 4. 判定胜负（上游调用已经结束，先释放并发名额）
+        winner = decide_winner(player_similarity_score, ai_similarity_score)
+
+        # 5. 异步写入数据库
+        with metrics.timed('db_write'):
+            game_round = await GameRound.objects.acreate(
+                user=request.user,
+                original_image_url=original_image_url,
+                player_prompt=player_prompt,
+                player_generated_image_url=player_generated_image_url,
+                player_similarity_score=player_similarity_score,
+                ai_generated_prompt_from_image=ai_prompt_from_image,
+                ai_generated_image_url=ai_generated_image_url,
+                ai_similarity_score=ai_similarity_score,
+                winner=winner,
+                score_model=ai_services.score_model_name(),
+                image_renditions=round_renditions(original_renditions, speculated),
+            )
+
+        # 6. 后台转存生成的图片（提交到后台线程池，不等待）
+        if settings.MIRROR_GENERATED_IMAGES:
+            mirroring.schedule_mirror(game_round.id, {'player': player_image_bytes, 'ai': ai_image_bytes})
+
+        return Response(GameRoundResultSerializer(game_round).data, status=status.HTTP_201_CREATED)
+
+
+class AsyncGameRoundHistoryAPIView(AsyncInstrumentedViewMixin, APIView):
+    """
+    GameRoundHistoryAPIView 的异步版本，使用 async for 逐行读取查询结果。
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    async def get(self, request, *args, **kwargs):
+        queryset = GameRound.objects.filter(user=request.user).order_by('-timestamp')
+        return Response(await game_round_rows.aserialize_queryset(queryset))
+
+
+class AsyncLeaderboardAPIView(AsyncInstrumentedViewMixin, APIView):
+    """
+    LeaderboardAPIView 的异步版本。
+    """
+
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    async def get(self, request, *args, **kwargs):
+        rows = [row async for row in leaderboard_queryset()]
+        return Response(leaderboard_rows.serialize_dicts(rows))
+
+
+class AsyncGameEventAPIView(AsyncInstrumentedViewMixin, APIView):
+    """
+    GameEventAPIView 的异步版本。
+    """
+
+    async def post(self, request, *args, **kwargs):
+        serializer = GameEventSerializer(data=await parsed_data(request))
+        if await sync_to_async(serializer.is_valid, thread_sensitive=False)():
+            user = request.user if request.user.is_authenticated else None
+            session_id = request.session.session_key or ''
+            await GameEvent.objects.acreate(
+                user=user,
+                session_id=session_id,
+                event_type=serializer.data['event_type'],
+                event_data=serializer.data.get('event_data', {}),
+            )
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,83 @@
+"""
+带进程内缓存的 Token 认证。
+
+DRF 的 TokenAuthentication 每个请求都要联表查询一次 authtoken_token 和 auth_user，
+轮询历史记录这类接口的认证开销甚至超过业务查询本身。这里把 token -> (user, token)
+缓存在有容量上限、带过期时间的 TTLCache 中，命中时认证只是一次内存查找。
+
+缓存失效：
+- token 被删除（dj_rest_auth 登出会删除 token）时立即移除；
+- 用户修改密码（set_password 后保存，例如 dj_rest_auth 的修改密码接口）时吊销该用户的所有 token，
+  与 Django 修改密码后其他会话失效一致，之前发出的 token 立即不能再使用，需要重新登录；
+- 用户的 is_active 或密码变化（停用、改密码）时移除该用户的所有缓存条目，下次认证重新检查 is_active；
+  其他字段的修改（包括每次登录都会更新的 last_login）不影响缓存，缓存中的用户对象最多 AUTH_TOKEN_CACHE_TTL 秒后刷新；
+- 用户被删除时移除该用户的所有缓存条目；
+- 信号只能通知当前进程，其他工作进程最多在 AUTH_TOKEN_CACHE_TTL 秒后失效。
+
+已知的缺口：QuerySet.update()（例如 User.objects.filter(...).update(is_active=False)）和原生 SQL 不发送信号，
+这样批量停用用户、修改密码或删除 token 后，所有进程中的缓存都要等 AUTH_TOKEN_CACHE_TTL 秒后才失效。
+需要立即生效时逐个调用 save()/delete()，或者重启工作进程。
+"""
+import copy
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+
+from . import metrics
+
+_token_cache = TTLCache(maxsize=settings.AUTH_TOKEN_CACHE_SIZE, ttl=settings.AUTH_TOKEN_CACHE_TTL)
+# TTLCache 不是线程安全的，所有读写都要持有这把锁
+_token_cache_lock = threading.Lock()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    与 TokenAuthentication 行为一致（包括对无效 token 和已停用用户的拒绝），只是缓存了认证成功的结果。
+    """
+
+    def authenticate_credentials(self, key):
+        with _token_cache_lock:
+            cached = _token_cache.get(key)
+        metrics.record_cache('auth_token', cached is not None)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            with _token_cache_lock:
+                _token_cache[key] = cached
+        user, token = cached
+        # 每个请求拿到独立的用户对象，避免并发请求之间共享、修改同一个实例
+        return copy.copy(user), token
+
+
+def invalidate_token(sender, instance, **kwargs):
+    with _token_cache_lock:
+        _token_cache.pop(instance.key, None)
+
+
+def invalidate_user(sender, instance, **kwargs):
+    with _token_cache_lock:
+        stale = [key for key, (user, token) in list(_token_cache.items()) if user.pk == instance.pk]
+        for key in stale:
+            _token_cache.pop(key, None)
+
+
+def on_user_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    用户被保存时，只有影响认证结果的 is_active 或密码变化才移除缓存。
+    登录时 update_last_login 只保存 last_login（update_fields=['last_login']），不会清空该用户的缓存。
+    通过 set_password 修改了密码时（保存完成前 _password 保存着新密码；登录时升级密码哈希不算）吊销该用户的所有 token，
+    token 的删除信号会移除各自的缓存条目。
+    """
+    if not created and getattr(instance, '_password', None) is not None:
+        from rest_framework.authtoken.models import Token
+        Token.objects.filter(user_id=instance.pk).delete()
+    if update_fields is not None and not {'is_active', 'password'} & set(update_fields):
+        return
+    with _token_cache_lock:
+        stale = [
+            key for key, (user, token) in list(_token_cache.items())
+            if user.pk == instance.pk and (user.is_active != instance.is_active or user.password != instance.password)
+        ]
+        for key in stale:
+            _token_cache.pop(key, None)
@@ -0,0 +1,54 @@
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+# --- 后台任务线程池 ---
+# 用于不需要阻塞请求的后续处理（如转存生成的图片）。
+# 每个任务结束后按 CONN_MAX_AGE 处理本线程的数据库连接（与请求结束时相同）：
+# 持久连接留给本线程的下一个任务复用，过期或不可用的连接则关闭。
+# 耗时的批量任务（锦标赛预先计算，每个可能持续数分钟）使用单独的 batch 线程池，
+# 同时执行的数量有上限，多出的在队列中等待，不会占满转存、投机执行等短任务的线程。
+_executors = {}
+_executor_lock = threading.Lock()
+
+
+def _pool_settings(pool: str) -> tuple[int, str]:
+    if pool == 'batch':
+        return settings.BACKGROUND_BATCH_WORKERS, 'gamecore-batch'
+    return settings.BACKGROUND_WORKERS, 'gamecore-bg'
+
+
+def _get_executor(pool: str = 'default') -> ThreadPoolExecutor:
+    with _executor_lock:
+        if pool not in _executors:
+            max_workers, thread_name_prefix = _pool_settings(pool)
+            _executors[pool] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+    return _executors[pool]
+
+
+def _run(fn, args, kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        print(f"后台任务 {getattr(fn, '__name__', fn)} 执行失败: {e}")
+        traceback.print_exc()
+        raise
+    finally:
+        close_old_connections()
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """
+    把一个函数提交到后台线程池执行，返回 Future。
+    """
+    return _get_executor().submit(_run, fn, args, kwargs)
+
+
+def submit_batch(fn, *args, **kwargs) -> Future:
+    """
+    把一个耗时的批量任务提交到 batch 线程池执行，返回 Future。
+    """
+    return _get_executor('batch').submit(_run, fn, args, kwargs)
@@ -0,0 +1,221 @@
+"""
+每日挑战：所有玩家当天挑战同一张原图。
+
+- 发布时（publish_challenge 管理命令）只计算一次 AI 一方：识图、AI 生图，原图和 AI 图片一次批量编码；
+- 玩家回合只调用一次文生图，与保存的原图嵌入比较打分，上游调用从一回合三次减少到一次；
+- 每个玩家在挑战中的最好成绩保存在 ChallengeEntry 中，每提交一次回合增量更新，排行榜直接按索引读取。
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import ai_services
+from . import image_processing
+from . import metrics
+from . import mirroring
+from . import scheduling
+from . import scoring
+from .models import ChallengeEntry, DailyChallenge, GameRound, decide_winner
+from .resilience import CircuitOpenError, Deadline, DeadlineExceeded
+from .tournaments import TurnFailed, embedding_from_bytes, embedding_to_bytes, \
+    generate_player_image, prepare_ai_side, reembed_ai_side
+
+
+class ChallengeClosed(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = '只能挑战当天的题目。'
+    default_code = 'challenge_closed'
+
+
+def publish_challenge(date: datetime.date, original_image_url: str = '', language: str = 'en',
+                      char_limit: int = 20, replace: bool = False) -> DailyChallenge:
+    """
+    计算并发布某一天的挑战。未指定原图时随机生成一张。
+    当天已有挑战时，只有 replace=True 才会覆盖：原地更新挑战（主键不变），已经产生的成绩一起清除。
+    已有的回合是对着旧的原图和 AI 一方玩的，与挑战解除关联、保留为普通对局，
+    否则重新打分（rebuild_entries）时旧成绩会重新出现在新挑战的排行榜上。
+    今天的挑战已经开放，玩家可能正在提交回合，不能覆盖。
+    """
+    _check_replaceable(date, replace)
+
+    deadline = Deadline(settings.TOURNAMENT_PREPARE_DEADLINE)
+    # 发布挑战的上游调用走 batch 通道，与锦标赛的预先计算相同
+    with metrics.timed('challenge_publish'), scheduling.lane(scheduling.BATCH):
+        prepared = prepare_ai_side(original_image_url, language, char_limit, deadline)
+        embeddings = ai_services.encode_images([prepared.original_image_bytes, prepared.ai_image_bytes])
+
+    renditions = {'ai': prepared.ai_renditions}
+    if prepared.original_renditions:
+        renditions['original'] = prepared.original_renditions
+    fields = {
+        'original_image_url': prepared.original_image_url,
+        'image_renditions': renditions,
+        'language': language,
+        'char_limit': char_limit,
+        'ai_generated_prompt_from_image': prepared.ai_prompt,
+        'ai_generated_image_url': prepared.ai_renditions[image_processing.MAIN_RENDITION],
+        # 与 calculate_image_similarity 一致：CLIP 模型未加载时得分为 0
+        'original_embedding': None if embeddings is None else embedding_to_bytes(embeddings[0]),
+        'ai_similarity_score': 0.0 if embeddings is None else ai_services.similarity_from_embeddings(
+            embeddings[0], embeddings[1]
+        ),
+        'embedding_model': '' if embeddings is None else ai_services.score_model_name(),
+        'play_count': 0,
+    }
+
+    with transaction.atomic():
+        # 计算 AI 一方需要一段时间，写入前再检查一次（例如期间已经过了零点）
+        _check_replaceable(date, replace)
+        challenge = DailyChallenge.objects.select_for_update().filter(date=date).first()
+        if challenge is None:
+            return DailyChallenge.objects.create(date=date, **fields)
+        ChallengeEntry.objects.filter(challenge=challenge).delete()
+        GameRound.objects.filter(daily_challenge=challenge).update(daily_challenge=None)
+        for name, value in fields.items():
+            setattr(challenge, name, value)
+        challenge.save()
+        return challenge
+
+
+def _check_replaceable(date: datetime.date, replace: bool) -> None:
+    if not DailyChallenge.objects.filter(date=date).exists():
+        return
+    if not replace:
+        raise ValueError(f"{date} 的挑战已经存在。")
+    if date == timezone.localdate():
+        raise ValueError(f"{date} 的挑战已经开放，不能覆盖。")
+
+
+def play_challenge(challenge: DailyChallenge, user, player_prompt: str, deadline: Deadline) -> GameRound:
+    """
+    处理玩家在每日挑战中的一个回合：生成玩家图片并打分，创建 GameRound，增量更新玩家在挑战中的成绩。
+    """
+    if challenge.date != timezone.localdate():
+        raise ChallengeClosed()
+
+    # 1. 玩家回合：生成并下载图片（AI 一方在发布时已经算好）
+    try:
+        player_image_url, player_image_bytes = generate_player_image(player_prompt, deadline)
+    except (CircuitOpenError, DeadlineExceeded, TurnFailed):
+        raise
+    except Exception as e:
+        print(f"下载图片时发生错误: {e}")
+        raise TurnFailed("Failed to download images for scoring. Check server logs for details.") from e
+
+    # 2. 只编码玩家图片，与保存的原图嵌入比较。
+    # 原图嵌入不是用当前模型计算的（更换模型后还没有重新打分），先用当前模型重新计算挑战的 AI 一方
+    try:
+        embeddings = ai_services.encode_images([player_image_bytes])
+        if embeddings is not None and (
+            challenge.original_embedding is None or challenge.embedding_model != ai_services.score_model_name()
+        ):
+            reembed_ai_side(challenge)
+    except (scoring.ScoringBusy, scoring.ScoringTimeout):
+        raise
+    except Exception as e:
+        print(f"计算图片相似度时发生错误: {e}")
+        raise TurnFailed("Failed to calculate images similarity. Check server logs for details.") from e
+    if embeddings is None or challenge.original_embedding is None:
+        player_similarity_score = 0.0
+    else:
+        player_similarity_score = ai_services.similarity_from_embeddings(
+            embedding_from_bytes(challenge.original_embedding), embeddings[0]
+        )
+
+    # 3. 写入本轮记录，并增量更新挑战成绩
+    with metrics.timed('db_write'), transaction.atomic():
+        game_round = GameRound.objects.create(
+            user=user,
+            original_image_url=challenge.original_image_url,
+            player_prompt=player_prompt,
+            player_generated_image_url=player_image_url,
+            player_similarity_score=player_similarity_score,
+            ai_generated_prompt_from_image=challenge.ai_generated_prompt_from_image,
+            ai_generated_image_url=challenge.ai_generated_image_url,
+            ai_similarity_score=challenge.ai_similarity_score,
+            winner=decide_winner(player_similarity_score, challenge.ai_similarity_score),
+            score_model=ai_services.score_model_name(),
+            image_renditions=challenge.image_renditions,
+            daily_challenge=challenge,
+        )
+        record_entry(challenge, user, game_round)
+        DailyChallenge.objects.filter(pk=challenge.pk).update(play_count=F('play_count') + 1)
+
+    # 4. 后台转存玩家图片（AI 图片在发布时已经转存）
+    if settings.MIRROR_GENERATED_IMAGES:
+        mirroring.schedule_mirror(game_round.id, {'player': player_image_bytes})
+
+    return game_round
+
+
+def record_entry(challenge: DailyChallenge, user, game_round: GameRound) -> ChallengeEntry:
+    """
+    用一个新回合增量更新玩家在挑战中的成绩：尝试次数加一，得分更高时替换最好成绩。需要在事务中调用。
+    """
+    entry, created = ChallengeEntry.objects.select_for_update().get_or_create(
+        challenge=challenge,
+        user=user,
+        defaults={
+            'attempts': 1,
+            'best_score': game_round.player_similarity_score,
+            'best_round': game_round,
+            'best_at': game_round.timestamp,
+        },
+    )
+    if created:
+        return entry
+
+    entry.attempts += 1
+    update_fields = ['attempts']
+    if game_round.player_similarity_score > entry.best_score:
+        entry.best_score = game_round.player_similarity_score
+        entry.best_round = game_round
+        entry.best_at = game_round.timestamp
+        update_fields += ['best_score', 'best_round', 'best_at']
+    entry.save(update_fields=update_fields)
+    return entry
+
+
+def rebuild_entries(challenge_id: int) -> None:
+    """
+    按时间顺序重放挑战的全部回合，重新生成每个玩家的成绩（回合被重新打分后调用）。
+    """
+    entries = {}
+    rounds = GameRound.objects.filter(daily_challenge_id=challenge_id).order_by('timestamp', 'id').only(
+        'id', 'user_id', 'player_similarity_score', 'timestamp'
+    )
+    for game_round in rounds.iterator(chunk_size=2000):
+        entry = entries.get(game_round.user_id)
+        if entry is None:
+            entries[game_round.user_id] = ChallengeEntry(
+                challenge_id=challenge_id,
+                user_id=game_round.user_id,
+                attempts=1,
+                best_score=game_round.player_similarity_score,
+                best_round_id=game_round.id,
+                best_at=game_round.timestamp,
+            )
+            continue
+        entry.attempts += 1
+        if game_round.player_similarity_score > entry.best_score:
+            entry.best_score = game_round.player_similarity_score
+            entry.best_round_id = game_round.id
+            entry.best_at = game_round.timestamp
+
+    with transaction.atomic():
+        ChallengeEntry.objects.filter(challenge_id=challenge_id).delete()
+        ChallengeEntry.objects.bulk_create(entries.values())
+
+
+def challenge_leaderboard(challenge: DailyChallenge):
+    """
+    挑战排行榜：按最高分降序，同分时先取得的排名靠前。
+    """
+    return ChallengeEntry.objects.filter(challenge=challenge).select_related('user').order_by(
+        '-best_score', 'best_at'
+    )[:settings.CHALLENGE_LEADERBOARD_SIZE]
@@ -0,0 +1,46 @@
+"""
+数据库连接复用情况的监控。
+
+- 持久连接模式（CONN_MAX_AGE > 0）：gamecore_db_connections_total 只在真正建立新连接时增加，
+  与请求数之比就是连接的复用程度；
+- 连接池模式（DB_POOL=True）：gamecore_db_connections_total 记录从池中取出连接的次数，
+  gamecore_db_pool_connections 给出每个连接池的容量、已借出、空闲和溢出的连接数。
+"""
+from . import metrics
+
+try:
+    from dj_db_conn_pool.core import pool_container
+except ImportError:
+    pool_container = None
+
+
+def on_connection_created(sender, connection, **kwargs):
+    metrics.db_connections.inc(alias=connection.alias)
+
+
+def pool_stats() -> list[tuple[tuple[str, str], int]]:
+    """
+    读取当前进程内各连接池（SQLAlchemy QueuePool）的状态。没有启用连接池时返回空列表。
+    """
+    if pool_container is None:
+        return []
+    with pool_container.lock:
+        pools = list(pool_container.items())
+    samples = []
+    for alias, pool in pools:
+        samples += [
+            ((alias, 'size'), pool.size()),
+            ((alias, 'checked_out'), pool.checkedout()),
+            ((alias, 'idle'), pool.checkedin()),
+            # 池子还没填满时 overflow() 为负数
+            ((alias, 'overflow'), max(0, pool.overflow())),
+        ]
+    return samples
+
+
+db_pool_connections = metrics.registry.register(metrics.Gauge(
+    'gamecore_db_pool_connections',
+    'Database connection pool usage by alias and state (size/checked_out/idle/overflow).',
+    callback=pool_stats,
+    labelnames=('alias', 'state'),
+))
@@ -0,0 +1,153 @@
+"""
+GameRound / GameEvent 的批量导出（CSV 或 JSONL），供数据分析使用。
+
+无论表有多大，内存占用都保持不变：
+- 按主键分批读取（keyset 分页：WHERE id > 上一批的最大 id ORDER BY id LIMIT n）。
+  MySQL 的驱动不支持服务端游标，单纯的 .iterator() 仍会把整个结果集读进客户端内存，
+  分批查询则每次只持有一批数据，而且每批都走主键索引，越往后翻页也不会变慢；
+- 每批数据格式化后立即交给 StreamingHttpResponse 或写入文件，不在内存中累积；
+- since_id 支持增量导出：下一次从上次导出的最大 id 继续。
+"""
+import csv
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import GameEvent, GameRound
+
+# 导出类型 -> (模型, 导出的字段)。user__username 会联表带出用户名
+EXPORTS = {
+    'rounds': (GameRound, [
+        'id',
+        'user_id',
+        'user__username',
+        'timestamp',
+        'original_image_url',
+        'player_prompt',
+        'player_generated_image_url',
+        'player_similarity_score',
+        'ai_generated_prompt_from_image',
+        'ai_generated_image_url',
+        'ai_similarity_score',
+        'winner',
+        'daily_challenge_id',
+    ]),
+    'events': (GameEvent, [
+        'id',
+        'user_id',
+        'user__username',
+        'session_id',
+        'event_type',
+        'event_data',
+        'timestamp',
+    ]),
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class Export:
+    """
+    一次导出。batches() 按主键分批产出行，lines(fmt) 产出格式化后的文本块（每批一块）。
+    导出过程中 last_id 和 row_count 随之更新，便于记录增量导出的位置。
+    """
+
+    def __init__(self, kind: str, since=None, until=None, since_id: int | None = None,
+                 chunk_size: int | None = None):
+        self.model, self.fields = EXPORTS[kind]
+        self.since = since
+        self.until = until
+        self.last_id = since_id or 0
+        self.row_count = 0
+        self.chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+
+    def queryset(self):
+        queryset = self.model.objects.all()
+        if self.since is not None:
+            queryset = queryset.filter(timestamp__gte=self.since)
+        if self.until is not None:
+            queryset = queryset.filter(timestamp__lt=self.until)
+        return queryset.order_by('id').values(*self.fields)
+
+    def batches(self):
+        queryset = self.queryset()
+        while True:
+            batch = list(queryset.filter(id__gt=self.last_id)[:self.chunk_size])
+            if not batch:
+                return
+            self.last_id = batch[-1]['id']
+            self.row_count += len(batch)
+            yield batch
+            if len(batch) < self.chunk_size:
+                return
+
+    def lines(self, fmt: str):
+        if fmt == 'csv':
+            return self._csv_lines()
+        return self._jsonl_lines()
+
+    def _csv_lines(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.fields)
+        for batch in self.batches():
+            for row in batch:
+                writer.writerow([_csv_value(row[field]) for field in self.fields])
+            yield _drain(buffer)
+        # 没有数据时也要输出表头
+        if buffer.tell():
+            yield _drain(buffer)
+
+    def _jsonl_lines(self):
+        for batch in self.batches():
+            yield ''.join(
+                json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in batch
+            )
+
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _drain(buffer: io.StringIO) -> str:
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return text
+
+
+def encode_chunks(chunks, compress: bool = False):
+    """
+    把文本块编码为 UTF-8；compress=True 时边产出边 gzip 压缩。
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+async def aiterate(iterator):
+    """
+    在 ASGI 下逐块消费同步迭代器：StreamingHttpResponse 遇到同步迭代器时会先把它整个读进内存，
+    这里每次在同一个线程里取下一块（数据库连接属于该线程），保持流式输出。
+    """
+    sentinel = object()
+    next_chunk = sync_to_async(lambda: next(iterator, sentinel))
+    while (chunk := await next_chunk()) is not sentinel:
+        yield chunk
@@ -0,0 +1,133 @@
+"""
+高频只读接口（历史记录、排行榜）的快速序列化。
+
+DRF 的 ModelSerializer 对每一行都要实例化模型对象，再逐个字段调用 get_attribute / to_representation，
+列表较长时序列化本身就是主要的 CPU 开销。RowSerializer 根据已有的 DRF 序列化器预先生成一个普通函数：
+- 直接读取 .values_list() 的元组（或 .values() 的字典），不创建模型对象；
+- 字段顺序、字段名和取值规则与原序列化器一致，只有时间、浮点数等少数字段需要转换，其余原样输出；
+- 配合 renderers.FastJSONRenderer（orjson）输出，结果与 DRF 的 JSONRenderer 逐字节相同。
+遇到无法直接处理的字段类型时，该字段退回使用 DRF 字段自身的 to_representation。
+"""
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
+
+from .serializers import GameRoundResultSerializer, LeaderboardSerializer
+
+# 不需要转换、数据库返回的值就是 DRF 的输出值的字段类型
+# （CharField / ChoiceField 的值已经是字符串，IntegerField 的值已经是整数，外键列即主键）
+_PASSTHROUGH_FIELDS = (
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+class StdlibFloat(float):
+    """
+    orjson 与标准库 json 对极小（< 1e-4）、极大（>= 1e16）的浮点数以及 NaN / inf 的写法不同。
+    这类值包装成 StdlibFloat，FastJSONRenderer 遇到它时改用 DRF 的 JSONRenderer 输出，保证结果一致。
+    """
+
+
+def _float(value):
+    value = float(value)
+    if value == 0 or 1e-4 <= abs(value) < 1e16:
+        return value
+    return StdlibFloat(value)
+
+
+def _datetime_converter(field: serializers.DateTimeField):
+    """
+    DateTimeField.to_representation 的快速版本：只处理最常见的“带时区 + ISO 8601”情况，
+    其余情况交给 DRF 字段本身。
+    """
+    def convert(value, tz):
+        if tz is None or value.tzinfo is None:
+            return field.to_representation(value)
+        text = value.astimezone(tz).isoformat()
+        if text.endswith('+00:00'):
+            text = text[:-6] + 'Z'
+        return text
+    return convert
+
+
+class RowSerializer:
+    """
+    由 DRF 序列化器类生成的行序列化函数。字段的数据来源（values_list 的列名）取自字段的 source，
+    嵌套的 source（如 'user.username'）对应 'user__username'。
+
+    serialize_queryset(queryset) / aserialize_queryset(queryset) 读取模型查询集；serialize_dicts(rows) 处理 .values() 的结果（如排行榜的聚合查询）。
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._compiled = None
+
+    def _compile(self):
+        fields = [field for field in self.serializer_class().fields.values() if not field.write_only]
+        namespace = {'_float': _float}
+        columns = []
+        expressions = []
+        for index, field in enumerate(fields):
+            if field.source == '*' or isinstance(field, serializers.BaseSerializer):
+                raise ValueError(f"{self.serializer_class.__name__}.{field.field_name} 不是单个列，无法按列读取。")
+            columns.append('__'.join(field.source_attrs))
+            value = f"r[{{key{index}}}]"
+            if isinstance(field, serializers.FloatField):
+                converted = "_float(v)"
+            elif (isinstance(field, serializers.DateTimeField)
+                  and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601
+                  and not hasattr(field, 'timezone')):
+                namespace[f'_c{index}'] = _datetime_converter(field)
+                converted = f"_c{index}(v, tz)"
+            elif isinstance(field, _PASSTHROUGH_FIELDS) or (
+                    isinstance(field, serializers.JSONField) and not field.binary):
+                expressions.append((field.field_name, value))
+                continue
+            else:
+                namespace[f'_c{index}'] = field.to_representation
+                converted = f"_c{index}(v)"
+            # 与 Serializer.to_representation 一致：值为 None 时直接输出 None，不调用字段的转换
+            expressions.append((field.field_name, f"(None if (v := {value}) is None else {converted})"))
+
+        # 分别生成读取元组（按位置）和读取字典（按列名）的版本
+        compiled = {}
+        for mode in ('tuple', 'dict'):
+            keys = {f'key{index}': repr(index if mode == 'tuple' else column) for index, column in enumerate(columns)}
+            items = ', '.join(f"{name!r}: {expression.format(**keys)}" for name, expression in expressions)
+            source = f"def serialize(rows, tz):\n    return [{{{items}}} for r in rows]\n"
+            code = compile(source, f"<{self.serializer_class.__name__} {mode} rows>", 'exec')
+            scope = dict(namespace)
+            exec(code, scope)
+            compiled[mode] = scope['serialize']
+        return columns, compiled
+
+    def _get(self):
+        if self._compiled is None:
+            self._compiled = self._compile()
+        return self._compiled
+
+    @staticmethod
+    def _timezone():
+        return timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def serialize_queryset(self, queryset) -> list[dict]:
+        columns, compiled = self._get()
+        return compiled['tuple'](queryset.values_list(*columns), self._timezone())
+
+    async def aserialize_queryset(self, queryset) -> list[dict]:
+        columns, compiled = self._get()
+        rows = [row async for row in queryset.values_list(*columns)]
+        return compiled['tuple'](rows, self._timezone())
+
+    def serialize_dicts(self, rows) -> list[dict]:
+        return self._get()[1]['dict'](rows, self._timezone())
+
+
+# 历史记录与排行榜使用的行序列化函数（首次使用时生成）
+game_round_rows = RowSerializer(GameRoundResultSerializer)
+leaderboard_rows = RowSerializer(LeaderboardSerializer)
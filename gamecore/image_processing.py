@@ -0,0 +1,374 @@
+import asyncio
+import multiprocessing
+import random
+import re
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http.request import split_domain_port, validate_host
+
+from . import metrics
+from .resilience import Deadline
+
+# --- 衍生图（rendition）规格 ---
+# 名称 -> (目标尺寸, 是否强制拉伸到目标尺寸)
+# play:    游戏展示用的主图，等比缩放到 512px 以内
+# score:   CLIP 打分输入，与 calculate_image_similarity 的预处理保持一致，直接拉伸为 224x224
+# preview: 历史记录、排行榜等处使用的小缩略图
+RENDITION_SIZES = {
+    'play': ((512, 512), False),
+    'score': ((224, 224), True),
+    'preview': ((128, 128), False),
+}
+
+# 每种尺寸都输出 JPEG 与 WebP 两种格式：扩展名 -> (Pillow 格式名, 编码参数)
+RENDITION_FORMATS = {
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+# 缩放时先用 reduce 做整数倍快速降采样，保留不少于目标尺寸 2 倍的像素再做高质量重采样
+REDUCING_GAP = 2
+
+# 主图 JPEG 的文件名沿用旧格式 uploads/<hex>.jpg，其他衍生图为 uploads/<hex>_<名称>.<扩展名>
+MAIN_RENDITION = 'play_jpg'
+# 原图打分时读取的衍生图（玩家回合、投机执行、锦标赛、每日挑战和重新打分都以此为准）
+SCORE_RENDITION = 'score_jpg'
+# 打分输入的版本，与模型名称一起记录在 score_model / embedding_model 中（见 ai_services.score_tag）。
+# 改用 224px 打分图之前，原图的打分输入是 512px 主图再缩放到 224px，得分会有细微差别，
+# 两种输入的得分不直接比较，rescore_rounds 会把旧版本的回合用当前输入重新计算。
+# 修改打分图的尺寸、缩放方式或编码参数时需要递增这个版本。
+SCORE_INPUT_VERSION = 'score224'
+# 生成的图片转存时另外保存一份服务商返回的原始内容：实时打分用的就是它，重新打分时需要相同的输入
+SOURCE_RENDITION = 'source'
+_MAIN_NAME_RE = re.compile(r'^(?P<prefix>.+)/(?P<stem>[0-9a-f]{32})\.jpg$')
+
+
+def _shrink(image: Image.Image, size: tuple[int, int], stretch: bool) -> Image.Image:
+    """
+    把图片缩放到目标尺寸。先用 Image.reduce 做整数倍降采样（快路径），再用 LANCZOS 精确缩放。
+    """
+    width, height = image.size
+    if stretch:
+        target = size
+    else:
+        scale = min(size[0] / width, size[1] / height)
+        if scale >= 1:
+            # 与 thumbnail 一致：不放大小图
+            return image
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    factor = min(width // target[0], height // target[1]) // REDUCING_GAP
+    if factor > 1:
+        image = image.reduce(factor)
+    return image.resize(target, Image.Resampling.LANCZOS)
+
+
+def render_image(source, max_pixels: int | None = None) -> dict[str, bytes]:
+    """
+    在工作进程中执行：解码一次原图，逐级缩放出所有衍生图并编码。
+    source 可以是图片的二进制内容，也可以是本地文件路径（如上传时的临时文件）。
+    返回 {'play_jpg': b'...', 'play_webp': b'...', ...}。
+    """
+    image = Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+    # 解码前再检查一次像素数，防止解压炸弹拖住工作进程
+    if max_pixels and image.size[0] * image.size[1] > max_pixels:
+        raise ValueError(f"图片尺寸过大（{image.size[0]}x{image.size[1]}）。")
+    # JPEG 可以在解码时直接按 1/2、1/4、1/8 缩小（draft 模式），大幅减少大照片的解码开销和内存
+    if image.format in ('JPEG', 'MPO'):
+        image.draft('RGB', RENDITION_SIZES['play'][0])
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    # 渐进式缩放：只有主图从原图缩放，更小的衍生图都从主图继续缩放，避免重复处理大图
+    play = _shrink(image, *RENDITION_SIZES['play'])
+    resized = {
+        'play': play,
+        'score': _shrink(play, *RENDITION_SIZES['score']),
+        'preview': _shrink(play, *RENDITION_SIZES['preview']),
+    }
+
+    encoded = {}
+    for name, img in resized.items():
+        for ext, (pil_format, options) in RENDITION_FORMATS.items():
+            buffer = BytesIO()
+            img.save(buffer, format=pil_format, **options)
+            encoded[f"{name}_{ext}"] = buffer.getvalue()
+    return encoded
+
+
+# --- 进程池 ---
+# CPU 密集的解码/缩放/编码放到独立进程中执行，避免占用请求线程和 GIL。
+# 使用 spawn 方式启动，避免 fork 出一个已加载 CLIP 模型、持有多个线程的 Web 进程。
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor | None:
+    global _pool
+    if settings.IMAGE_PROCESSING_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    return _pool
+
+
+def build_renditions(source) -> dict[str, bytes]:
+    """
+    生成所有衍生图的二进制内容。配置了进程池时在池中执行，否则在当前线程执行。
+    source 为本地文件路径时只把路径传给工作进程，不在进程间复制文件内容。
+    """
+    pool = _get_pool()
+    with metrics.timed('renditions'):
+        if pool is None:
+            return render_image(source, settings.MAX_UPLOAD_PIXELS)
+        future = pool.submit(render_image, source, settings.MAX_UPLOAD_PIXELS)
+        return future.result(timeout=settings.IMAGE_PROCESSING_TIMEOUT)
+
+
+def _rendition_path(stem: str, key: str, prefix: str) -> str:
+    if key == MAIN_RENDITION:
+        return f"{prefix}/{stem}.jpg"
+    name, ext = key.rsplit('_', 1)
+    return f"{prefix}/{stem}_{name}.{ext}"
+
+
+def _source_extension(content: bytes) -> str:
+    with Image.open(BytesIO(content)) as image:
+        image_format = (image.format or 'bin').lower()
+    return 'jpg' if image_format in ('jpeg', 'mpo') else image_format
+
+
+def save_renditions(source, prefix: str = 'uploads', keep_source: bool = False) -> dict[str, str]:
+    """
+    生成衍生图并通过 default_storage 保存，返回 {衍生图名称: 存储路径}。
+    keep_source=True 时把 source（图片内容）原样另存一份，名称为 SOURCE_RENDITION。
+    """
+    stem = uuid.uuid4().hex
+    saved = {}
+    for key, content in build_renditions(source).items():
+        saved[key] = default_storage.save(_rendition_path(stem, key, prefix), ContentFile(content))
+    if keep_source and isinstance(source, bytes):
+        path = f"{prefix}/{stem}_{SOURCE_RENDITION}.{_source_extension(source)}"
+        saved[SOURCE_RENDITION] = default_storage.save(path, ContentFile(source))
+    return saved
+
+
+def scoring_source(renditions: dict | None, role: str, url: str) -> str:
+    """
+    打分使用的图片地址，与实时打分的输入一致：原图（role='original'）使用 SCORE_RENDITION，
+    生成的图片使用转存时保存的原始内容。renditions 为 image_renditions 的结构，没有对应的图片时返回 url。
+    """
+    key = SCORE_RENDITION if role == 'original' else SOURCE_RENDITION
+    return ((renditions or {}).get(role) or {}).get(key) or url
+
+
+def media_url(path: str, request=None) -> str:
+    """
+    构建存储路径对应的完整、可公开访问的 URL。没有请求对象时使用 PUBLIC_DOMAIN。
+    """
+    relative = f"{settings.MEDIA_URL}{path}"
+    if request is not None:
+        return request.build_absolute_uri(relative)
+    return f"{settings.PUBLIC_DOMAIN.rstrip('/')}{relative}"
+
+
+def _is_own_host(netloc: str) -> bool:
+    """
+    netloc 是否是本站的域名：PUBLIC_DOMAIN 或 ALLOWED_HOSTS 中的域名（不含通配符 '*'）。
+    """
+    host, _ = split_domain_port(netloc)
+    own_hosts = [h for h in settings.ALLOWED_HOSTS if h != '*']
+    public_host = urlparse(settings.PUBLIC_DOMAIN).hostname
+    if public_host:
+        own_hosts.append(public_host)
+    return bool(host) and validate_host(host, own_hosts)
+
+
+def media_path_from_url(url: str) -> str | None:
+    """
+    如果 URL 指向本站的媒体文件，返回其存储路径，否则返回 None。
+    其他域名下同样以 MEDIA_URL 开头的路径不是本站的文件，不能当作本地文件读取。
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.netloc and not _is_own_host(parsed.netloc):
+        return None
+    if not parsed.path.startswith(settings.MEDIA_URL):
+        return None
+    return parsed.path[len(settings.MEDIA_URL):]
+
+
+def read_local_media(url: str) -> bytes | None:
+    """
+    直接从存储读取本站媒体文件，省去一次对自己的 HTTP 请求。不是本站文件或文件不存在时返回 None。
+    """
+    path = media_path_from_url(url)
+    if not path or not default_storage.exists(path):
+        return None
+    with default_storage.open(path, 'rb') as f:
+        return f.read()
+
+
+def rendition_urls_for(url: str) -> dict[str, str]:
+    """
+    根据主图 URL 推导出同一张图的所有衍生图 URL。
+    只有主图是由 save_renditions 生成的（并且衍生图确实存在）时才返回结果，否则返回空字典。
+    """
+    path = media_path_from_url(url)
+    match = _MAIN_NAME_RE.match(path or '')
+    if not match:
+        return {}
+    prefix = match.group('prefix')
+    stem = match.group('stem')
+    keys = [f"{name}_{ext}" for name in RENDITION_SIZES for ext in RENDITION_FORMATS]
+    # 只检查一张衍生图是否存在，避免为旧格式的上传图返回不存在的 URL
+    if not default_storage.exists(_rendition_path(stem, 'score_jpg', prefix)):
+        return {}
+    parsed = urlparse(url)
+    base = f"{parsed.scheme}://{parsed.netloc}{settings.MEDIA_URL}" if parsed.netloc else settings.MEDIA_URL
+    return {key: f"{base}{_rendition_path(stem, key, prefix)}" for key in keys}
+
+
+# --- 图片下载 ---
+# 限制同时进行的下载数量，避免瞬时大量请求占满带宽或被服务商限流。
+# 第一次下载时按配置创建，配置变化时（如压测命令用 override_settings 调整）重新创建，
+# 已经占到的名额仍然归还给原来的信号量
+_download_slots = None
+_download_slots_size = None
+_download_slots_lock = threading.Lock()
+
+
+def _get_download_slots() -> threading.BoundedSemaphore:
+    global _download_slots, _download_slots_size
+    size = settings.IMAGE_DOWNLOAD_CONCURRENCY
+    with _download_slots_lock:
+        if _download_slots is None or _download_slots_size != size:
+            _download_slots = threading.BoundedSemaphore(size)
+            _download_slots_size = size
+        return _download_slots
+
+
+def _is_retryable(error: requests.RequestException) -> bool:
+    """
+    连接错误、超时、429 和 5xx 视为临时错误，可以重试；其他 4xx 重试也不会成功。
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return True
+
+
+def _retry_delay(attempt: int, deadline: Deadline | None) -> float | None:
+    """
+    第 attempt 次下载失败后的退避时间（指数退避，带随机抖动）。退避结束前调用方的时间预算就会用完时返回 None，不再重试。
+    """
+    delay = settings.IMAGE_DOWNLOAD_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+    if deadline is not None and deadline.remaining() <= delay:
+        return None
+    return delay
+
+
+def fetch_image_bytes(url: str, timeout: float = 60, deadline: Deadline | None = None) -> bytes:
+    """
+    获取图片的二进制内容。本站媒体文件直接从存储读取，其余通过 HTTP 下载，
+    遇到临时错误时按指数退避（带随机抖动）重试。
+    传入 deadline 时每次下载的超时不超过剩余预算，预算不够再等一次退避时停止重试。
+    """
+    # 本站存储可以看作一层缓存：已转存或本站生成的图片不必再走网络
+    content = read_local_media(url)
+    metrics.record_cache('local_media', content is not None)
+    if content is not None:
+        return content
+
+    attempts = settings.IMAGE_DOWNLOAD_RETRIES + 1
+    for attempt in range(attempts):
+        attempt_timeout = deadline.timeout(timeout) if deadline is not None else timeout
+        try:
+            with _get_download_slots(), metrics.timed('image_download'):
+                response = requests.get(url, timeout=attempt_timeout)
+                response.raise_for_status()
+                return response.content
+        except requests.RequestException as e:
+            if attempt == attempts - 1 or not _is_retryable(e):
+                raise
+            delay = _retry_delay(attempt, deadline)
+            if delay is None:
+                raise
+            print(f"下载图片失败（第 {attempt + 1} 次），{delay:.2f} 秒后重试: {e}")
+            time.sleep(delay)
+
+
+# --- 异步下载（ASGI 模式） ---
+# httpx.AsyncClient 和 asyncio.Semaphore 都绑定在创建它们的事件循环上，
+# 所以按事件循环分别创建；事件循环被回收后对应的条目自动消失。
+# 与同步下载一样，并发上限变化时重新创建信号量（客户端继续使用）。
+_async_download_state = weakref.WeakKeyDictionary()
+
+
+def _async_downloader() -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+    loop = asyncio.get_running_loop()
+    size = settings.IMAGE_DOWNLOAD_CONCURRENCY
+    state = _async_download_state.get(loop)
+    if state is None or state[2] != size:
+        client = state[0] if state is not None else httpx.AsyncClient(follow_redirects=True)
+        state = _async_download_state[loop] = (client, asyncio.Semaphore(size), size)
+    return state[0], state[1]
+
+
+def _is_retryable_async(error: httpx.HTTPError) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+async def afetch_image_bytes(url: str, timeout: float = 60, deadline: Deadline | None = None) -> bytes:
+    """
+    fetch_image_bytes 的异步版本：等待下载时不占用线程，重试策略相同。
+    """
+    content = await sync_to_async(read_local_media, thread_sensitive=False)(url)
+    metrics.record_cache('local_media', content is not None)
+    if content is not None:
+        return content
+
+    client, slots = _async_downloader()
+    attempts = settings.IMAGE_DOWNLOAD_RETRIES + 1
+    for attempt in range(attempts):
+        attempt_timeout = deadline.timeout(timeout) if deadline is not None else timeout
+        try:
+            async with slots:
+                with metrics.timed('image_download'):
+                    response = await client.get(url, timeout=attempt_timeout)
+                    response.raise_for_status()
+                    return response.content
+        except httpx.HTTPError as e:
+            if attempt == attempts - 1 or not _is_retryable_async(e):
+                raise
+            delay = _retry_delay(attempt, deadline)
+            if delay is None:
+                raise
+            print(f"下载图片失败（第 {attempt + 1} 次），{delay:.2f} 秒后重试: {e}")
+            await asyncio.sleep(delay)
+
+
+async def asave_renditions(source, prefix: str = 'uploads') -> dict[str, str]:
+    """
+    save_renditions 的异步版本：解码、缩放和写入存储在线程中进行，不阻塞事件循环。
+    """
+    return await sync_to_async(save_renditions, thread_sensitive=False)(source, prefix)
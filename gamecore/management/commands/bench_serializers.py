@@ -0,0 +1,111 @@
+import json
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import setup_test_environment
+from rest_framework.renderers import JSONRenderer
+
+from gamecore.fast_serializers import game_round_rows, leaderboard_rows
+from gamecore.models import GameRound
+from gamecore.renderers import FastJSONRenderer, orjson
+from gamecore.serializers import GameRoundResultSerializer, LeaderboardSerializer
+from gamecore.views import leaderboard_queryset
+
+PROMPTS = ['a cat on a sofa', '一只在沙发上的猫', 'sunset over the sea, oil painting', '雪山下的小木屋', 'neon city at night']
+
+
+class Command(BaseCommand):
+    help = (
+        "序列化微基准：在测试数据库上对比历史记录和排行榜接口的两种序列化方式——"
+        "DRF 序列化器 + JSONRenderer，与 fast_serializers + FastJSONRenderer——"
+        "输出每秒处理的行数，并检查两者的输出是否逐字节相同。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="写入的用户数")
+        parser.add_argument('--rounds', type=int, default=500, help="每个用户写入的回合数（即历史记录的长度）")
+        parser.add_argument('--repeat', type=int, default=20, help="每种方式重复执行的次数，取最快的一次")
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(self.style.WARNING("未安装 orjson，FastJSONRenderer 将退回标准库 json。"))
+
+        setup_test_environment()
+        old_db_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user_id = self.prepare_rounds(options['users'], options['rounds'])
+            history = GameRound.objects.filter(user_id=user_id).order_by('-timestamp')
+            cases = {
+                'history': (
+                    lambda: JSONRenderer().render(GameRoundResultSerializer(history, many=True).data),
+                    lambda: FastJSONRenderer().render(game_round_rows.serialize_queryset(history)),
+                ),
+                'leaderboard': (
+                    lambda: JSONRenderer().render(LeaderboardSerializer(leaderboard_queryset(), many=True).data),
+                    lambda: FastJSONRenderer().render(leaderboard_rows.serialize_dicts(leaderboard_queryset())),
+                ),
+            }
+            for name, (before, after) in cases.items():
+                self.compare(name, before, after, options['repeat'])
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+
+    def prepare_rounds(self, users: int, rounds: int) -> int:
+        """
+        写入测试数据（包括中文提示词、空值和衍生图），返回第一个用户的 id。
+        """
+        rng = random.Random(0)
+        User = get_user_model()
+        objects = []
+        user_ids = []
+        for index in range(users):
+            user = User.objects.create_user(username=f"bench{index}", password='bench')
+            user_ids.append(user.id)
+            for round_index in range(rounds):
+                player_score = round(rng.uniform(0, 100), 2)
+                ai_score = round(rng.uniform(0, 100), 2)
+                objects.append(GameRound(
+                    user=user,
+                    original_image_url=f"http://localhost/media/uploads/{index}-{round_index}_play.jpg",
+                    player_prompt=rng.choice(PROMPTS),
+                    player_generated_image_url=f"http://localhost/media/generated/{index}-{round_index}p_play.jpg",
+                    player_similarity_score=player_score,
+                    ai_generated_prompt_from_image=rng.choice(PROMPTS) if round_index % 10 else None,
+                    ai_generated_image_url=f"http://localhost/media/generated/{index}-{round_index}a_play.jpg",
+                    ai_similarity_score=ai_score,
+                    winner='player' if player_score > ai_score else 'ai' if ai_score > player_score else 'draw',
+                    score_model='clip-ViT-B-32',
+                    image_renditions={'original': {
+                        'play_jpg': f"http://localhost/media/uploads/{index}-{round_index}_play.jpg",
+                        'thumb_webp': f"http://localhost/media/uploads/{index}-{round_index}_thumb.webp",
+                    }},
+                ))
+        GameRound.objects.bulk_create(objects, batch_size=1000)
+        return user_ids[0]
+
+    def compare(self, name: str, before, after, repeat: int) -> None:
+        expected, actual = before(), after()
+        if expected != actual:
+            raise CommandError(f"{name}：两种方式的输出不一致（{len(expected)} 字节 / {len(actual)} 字节）。")
+        rows = len(json.loads(expected))
+
+        timings = {}
+        for label, func in (('before', before), ('after', after)):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = best
+        self.stdout.write(
+            f"{name}: {rows} 行，{len(expected)} 字节，输出逐字节相同\n"
+            f"  DRF 序列化器 + JSONRenderer:          {rows / timings['before']:>12,.0f} 行/秒（{timings['before'] * 1000:.2f} ms）\n"
+            f"  fast_serializers + FastJSONRenderer: {rows / timings['after']:>12,.0f} 行/秒（{timings['after'] * 1000:.2f} ms），"
+            f"提升 {timings['before'] / timings['after']:.1f} 倍"
+        )
@@ -0,0 +1,57 @@
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from gamecore.exports import EXPORTS, Export
+
+
+class Command(BaseCommand):
+    help = "以 CSV 或 JSONL 导出游戏回合或埋点事件。按主键分批读取，内存占用与表的大小无关；输出文件以 .gz 结尾时直接写入 gzip。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(EXPORTS), default='rounds', help="导出游戏回合（rounds）或埋点事件（events）")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--since', help="只导出这个时间（含）之后的记录，ISO 格式")
+        parser.add_argument('--until', help="只导出这个时间（不含）之前的记录，ISO 格式")
+        parser.add_argument('--since-id', type=int, help="增量导出：只导出 id 大于该值的记录")
+        parser.add_argument('--chunk-size', type=int, help="每批读取的行数，默认为 EXPORT_CHUNK_SIZE")
+        parser.add_argument('--output', '-o', help="输出文件，默认输出到标准输出")
+
+    def handle(self, *args, **options):
+        export = Export(
+            options['kind'],
+            since=self.parse_time(options['since']),
+            until=self.parse_time(options['until']),
+            since_id=options['since_id'],
+            chunk_size=options['chunk_size'],
+        )
+
+        output = options['output']
+        if not output:
+            out = sys.stdout
+        elif output.endswith('.gz'):
+            out = gzip.open(output, 'wt', encoding='utf-8', newline='')
+        else:
+            out = open(output, 'w', encoding='utf-8', newline='')
+        try:
+            for chunk in export.lines(options['format']):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+        # 下次增量导出时把 last_id 传给 --since-id
+        self.stderr.write(f"已导出 {export.row_count} 条记录，last_id={export.last_id}")
+
+    def parse_time(self, value):
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f"无效的时间：{value}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
@@ -0,0 +1,357 @@
+import asyncio
+import importlib
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import clear_url_caches
+from rest_framework.authtoken.models import Token
+from volcenginesdkarkruntime import Ark
+
+from gamecore import ai_services, metrics
+from gamecore.stub_ark import DeterministicClipModel, StubArkServer, StubConfig
+
+ENDPOINTS = ('start_game', 'play_turn', 'leaderboard', 'history', 'log_event')
+
+
+def percentile(ordered: list[float], q: float) -> float | None:
+    """
+    最近秩法计算分位数，ordered 需要已排序。
+    """
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class TokenAsyncClient(AsyncClient):
+    """
+    每个请求都带上 Token 认证头的 AsyncClient。
+    （AsyncClient 构造参数中的 headers 会被转换成 WSGI 风格的名称，在 ASGI 请求里无法识别。）
+    """
+
+    def __init__(self, token: str):
+        super().__init__()
+        self.token = token
+
+    def generic(self, *args, headers=None, **kwargs):
+        headers = {'Authorization': f"Token {self.token}", **(headers or {})}
+        return super().generic(*args, headers=headers, **kwargs)
+
+
+class Command(BaseCommand):
+    help = (
+        "离线压测：启动本地 Ark 桩服务，在测试数据库上以指定并发压测 gamecore 的各个 API，"
+        "输出吞吐量、p50/p95/p99 延迟和数据库查询次数，并保存为 JSON 报告以便跨提交对比。"
+        "--interface asgi 时在单个事件循环中以异步视图处理请求，用于对比单进程能同时处理的回合数。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help="要压测的接口，逗号分隔")
+        parser.add_argument('--interface', choices=['wsgi', 'asgi'], default='wsgi',
+                            help="wsgi：同步视图，每个并发占用一个线程；asgi：异步视图，所有并发请求共享一个事件循环")
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help="并发数（wsgi 模式下为线程数，asgi 模式下为同时进行的请求数）")
+        parser.add_argument('--requests', type=int, default=50, help="每个接口的请求数")
+        parser.add_argument('--users', type=int, default=10, help="参与压测的用户数")
+        parser.add_argument('--history-rounds', type=int, default=50, help="每个用户预先写入的历史记录数")
+        parser.add_argument('--clip', choices=['deterministic', 'real'], default='deterministic',
+                            help="使用确定性的替身模型，还是真实加载的 CLIP 模型")
+        parser.add_argument('--stub-latency', type=float, default=StubConfig.latency)
+        parser.add_argument('--stub-jitter', type=float, default=StubConfig.jitter)
+        parser.add_argument('--stub-image-latency', type=float, default=StubConfig.image_latency)
+        parser.add_argument('--stub-error-rate', type=float, default=0.0)
+        parser.add_argument('--stub-rate-limit-rate', type=float, default=0.0)
+        parser.add_argument('--keep-limits', action='store_true',
+                            help="保留准入控制的限流配置（默认放开限流，只测处理能力）")
+        parser.add_argument('--output', default='loadtest_report.json', help="JSON 报告的保存路径")
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            self.stderr.write(f"未知的接口: {', '.join(sorted(unknown))}")
+            return
+
+        stub_config = StubConfig(
+            latency=options['stub_latency'],
+            jitter=options['stub_jitter'],
+            image_latency=options['stub_image_latency'],
+            error_rate=options['stub_error_rate'],
+            rate_limit_rate=options['stub_rate_limit_rate'],
+        )
+        stub = StubArkServer(config=stub_config)
+        stub.start_in_background()
+
+        workdir = tempfile.mkdtemp(prefix='gamecore-loadtest-')
+        overrides = {
+            'MEDIA_ROOT': f"{workdir}/media",
+            'ADMISSION_STATE_DIR': f"{workdir}/admission",
+            'CACHES': {
+                **settings.CACHES,
+                'admission': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': f"{workdir}/admission/cache",
+                },
+            },
+            'MIRROR_GENERATED_IMAGES': False,
+            # 异步视图按 ARK_BASE_URL 创建异步客户端
+            'ARK_BASE_URL': stub.base_url,
+        }
+        if not options['keep_limits']:
+            overrides.update({
+                'AI_USER_RATE': '1000000/s',
+                'ARK_MODEL_RATES': {model: '1000000/s' for model in settings.ARK_MODEL_RATES},
+                'AI_MAX_CONCURRENT': max(settings.AI_MAX_CONCURRENT, options['concurrency']),
+                # 异步视图中一个回合的两条 AI 分支同时调用上游；设为 0（不调度）时保持不变
+                'UPSTREAM_MAX_CONCURRENT': settings.UPSTREAM_MAX_CONCURRENT and max(
+                    settings.UPSTREAM_MAX_CONCURRENT, 2 * options['concurrency']),
+            })
+
+        # 替换 AI 客户端和 CLIP 模型，压测结束后恢复
+        original_client, original_clip = ai_services.client, ai_services.clip_model
+        original_api_key = ai_services.ARK_API_KEY
+        ai_services.client = Ark(base_url=stub.base_url, api_key='stub', max_retries=0)
+        ai_services.ARK_API_KEY = 'stub'
+        if options['clip'] == 'deterministic':
+            ai_services.clip_model = DeterministicClipModel()
+
+        setup_test_environment()
+        old_db_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(**overrides), self.views_for(options['interface']):
+                report = self.run_benchmark(endpoints, options, stub_config)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            ai_services.client, ai_services.clip_model = original_client, original_clip
+            ai_services.ARK_API_KEY = original_api_key
+            stub.shutdown()
+            stub.server_close()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        for name, result in report['endpoints'].items():
+            self.stdout.write(
+                f"{name:<12} {result['throughput_rps']:>8.2f} req/s  "
+                f"p50 {result['latency_ms']['p50']:>8.1f} ms  "
+                f"p95 {result['latency_ms']['p95']:>8.1f} ms  "
+                f"p99 {result['latency_ms']['p99']:>8.1f} ms  "
+                f"errors {result['errors']:>4}  queries/req "
+                + (f"{result['queries_per_request']:.1f}" if result['queries_per_request'] is not None else '-')
+            )
+        self.stdout.write(self.style.SUCCESS(f"报告已保存到 {options['output']}"))
+
+    def run_benchmark(self, endpoints, options, stub_config):
+        tokens = self.prepare_users(options['users'], options['history_rounds'])
+
+        # play_turn 需要一张已经发布的原图，先通过 start_game 生成一张
+        original_image_url = None
+        if 'play_turn' in endpoints:
+            response = self.client_for(tokens[0]).post('/api/start_game/', {}, content_type='application/json')
+            original_image_url = response.json().get('original_image_url')
+            if not original_image_url:
+                raise RuntimeError(f"无法通过 start_game 生成原图: {response.status_code} {response.content[:200]}")
+
+        requests_by_endpoint = {
+            'start_game': lambda client: client.post('/api/start_game/', {}, content_type='application/json'),
+            'play_turn': lambda client: client.post('/api/play_turn/', {
+                'original_image_url': original_image_url,
+                'player_prompt': 'a cat',
+                'language': 'en',
+                'char_limit': 20,
+            }, content_type='application/json'),
+            'leaderboard': lambda client: client.get('/api/leaderboard/'),
+            'history': lambda client: client.get('/api/history/'),
+            'log_event': lambda client: client.post('/api/log_event/', {
+                'event_type': 'loadtest',
+                'event_data': {'source': 'loadtest'},
+            }, content_type='application/json'),
+        }
+
+        drive = self.drive_async if options['interface'] == 'asgi' else self.drive
+        results = {}
+        for name in endpoints:
+            self.stdout.write(f"压测 {name} ...")
+            results[name] = drive(requests_by_endpoint[name], tokens, options['concurrency'], options['requests'])
+
+        return {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'commit': self.git_commit(),
+            'options': {
+                'interface': options['interface'],
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+                'users': options['users'],
+                'history_rounds': options['history_rounds'],
+                'clip': options['clip'],
+                'keep_limits': options['keep_limits'],
+                'stub': stub_config.__dict__,
+            },
+            'endpoints': results,
+            'stages': metrics.stage_seconds.summary(),
+        }
+
+    @staticmethod
+    @contextmanager
+    def views_for(interface: str):
+        """
+        切换 gamecore 的 URL 使用同步视图还是异步视图：urls.py 在导入时根据设置选择视图，所以需要重新加载。
+        """
+        import gamecore.urls
+
+        def reload_urls():
+            # 根 URLconf 中的 include() 缓存了子路由，两个模块都要重新加载
+            importlib.reload(gamecore.urls)
+            importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+            clear_url_caches()
+
+        override = override_settings(GAMECORE_ASYNC_VIEWS=interface == 'asgi')
+        override.enable()
+        reload_urls()
+        try:
+            yield
+        finally:
+            override.disable()
+            reload_urls()
+
+    def prepare_users(self, count: int, history_rounds: int) -> list[str]:
+        from gamecore.models import GameRound
+
+        User = get_user_model()
+        tokens = []
+        rounds = []
+        for index in range(count):
+            user = User.objects.create_user(username=f"loadtest{index}", password='loadtest')
+            tokens.append(Token.objects.create(user=user).key)
+            for round_index in range(history_rounds):
+                player_score = float((index * 7 + round_index * 13) % 100)
+                ai_score = float((index * 11 + round_index * 5) % 100)
+                rounds.append(GameRound(
+                    user=user,
+                    original_image_url='http://localhost/media/uploads/loadtest.jpg',
+                    player_prompt='loadtest',
+                    player_generated_image_url='http://localhost/media/generated/player.jpg',
+                    player_similarity_score=player_score,
+                    ai_generated_prompt_from_image='loadtest',
+                    ai_generated_image_url='http://localhost/media/generated/ai.jpg',
+                    ai_similarity_score=ai_score,
+                    winner='player' if player_score > ai_score else 'ai' if ai_score > player_score else 'draw',
+                ))
+        GameRound.objects.bulk_create(rounds, batch_size=1000)
+        return tokens
+
+    @staticmethod
+    def client_for(token: str) -> Client:
+        # 使用 localhost 作为主机名：start_game 返回的图片 URL 需要通过 URLField 校验（testserver 没有顶级域名）
+        return Client(HTTP_AUTHORIZATION=f"Token {token}", SERVER_NAME='localhost')
+
+    @staticmethod
+    def async_client_for(token: str) -> AsyncClient:
+        return TokenAsyncClient(token)
+
+    def drive(self, send, tokens: list[str], concurrency: int, total: int) -> dict:
+        """
+        用 concurrency 个线程一共发送 total 个请求，记录每个请求的延迟、状态码和数据库查询次数。
+        """
+        samples = []
+        samples_lock = threading.Lock()
+        counter = iter(range(total))
+        counter_lock = threading.Lock()
+
+        def worker(worker_index: int):
+            client = self.client_for(tokens[worker_index % len(tokens)])
+            try:
+                while True:
+                    with counter_lock:
+                        if next(counter, None) is None:
+                            return
+                    with CaptureQueriesContext(connections['default']) as queries:
+                        started = time.perf_counter()
+                        try:
+                            status_code = send(client).status_code
+                        except Exception as e:
+                            self.stderr.write(f"请求异常: {e}")
+                            status_code = 0
+                        elapsed = time.perf_counter() - started
+                    with samples_lock:
+                        samples.append((elapsed, status_code, len(queries.captured_queries)))
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, range(concurrency)))
+        return self.summarize(samples, time.perf_counter() - started)
+
+    def drive_async(self, send, tokens: list[str], concurrency: int, total: int) -> dict:
+        """
+        在一个事件循环中同时保持 concurrency 个请求，一共发送 total 个请求。
+        数据库查询在各请求自己的线程中执行，无法按请求统计查询次数，报告中记为 None。
+        """
+        samples = []
+        counter = iter(range(total))
+
+        async def worker(worker_index: int):
+            client = self.async_client_for(tokens[worker_index % len(tokens)])
+            while next(counter, None) is not None:
+                started = time.perf_counter()
+                try:
+                    status_code = (await send(client)).status_code
+                except Exception as e:
+                    self.stderr.write(f"请求异常: {e}")
+                    status_code = 0
+                samples.append((time.perf_counter() - started, status_code, None))
+
+        async def run():
+            await asyncio.gather(*(worker(index) for index in range(concurrency)))
+
+        started = time.perf_counter()
+        asyncio.run(run())
+        return self.summarize(samples, time.perf_counter() - started)
+
+    @staticmethod
+    def summarize(samples: list[tuple], wall_time: float) -> dict:
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        statuses = Counter(sample[1] for sample in samples)
+        query_counts = [sample[2] for sample in samples if sample[2] is not None]
+        return {
+            'requests': len(samples),
+            'errors': sum(count for code, count in statuses.items() if not 200 <= code < 300),
+            'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+            'wall_time_s': round(wall_time, 3),
+            'throughput_rps': round(len(samples) / wall_time, 2) if wall_time else 0,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 0.50) or 0, 2),
+                'p95': round(percentile(latencies, 0.95) or 0, 2),
+                'p99': round(percentile(latencies, 0.99) or 0, 2),
+                'max': round(latencies[-1], 2) if latencies else 0,
+                'mean': round(sum(latencies) / len(latencies), 2) if latencies else 0,
+            },
+            'queries_per_request': round(sum(query_counts) / len(query_counts), 2) if query_counts else None,
+        }
+
+    @staticmethod
+    def git_commit() -> str | None:
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, text=True, stderr=subprocess.DEVNULL
+            ).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
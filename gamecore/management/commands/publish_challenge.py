@@ -0,0 +1,44 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from gamecore.challenges import publish_challenge
+
+
+class Command(BaseCommand):
+    help = "发布每日挑战：一次性计算好 AI 一方（识图、AI 生图和得分），所有玩家共用。可以用 cron 每天提前执行。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="挑战日期（YYYY-MM-DD），默认为明天")
+        parser.add_argument('--image-url', default='', help="原图 URL，不指定时随机生成一张")
+        parser.add_argument('--language', choices=['en', 'zh'], default='en', help="AI 识图提示词使用的语言")
+        parser.add_argument('--char-limit', type=int, default=20, help="提示词的最大字符数")
+        parser.add_argument('--replace', action='store_true', help="覆盖当天已有的挑战（会清除已有成绩，已有回合保留为普通对局；今天已经开放的挑战不能覆盖）")
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                date = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"无效的日期：{options['date']}")
+        else:
+            date = timezone.localdate() + datetime.timedelta(days=1)
+
+        try:
+            challenge = publish_challenge(
+                date,
+                original_image_url=options['image_url'],
+                language=options['language'],
+                char_limit=options['char_limit'],
+                replace=options['replace'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        except Exception as e:
+            raise CommandError(f"发布挑战失败: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"已发布 {challenge.date} 的挑战：AI 提示词 “{challenge.ai_generated_prompt_from_image}”，"
+            f"AI 得分 {challenge.ai_similarity_score}"
+        ))
@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from gamecore.models import GameRound
+from gamecore.stats import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = "按历史回合重新计算用户的战绩汇总（UserStats），用于补齐上线前的数据或修复不一致。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="只重算这些用户，默认重算所有玩过游戏的用户")
+
+    def handle(self, *args, **options):
+        if options['usernames']:
+            user_ids = list(
+                get_user_model().objects.filter(username__in=options['usernames']).values_list('pk', flat=True)
+            )
+        else:
+            user_ids = list(GameRound.objects.values_list('user_id', flat=True).distinct().order_by('user_id'))
+
+        for count, user_id in enumerate(user_ids, start=1):
+            rebuild_user_stats(user_id)
+            if count % 100 == 0:
+                self.stdout.write(f"已处理 {count}/{len(user_ids)} 个用户")
+
+        self.stdout.write(self.style.SUCCESS(f"已重新计算 {len(user_ids)} 个用户的战绩汇总。"))
@@ -0,0 +1,40 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from gamecore.models import TournamentSession
+from gamecore.tournaments import requeue_session
+
+
+class Command(BaseCommand):
+    help = (
+        "重新准备卡在 preparing 状态的锦标赛（准备任务在内存中排队，进程重启后会丢失），"
+        "已经准备好的轮次保留，只计算剩下的轮次。可以在部署后或用 cron 定期执行。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=float, default=None,
+            help="只处理创建超过这么多秒的锦标赛，默认为准备时间预算的两倍（避免和正在准备的任务重复）",
+        )
+        parser.add_argument('--include-failed', action='store_true', help="同时重新准备失败的锦标赛")
+
+    def handle(self, *args, **options):
+        older_than = options['older_than']
+        if older_than is None:
+            older_than = 2 * settings.TOURNAMENT_PREPARE_DEADLINE
+        statuses = ['preparing', 'failed'] if options['include_failed'] else ['preparing']
+        cutoff = timezone.now() - datetime.timedelta(seconds=older_than)
+        sessions = list(TournamentSession.objects.filter(status__in=statuses, created_at__lt=cutoff).order_by('pk'))
+
+        for session in sessions:
+            requeue_session(session)
+            session.refresh_from_db(fields=['status', 'error'])
+            if session.status == 'ready':
+                self.stdout.write(f"锦标赛 {session.pk} 已准备好")
+            else:
+                self.stdout.write(self.style.WARNING(f"锦标赛 {session.pk} 仍然失败：{session.error}"))
+
+        self.stdout.write(self.style.SUCCESS(f"已重新准备 {len(sessions)} 场锦标赛。"))
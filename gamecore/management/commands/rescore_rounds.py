@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from gamecore import ai_services
+from gamecore.rescoring import Checkpoint, Rescorer
+
+
+class Command(BaseCommand):
+    help = (
+        "用指定的 CLIP 模型重新计算历史回合的相似度得分和胜负，并刷新依赖得分的汇总数据。"
+        "已经用该模型打过分的回合会被跳过；配合 --checkpoint 可以在中断后继续。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=settings.CLIP_MODEL_NAME,
+                            help="打分使用的模型名称，默认为 CLIP_MODEL_NAME")
+        parser.add_argument('--checkpoint', default='', help="检查点文件路径，存在时从中记录的位置继续")
+        parser.add_argument('--chunk-size', type=int, default=256, help="每批读取的回合数")
+        parser.add_argument('--fetch-workers', type=int, default=16, help="同时下载的图片数")
+        parser.add_argument('--batch-size', type=int, default=128, help="每次 encode 的图片数")
+        parser.add_argument('--limit', type=int, help="最多处理的回合数（用于试运行）")
+        parser.add_argument('--force', action='store_true', help="已经用该模型打过分的回合也重新计算")
+
+    def handle(self, *args, **options):
+        model_name = options['model']
+        model = self.load_model(model_name)
+        # 得分按“模型 + 打分输入版本”标记，输入版本变化后同一个模型也会重新打分
+        tag = ai_services.score_tag(model_name)
+
+        try:
+            checkpoint = Checkpoint.load(options['checkpoint'], tag)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if checkpoint.last_id:
+            self.stdout.write(f"从检查点继续：id > {checkpoint.last_id}")
+
+        rescorer = Rescorer(
+            model,
+            tag,
+            chunk_size=options['chunk_size'],
+            fetch_workers=options['fetch_workers'],
+            batch_size=options['batch_size'],
+            force=options['force'],
+            log=self.stdout.write,
+        )
+        checkpoint = rescorer.run(checkpoint, options['checkpoint'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            f"重新打分完成：更新 {checkpoint.updated} 轮，失败 {checkpoint.failed} 轮。"
+        ))
+        if model_name != ai_services.clip_model_name:
+            self.stdout.write(self.style.WARNING(
+                f"请把 CLIP_MODEL_NAME 设置为 {model_name} 并重启服务，新回合才会使用同一个模型打分。"
+            ))
+
+    def load_model(self, model_name: str):
+        # 重新打分在本进程中批量编码，不经过打分进程池
+        if model_name == ai_services.clip_model_name and ai_services.get_clip_model():
+            return ai_services.clip_model
+        try:
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(model_name)
+        except Exception as e:
+            raise CommandError(f"加载模型 {model_name} 失败: {e}")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from gamecore.stub_ark import StubArkServer, StubConfig
+
+
+class Command(BaseCommand):
+    help = "启动本地的 Ark 桩服务（支持延迟和故障注入），用于测试容错逻辑和压测。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=StubConfig.latency, help="基础延迟（秒）")
+        parser.add_argument('--jitter', type=float, default=StubConfig.jitter, help="延迟抖动（对数正态 sigma）")
+        parser.add_argument('--image-latency', type=float, default=StubConfig.image_latency, help="文生图额外延迟（秒）")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="返回 500 的比例")
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="返回 429 的比例")
+        parser.add_argument('--hang-rate', type=float, default=0.0, help="挂起不响应的比例")
+
+    def handle(self, *args, **options):
+        config = StubConfig(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            image_latency=options['image_latency'],
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            hang_rate=options['hang_rate'],
+        )
+        server = StubArkServer(options['host'], options['port'], config)
+        self.stdout.write(self.style.SUCCESS(
+            f"Ark 桩服务已启动，请设置 ARK_BASE_URL={server.base_url}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,229 @@
+"""
+轻量的进程内指标收集，以 Prometheus 文本格式导出（/metrics）。
+
+- stage_seconds：各阶段耗时直方图（识图、文生图、图片下载、CLIP 编码……），按模型和成功/失败区分；
+- request_seconds：各 API 视图的总耗时直方图；
+- cache_requests_total：各缓存的命中/未命中次数，用于计算命中率；
+- db_connections_total / db_pool_connections：数据库连接的建立次数与连接池的占用情况（见 gamecore/db.py）。
+
+每次记录只有一次 perf_counter 和一次加锁累加，相对于动辄数秒的 AI 请求可以忽略不计。
+指标保存在当前进程内，多进程部署时 Prometheus 每次抓取到的是其中一个进程的数据。
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# 默认的耗时分桶（秒），覆盖从毫秒级的数据库操作到分钟级的文生图
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+trace_logger = logging.getLogger('gamecore.trace')
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # 标签值元组 -> [各分桶计数..., +Inf 计数, 总和]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    def summary(self) -> list[dict]:
+        """
+        返回每组标签的调用次数与总耗时，便于在压测报告中对比。
+        """
+        with self._lock:
+            items = [(key, sum(state[:-1]), state[-1]) for key, state in self._values.items()]
+        return [
+            {**dict(zip(self.labelnames, key)), 'count': count, 'sum': total}
+            for key, count, total in items
+        ]
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        bucket_labelnames = self.labelnames + ('le',)
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labelnames, key + (bound,))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {state[-1]}")
+        return lines
+
+
+class Gauge:
+    """
+    抓取时才计算数值的指标：callback 返回 [(标签值元组, 数值), ...]。
+    适合连接池占用这类本来就由其他组件维护的状态，不需要在每次变化时更新。
+    """
+
+    def __init__(self, name: str, documentation: str, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in self.callback():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    'gamecore_stage_seconds',
+    'Time spent in each stage of a game request.',
+    labelnames=('stage', 'model', 'outcome'),
+))
+request_seconds = registry.register(Histogram(
+    'gamecore_request_seconds',
+    'Total time spent handling a gamecore API request.',
+    labelnames=('view', 'status'),
+))
+cache_requests = registry.register(Counter(
+    'gamecore_cache_requests_total',
+    'Cache lookups by cache name and result (hit/miss).',
+    labelnames=('cache', 'result'),
+))
+db_connections = registry.register(Counter(
+    'gamecore_db_connections_total',
+    'Database connections set up by Django (checkouts in pooled mode; reused persistent connections are not counted).',
+    labelnames=('alias',),
+))
+
+
+# --- 单次请求的追踪 ---
+# 当前请求内记录的阶段列表；没有活动的追踪时为 None，timed 只记直方图
+_current_spans: ContextVar[list | None] = ContextVar('gamecore_trace_spans', default=None)
+
+
+@contextmanager
+def timed(stage: str, model: str = ''):
+    """
+    记录一个阶段的耗时。代码块抛出异常时 outcome 记为 failure。
+    也可以在代码块内把 outcome 改为 failure（例如服务函数返回 None 表示失败时）：
+        with metrics.timed('vision', model) as span:
+            ...
+            span['outcome'] = 'failure'
+    """
+    span = {'stage': stage, 'model': model, 'outcome': 'success'}
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span['outcome'] = 'failure'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage, model=model, outcome=span['outcome'])
+        spans = _current_spans.get()
+        if spans is not None:
+            span['ms'] = round(elapsed * 1000, 1)
+            spans.append(span)
+
+
+def record_cache(cache: str, hit: bool):
+    """
+    记录一次缓存查找的结果。
+    """
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def start_trace():
+    """
+    开始记录当前请求的阶段追踪，返回交给 finish_trace 的句柄。
+    """
+    return _current_spans.set([]), time.perf_counter()
+
+
+def finish_trace(handle, view: str, status_code: int, **fields):
+    """
+    结束追踪：记录请求总耗时；启用了 METRICS_TRACE_LOG 时把本次请求的各阶段耗时输出为一行 JSON 日志。
+    """
+    token, started = handle
+    elapsed = time.perf_counter() - started
+    spans = _current_spans.get()
+    _current_spans.reset(token)
+    request_seconds.observe(elapsed, view=view, status=str(status_code))
+    if settings.METRICS_TRACE_LOG:
+        trace_logger.info(json.dumps({
+            'view': view,
+            'status': status_code,
+            'ms': round(elapsed * 1000, 1),
+            'spans': spans or [],
+            **fields,
+        }, ensure_ascii=False))
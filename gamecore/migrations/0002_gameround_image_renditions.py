@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamecore', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameround',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, help_text="本轮各图片的衍生图URL，结构为 {'original': {'play_webp': url, ...}, ...}。"),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamecore', '0002_gameround_image_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TournamentSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('preparing', '准备中'), ('ready', '进行中'), ('finished', '已结束'), ('failed', '准备失败')], db_index=True, default='preparing', max_length=10)),
+                ('language', models.CharField(default='en', help_text='AI 识图提示词使用的语言。', max_length=5)),
+                ('char_limit', models.PositiveSmallIntegerField(default=20, help_text='玩家和 AI 提示词的最大字符数。')),
+                ('round_count', models.PositiveSmallIntegerField(help_text='本次锦标赛的轮数。')),
+                ('error', models.TextField(blank=True, default='', help_text='准备失败时的错误信息。')),
+                ('rounds_played', models.PositiveSmallIntegerField(default=0)),
+                ('player_total_score', models.FloatField(default=0.0)),
+                ('ai_total_score', models.FloatField(default=0.0)),
+                ('player_wins', models.PositiveSmallIntegerField(default=0)),
+                ('ai_wins', models.PositiveSmallIntegerField(default=0)),
+                ('draws', models.PositiveSmallIntegerField(default=0)),
+                ('winner', models.CharField(blank=True, choices=[('player', '玩家胜利'), ('ai', 'AI胜利'), ('draw', '平局')], help_text='按总分判定的锦标赛胜负，结束后填写。', max_length=10, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(help_text='参加锦标赛的用户。', on_delete=django.db.models.deletion.CASCADE, related_name='tournament_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TournamentRound',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField(help_text='本轮在锦标赛中的序号，从 0 开始。')),
+                ('original_image_url', models.TextField(blank=True, default='', help_text='本轮原图的URL（未指定时在准备阶段随机生成）。')),
+                ('image_renditions', models.JSONField(blank=True, default=dict, help_text='原图和 AI 生成图的衍生图URL，结构与 GameRound.image_renditions 相同。')),
+                ('original_embedding', models.BinaryField(blank=True, help_text='原图的 CLIP 嵌入（归一化后的 float32 向量），玩家回合打分时直接使用。', null=True)),
+                ('ai_generated_prompt_from_image', models.TextField(blank=True, default='')),
+                ('ai_generated_image_url', models.TextField(blank=True, default='')),
+                ('ai_similarity_score', models.FloatField(blank=True, null=True)),
+                ('game_round', models.OneToOneField(blank=True, help_text='玩家提交本轮后生成的游戏记录。', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tournament_round', to='gamecore.gameround')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rounds', to='gamecore.tournamentsession')),
+            ],
+            options={
+                'ordering': ['session', 'index'],
+                'constraints': [models.UniqueConstraint(fields=('session', 'index'), name='unique_tournament_round_index')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamecore', '0003_tournaments'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyChallenge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='挑战日期，每天一个挑战。', unique=True)),
+                ('original_image_url', models.TextField(help_text='挑战原图的URL。')),
+                ('image_renditions', models.JSONField(blank=True, default=dict, help_text='原图和 AI 生成图的衍生图URL，结构与 GameRound.image_renditions 相同。')),
+                ('original_embedding', models.BinaryField(blank=True, help_text='原图的 CLIP 嵌入（归一化后的 float32 向量），玩家回合打分时直接使用。', null=True)),
+                ('language', models.CharField(default='en', help_text='AI 识图提示词使用的语言。', max_length=5)),
+                ('char_limit', models.PositiveSmallIntegerField(default=20, help_text='玩家和 AI 提示词的最大字符数。')),
+                ('ai_generated_prompt_from_image', models.TextField()),
+                ('ai_generated_image_url', models.TextField()),
+                ('ai_similarity_score', models.FloatField()),
+                ('play_count', models.PositiveIntegerField(default=0, help_text='玩家提交的回合总数。')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='gameround',
+            name='daily_challenge',
+            field=models.ForeignKey(blank=True, help_text='本轮所属的每日挑战（普通对局为空）。', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='game_rounds', to='gamecore.dailychallenge'),
+        ),
+        migrations.CreateModel(
+            name='ChallengeEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('best_score', models.FloatField(help_text='玩家在该挑战中的最高相似度得分。')),
+                ('best_at', models.DateTimeField(help_text='取得最高分的时间，同分时先取得的排名靠前。')),
+                ('best_round', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gamecore.gameround')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='challenge_entries', to=settings.AUTH_USER_MODEL)),
+                ('challenge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='gamecore.dailychallenge')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['challenge', '-best_score', 'best_at'], name='challenge_leaderboard_idx')],
+                'constraints': [models.UniqueConstraint(fields=('challenge', 'user'), name='unique_challenge_entry')],
+            },
+        ),
+    ]
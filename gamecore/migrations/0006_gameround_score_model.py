@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:31
+
+from django.db import migrations, models
+
+
+def tag_existing_scores(apps, schema_editor):
+    # 此前的得分都由固定的 clip-ViT-B-32 模型计算。
+    # 双方得分都是 0 的回合是模型加载失败时记录的，不算打过分，留给 rescore_rounds 重新计算
+    GameRound = apps.get_model('gamecore', 'GameRound')
+    GameRound.objects.filter(player_similarity_score__isnull=False).exclude(
+        player_similarity_score=0.0, ai_similarity_score=0.0
+    ).update(score_model='clip-ViT-B-32')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamecore', '0005_user_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameround',
+            name='score_model',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='计算本轮相似度得分所用的模型名称，更换模型后据此找出需要重新打分的回合。', max_length=100),
+        ),
+        migrations.RunPython(tag_existing_scores, migrations.RunPython.noop),
+    ]
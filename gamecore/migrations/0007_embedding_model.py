@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+def tag_existing_embeddings(apps, schema_editor):
+    # 此前保存的嵌入都由固定的 clip-ViT-B-32 模型计算
+    for model_name in ('TournamentRound', 'DailyChallenge'):
+        model = apps.get_model('gamecore', model_name)
+        model.objects.filter(original_embedding__isnull=False).update(embedding_model='clip-ViT-B-32')
+
+
+def untag_unscored_rounds(apps, schema_editor):
+    # 0006 的旧版本把模型加载失败时记录的 0 分回合也标记成了 clip-ViT-B-32，这里撤销，让 rescore_rounds 重新计算
+    GameRound = apps.get_model('gamecore', 'GameRound')
+    GameRound.objects.filter(
+        player_similarity_score=0.0, ai_similarity_score=0.0, score_model='clip-ViT-B-32'
+    ).update(score_model='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamecore', '0006_gameround_score_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailychallenge',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', help_text='计算原图嵌入和 AI 得分所用的模型名称，与当前模型不一致时需要重新计算。', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='tournamentround',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', help_text='计算原图嵌入和 AI 得分所用的模型名称，与当前模型不一致时需要重新计算。', max_length=100),
+        ),
+        migrations.RunPython(tag_existing_embeddings, migrations.RunPython.noop),
+        migrations.RunPython(untag_unscored_rounds, migrations.RunPython.noop),
+    ]
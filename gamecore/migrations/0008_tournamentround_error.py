@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamecore', '0007_embedding_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournamentround',
+            name='error',
+            field=models.TextField(blank=True, default='', help_text='本轮最近一次准备失败时的错误信息。'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from .models import GameRound
+from . import background
+from . import image_processing
+
+# 角色 -> GameRound 上对应的图片 URL 字段
+MIRRORED_FIELDS = {
+    'player': 'player_generated_image_url',
+    'ai': 'ai_generated_image_url',
+}
+
+
+def mirror_round_images(round_id: int, images: dict[str, bytes]) -> None:
+    """
+    把生成图片转存到本站存储，并把 GameRound 中的服务商 URL 改写为本站 URL。
+    除衍生图外还原样保存一份原始图片（重新打分时使用，与实时打分的输入相同）。
+    images 为 {'player': 图片内容, 'ai': 图片内容}，这些内容在打分时已经下载过，这里不再重复下载。
+    """
+    mirrored = {}
+    for role, content in images.items():
+        if role not in MIRRORED_FIELDS or not content:
+            continue
+        saved_paths = image_processing.save_renditions(content, prefix='generated', keep_source=True)
+        mirrored[role] = {name: image_processing.media_url(path) for name, path in saved_paths.items()}
+
+    if not mirrored:
+        return
+
+    game_round = GameRound.objects.get(pk=round_id)
+    update_fields = ['image_renditions']
+    renditions = dict(game_round.image_renditions or {})
+    for role, urls in mirrored.items():
+        # 用优化后的 512px 主图替换会过期的服务商 URL
+        setattr(game_round, MIRRORED_FIELDS[role], urls[image_processing.MAIN_RENDITION])
+        update_fields.append(MIRRORED_FIELDS[role])
+        renditions[role] = urls
+    game_round.image_renditions = renditions
+    game_round.save(update_fields=update_fields)
+
+
+def schedule_mirror(round_id: int, images: dict[str, bytes]):
+    """
+    在后台转存一轮游戏的生成图片，不阻塞当前请求。
+    """
+    return background.submit(mirror_round_images, round_id, images)
@@ -54,6 +54,31 @@ class GameRound(models.Model):
         help_text="AI生成的图片与原图的相似度得分。"
     )
 
+    # --- 衍生图信息 ---
+    image_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="本轮各图片的衍生图URL，结构为 {'original': {'play_webp': url, ...}, ...}。"
+    )
+
+    score_model = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        db_index=True,
+        help_text="计算本轮相似度得分所用的模型名称，更换模型后据此找出需要重新打分的回合。"
+    )
+
+    # --- 每日挑战 ---
+    daily_challenge = models.ForeignKey(
+        'DailyChallenge',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='game_rounds',
+        help_text="本轮所属的每日挑战（普通对局为空）。"
+    )
+
     # --- 游戏结果信息 ---
     WINNER_CHOICES = [
         ('player', '玩家胜利'),
@@ -75,6 +100,17 @@ class GameRound(models.Model):
         ordering = ['-timestamp']
 
 
+def decide_winner(player_similarity_score: float, ai_similarity_score: float) -> str:
+    """
+    相似度更高的一方获胜，相同则为平局。
+    """
+    if player_similarity_score > ai_similarity_score:
+        return 'player'
+    if ai_similarity_score > player_similarity_score:
+        return 'ai'
+    return 'draw'
+
+
 # --- GameEvent 模型保持不变 ---
 class GameEvent(models.Model):
     user = models.ForeignKey(
@@ -106,4 +142,271 @@ class GameEvent(models.Model):
         return f" [{self.event_type}] by [{user_identifier}] at {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
 
     class Meta:
-        ordering = ['-timestamp']
\ No newline at end of file
+        ordering = ['-timestamp']
+
+# --- 锦标赛模式 ---
+class TournamentSession(models.Model):
+    """
+    一次锦标赛：玩家连续挑战 N 张图片。所有图片的 AI 一方（识图提示词、AI 生成图、嵌入和得分）
+    在开局时由后台批量预先计算，玩家每一轮只需要生成自己的图片并打分。
+    """
+    STATUS_CHOICES = [
+        ('preparing', '准备中'),
+        ('ready', '进行中'),
+        ('finished', '已结束'),
+        ('failed', '准备失败'),
+    ]
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='tournament_sessions',
+        help_text="参加锦标赛的用户。"
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default='preparing',
+        db_index=True,
+    )
+    language = models.CharField(
+        max_length=5,
+        default='en',
+        help_text="AI 识图提示词使用的语言。"
+    )
+    char_limit = models.PositiveSmallIntegerField(
+        default=20,
+        help_text="玩家和 AI 提示词的最大字符数。"
+    )
+    round_count = models.PositiveSmallIntegerField(
+        help_text="本次锦标赛的轮数。"
+    )
+    error = models.TextField(
+        blank=True,
+        default='',
+        help_text="准备失败时的错误信息。"
+    )
+
+    # --- 汇总结果（每提交一次回合后更新） ---
+    rounds_played = models.PositiveSmallIntegerField(default=0)
+    player_total_score = models.FloatField(default=0.0)
+    ai_total_score = models.FloatField(default=0.0)
+    player_wins = models.PositiveSmallIntegerField(default=0)
+    ai_wins = models.PositiveSmallIntegerField(default=0)
+    draws = models.PositiveSmallIntegerField(default=0)
+    winner = models.CharField(
+        max_length=10,
+        choices=GameRound.WINNER_CHOICES,
+        blank=True,
+        null=True,
+        help_text="按总分判定的锦标赛胜负，结束后填写。"
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Tournament #{self.pk} for {self.user.username} ({self.status})"
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class TournamentRound(models.Model):
+    """
+    锦标赛中的一轮。AI 一方的结果在准备阶段写入；玩家提交后创建对应的 GameRound 并关联到这里。
+    """
+    session = models.ForeignKey(
+        TournamentSession,
+        on_delete=models.CASCADE,
+        related_name='rounds',
+    )
+    index = models.PositiveSmallIntegerField(
+        help_text="本轮在锦标赛中的序号，从 0 开始。"
+    )
+    original_image_url = models.TextField(
+        blank=True,
+        default='',
+        help_text="本轮原图的URL（未指定时在准备阶段随机生成）。"
+    )
+    image_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="原图和 AI 生成图的衍生图URL，结构与 GameRound.image_renditions 相同。"
+    )
+    original_embedding = models.BinaryField(
+        blank=True,
+        null=True,
+        help_text="原图的 CLIP 嵌入（归一化后的 float32 向量），玩家回合打分时直接使用。"
+    )
+    embedding_model = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        help_text="计算原图嵌入和 AI 得分所用的模型名称，与当前模型不一致时需要重新计算。"
+    )
+    ai_generated_prompt_from_image = models.TextField(blank=True, default='')
+    ai_generated_image_url = models.TextField(blank=True, default='')
+    ai_similarity_score = models.FloatField(blank=True, null=True)
+    error = models.TextField(
+        blank=True,
+        default='',
+        help_text="本轮最近一次准备失败时的错误信息。"
+    )
+    game_round = models.OneToOneField(
+        GameRound,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='tournament_round',
+        help_text="玩家提交本轮后生成的游戏记录。"
+    )
+
+    def __str__(self):
+        return f"Tournament #{self.session_id} round {self.index}"
+
+    class Meta:
+        ordering = ['session', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='unique_tournament_round_index'),
+        ]
+
+
+# --- 每日挑战 ---
+class DailyChallenge(models.Model):
+    """
+    每日挑战：所有玩家当天挑战同一张原图。AI 一方（识图提示词、AI 生成图和得分）在发布时只计算一次，
+    玩家回合只需要生成自己的图片，和预先保存的原图嵌入比较打分。
+    """
+    date = models.DateField(
+        unique=True,
+        help_text="挑战日期，每天一个挑战。"
+    )
+    original_image_url = models.TextField(
+        help_text="挑战原图的URL。"
+    )
+    image_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="原图和 AI 生成图的衍生图URL，结构与 GameRound.image_renditions 相同。"
+    )
+    original_embedding = models.BinaryField(
+        blank=True,
+        null=True,
+        help_text="原图的 CLIP 嵌入（归一化后的 float32 向量），玩家回合打分时直接使用。"
+    )
+    embedding_model = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        help_text="计算原图嵌入和 AI 得分所用的模型名称，与当前模型不一致时需要重新计算。"
+    )
+    language = models.CharField(
+        max_length=5,
+        default='en',
+        help_text="AI 识图提示词使用的语言。"
+    )
+    char_limit = models.PositiveSmallIntegerField(
+        default=20,
+        help_text="玩家和 AI 提示词的最大字符数。"
+    )
+    ai_generated_prompt_from_image = models.TextField()
+    ai_generated_image_url = models.TextField()
+    ai_similarity_score = models.FloatField()
+    play_count = models.PositiveIntegerField(
+        default=0,
+        help_text="玩家提交的回合总数。"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Daily challenge {self.date}"
+
+    class Meta:
+        ordering = ['-date']
+
+
+class ChallengeEntry(models.Model):
+    """
+    玩家在一个每日挑战中的成绩，每提交一次回合增量更新，作为挑战排行榜的数据来源。
+    """
+    challenge = models.ForeignKey(
+        DailyChallenge,
+        on_delete=models.CASCADE,
+        related_name='entries',
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='challenge_entries',
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    best_score = models.FloatField(
+        help_text="玩家在该挑战中的最高相似度得分。"
+    )
+    best_round = models.ForeignKey(
+        GameRound,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='+',
+    )
+    best_at = models.DateTimeField(
+        help_text="取得最高分的时间，同分时先取得的排名靠前。"
+    )
+
+    def __str__(self):
+        return f"{self.user.username} in {self.challenge}: {self.best_score}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['challenge', 'user'], name='unique_challenge_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['challenge', '-best_score', 'best_at'], name='challenge_leaderboard_idx'),
+        ]
+
+
+# --- 用户统计 ---
+class UserStats(models.Model):
+    """
+    用户战绩的汇总，每创建一个 GameRound 增量更新一次（见 gamecore/stats.py），读取时不需要扫描历史记录。
+    连胜只统计连续的玩家胜利，平局和失败都会中断连胜。
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='game_stats',
+    )
+    total_rounds = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
+    scored_rounds = models.PositiveIntegerField(
+        default=0,
+        help_text="有相似度得分的回合数，用于计算平均分。"
+    )
+    score_sum = models.FloatField(
+        default=0.0,
+        help_text="玩家相似度得分之和。"
+    )
+    best_score = models.FloatField(blank=True, null=True)
+    current_streak = models.PositiveIntegerField(default=0)
+    longest_streak = models.PositiveIntegerField(default=0)
+    last_played_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_score(self) -> float | None:
+        if not self.scored_rounds:
+            return None
+        return round(self.score_sum / self.scored_rounds, 2)
+
+    @property
+    def win_rate(self) -> float | None:
+        if not self.total_rounds:
+            return None
+        return round(self.wins / self.total_rounds, 4)
+
+    def __str__(self):
+        return f"Stats for {self.user.username}"
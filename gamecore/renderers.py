@@ -0,0 +1,42 @@
+"""
+基于 orjson 的 JSON 渲染器，用于高频只读接口。
+
+输出与 DRF 的 JSONRenderer 逐字节相同（紧凑格式、不转义非 ASCII 字符、转义 U+2028 / U+2029）。
+orjson 是可选依赖（pip install orjson）：未安装、需要缩进输出（如可浏览 API 页面），
+或数据中含有 orjson 与标准库写法不同的值（时间、Decimal、StdlibFloat 等非基本类型）时，退回 JSONRenderer。
+
+注意：orjson 对极小、极大的普通浮点数写法与标准库不同（如 1e-05 写作 1e-5），无法在渲染时区分，
+因此只用于由 fast_serializers 生成的数据（这类浮点数已经包装为 StdlibFloat）。
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # 非基本类型（包括 datetime、各种子类）都交给 default，由 default 抛出异常后整体退回 JSONRenderer
+    _ORJSON_OPTIONS = (
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_SUBCLASS | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+
+def _unsupported(value):
+    raise TypeError(f"交给 JSONRenderer 处理: {type(value).__name__}")
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_unsupported, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # 与 JSONRenderer 一致：转义 U+2028 / U+2029，输出严格的 JavaScript 子集
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
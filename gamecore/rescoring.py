@@ -0,0 +1,245 @@
+"""
+用新的相似度模型批量重新计算历史回合的得分（rescore_rounds 管理命令）。
+
+- 按主键分批读取还没有用目标模型打过分的回合（GameRound.score_model 记录得分所用的模型）；
+- 每批的图片用有上限的线程池并发下载（优先使用本站保存的 224px 打分图），同一张图只下载、编码一次；
+- 下载下一批的同时编码当前批，编码按 batch_size 大批进行，得分用 bulk_update 写回；
+- 每批写入后更新检查点文件，中断后可以从检查点继续；
+- 打分输入与实时打分相同：原图使用 SCORE_RENDITION，玩家和 AI 的图片使用转存时保存的原始图片
+  （之前转存的回合没有原始图片，退回到 512px 主图）；
+- 全部完成后用新模型重新计算每日挑战和还没有玩过的锦标赛轮次中预先保存的原图嵌入和 AI 得分，
+  再重新计算受影响的用户战绩、每日挑战成绩和锦标赛汇总。
+  全站排行榜直接按 GameRound 的胜负实时查询，不需要单独刷新。
+"""
+import json
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+from django.db import transaction
+
+from . import ai_services
+from . import challenges
+from . import image_processing
+from . import stats
+from . import tournaments
+from .models import DailyChallenge, GameRound, TournamentRound, TournamentSession, decide_winner
+
+# 参与打分的图片：角色 -> GameRound 上对应的 URL 字段（角色名与 image_renditions 的键一致）
+IMAGE_FIELDS = {
+    'original': 'original_image_url',
+    'player': 'player_generated_image_url',
+    'ai': 'ai_generated_image_url',
+}
+
+
+@dataclass
+class Checkpoint:
+    """
+    重新打分的进度。每处理完一批写入一次文件；受影响的用户、挑战和锦标赛在最后统一刷新。
+    """
+    model: str
+    last_id: int = 0
+    processed: int = 0
+    updated: int = 0
+    failed: int = 0
+    user_ids: set = field(default_factory=set)
+    challenge_ids: set = field(default_factory=set)
+    session_ids: set = field(default_factory=set)
+    refreshed: bool = False
+
+    @classmethod
+    def load(cls, path: str, model: str) -> 'Checkpoint':
+        if not path or not os.path.exists(path):
+            return cls(model=model)
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('model') != model:
+            raise ValueError(f"检查点 {path} 属于模型 {data.get('model')}，与目标模型 {model} 不一致。")
+        for key in ('user_ids', 'challenge_ids', 'session_ids'):
+            data[key] = set(data.get(key, []))
+        return cls(**data)
+
+    def save(self, path: str) -> None:
+        if not path:
+            return
+        data = asdict(self)
+        for key in ('user_ids', 'challenge_ids', 'session_ids'):
+            data[key] = sorted(data[key])
+        # 先写临时文件再替换，中断时不会留下写了一半的检查点
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+def scoring_source(game_round: GameRound, role: str) -> str:
+    """
+    打分用的图片地址，与实时打分的输入相同（见 image_processing.scoring_source）。
+    """
+    return image_processing.scoring_source(
+        game_round.image_renditions, role, getattr(game_round, IMAGE_FIELDS[role]) or ''
+    )
+
+
+def _fetch_or_none(url: str) -> bytes | None:
+    try:
+        return image_processing.fetch_image_bytes(url)
+    except Exception as e:
+        print(f"下载图片失败，跳过: {url}: {e}")
+        return None
+
+
+class Rescorer:
+    """
+    用 model（名称为 model_name）重新计算回合得分。fetch_workers 限制同时下载的图片数，
+    chunk_size 为每批读取的回合数，batch_size 为每次 encode 的图片数。
+    """
+
+    def __init__(self, model, model_name: str, chunk_size: int = 256, fetch_workers: int = 16,
+                 batch_size: int = 128, force: bool = False, log=print):
+        self.model = model
+        self.model_name = model_name
+        self.chunk_size = chunk_size
+        self.fetch_workers = fetch_workers
+        self.batch_size = batch_size
+        self.force = force
+        self.log = log
+
+    def chunks(self, checkpoint: Checkpoint, limit: int | None = None):
+        queryset = GameRound.objects.order_by('id').only(
+            'id', 'user_id', 'daily_challenge_id', 'image_renditions', *IMAGE_FIELDS.values()
+        )
+        if not self.force:
+            queryset = queryset.exclude(score_model=self.model_name)
+        remaining = limit
+        last_id = checkpoint.last_id
+        while remaining is None or remaining > 0:
+            size = self.chunk_size if remaining is None else min(self.chunk_size, remaining)
+            chunk = list(queryset.filter(id__gt=last_id)[:size])
+            if not chunk:
+                return
+            last_id = chunk[-1].id
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+    def run(self, checkpoint: Checkpoint, checkpoint_path: str = '', limit: int | None = None) -> Checkpoint:
+        with ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='gamecore-rescore') as pool:
+            # 流水线：提交下一批的下载后，再编码并写回上一批
+            pending = None
+            for chunk in self.chunks(checkpoint, limit):
+                downloads = self.start_downloads(chunk, pool)
+                if pending is not None:
+                    self.finish_chunk(*pending, checkpoint, checkpoint_path)
+                pending = (chunk, downloads)
+            if pending is not None:
+                self.finish_chunk(*pending, checkpoint, checkpoint_path)
+
+        self.refresh(checkpoint, checkpoint_path)
+        return checkpoint
+
+    def start_downloads(self, chunk: list[GameRound], pool: ThreadPoolExecutor) -> dict:
+        urls = {scoring_source(game_round, role) for game_round in chunk for role in IMAGE_FIELDS}
+        urls.discard('')
+        return {url: pool.submit(_fetch_or_none, url) for url in urls}
+
+    def finish_chunk(self, chunk: list[GameRound], downloads: dict, checkpoint: Checkpoint,
+                     checkpoint_path: str) -> None:
+        images = {url: future.result() for url, future in downloads.items()}
+        images = {url: content for url, content in images.items() if content is not None}
+
+        # 同一张图片（如每日挑战的原图）只编码一次
+        urls = list(images)
+        position = {url: i for i, url in enumerate(urls)}
+        try:
+            embeddings = ai_services.encode_images(
+                [images[url] for url in urls], model=self.model, batch_size=self.batch_size
+            )
+        except Exception as e:
+            print(f"编码图片时发生错误: {e}")
+            traceback.print_exc()
+            embeddings = None
+
+        updated = []
+        for game_round in chunk:
+            sources = [scoring_source(game_round, role) for role in IMAGE_FIELDS]
+            if embeddings is None or not all(source in position for source in sources):
+                checkpoint.failed += 1
+                continue
+            original, player, ai = (embeddings[position[source]] for source in sources)
+            game_round.player_similarity_score = ai_services.similarity_from_embeddings(original, player)
+            game_round.ai_similarity_score = ai_services.similarity_from_embeddings(original, ai)
+            game_round.winner = decide_winner(game_round.player_similarity_score, game_round.ai_similarity_score)
+            game_round.score_model = self.model_name
+            updated.append(game_round)
+
+        with transaction.atomic():
+            GameRound.objects.bulk_update(
+                updated,
+                fields=['player_similarity_score', 'ai_similarity_score', 'winner', 'score_model'],
+                batch_size=500,
+            )
+        round_ids = [game_round.id for game_round in updated]
+        checkpoint.user_ids.update(game_round.user_id for game_round in updated)
+        checkpoint.challenge_ids.update(
+            game_round.daily_challenge_id for game_round in updated if game_round.daily_challenge_id
+        )
+        checkpoint.session_ids.update(
+            TournamentRound.objects.filter(game_round_id__in=round_ids).values_list('session_id', flat=True)
+        )
+        checkpoint.last_id = chunk[-1].id
+        checkpoint.processed += len(chunk)
+        checkpoint.updated += len(updated)
+        checkpoint.save(checkpoint_path)
+        self.log(
+            f"已处理到 id={checkpoint.last_id}：共 {checkpoint.processed} 轮，"
+            f"更新 {checkpoint.updated} 轮，失败 {checkpoint.failed} 轮"
+        )
+
+    def reembed_targets(self):
+        """
+        预先保存了原图嵌入、需要用新模型重新计算的对象：每日挑战，以及还没有玩过的锦标赛轮次。
+        """
+        challenges_qs = DailyChallenge.objects.order_by('id')
+        rounds_qs = TournamentRound.objects.filter(
+            game_round__isnull=True, session__status='ready'
+        ).order_by('id')
+        if not self.force:
+            challenges_qs = challenges_qs.exclude(embedding_model=self.model_name)
+            rounds_qs = rounds_qs.exclude(embedding_model=self.model_name)
+        yield from challenges_qs.iterator()
+        yield from rounds_qs.iterator()
+
+    def refresh(self, checkpoint: Checkpoint, checkpoint_path: str = '') -> None:
+        """
+        用新模型重新计算每日挑战和未玩过的锦标赛轮次的原图嵌入，
+        再重新计算依赖得分的汇总数据：用户战绩、每日挑战成绩、锦标赛汇总。
+        """
+        reembedded = failed = 0
+        for target in self.reembed_targets():
+            try:
+                tournaments.reembed_ai_side(target, model=self.model, model_name=self.model_name)
+                reembedded += 1
+            except Exception as e:
+                print(f"重新计算 {target} 的原图嵌入失败: {e}")
+                failed += 1
+        self.log(f"已重新计算 {reembedded} 个每日挑战或锦标赛轮次的原图嵌入，失败 {failed} 个")
+
+        for user_id in sorted(checkpoint.user_ids):
+            stats.rebuild_user_stats(user_id)
+        for challenge_id in sorted(checkpoint.challenge_ids):
+            challenges.rebuild_entries(challenge_id)
+        for session in TournamentSession.objects.filter(pk__in=checkpoint.session_ids):
+            with transaction.atomic():
+                tournaments.update_totals(session)
+        self.log(
+            f"已刷新 {len(checkpoint.user_ids)} 个用户的战绩、{len(checkpoint.challenge_ids)} 个每日挑战、"
+            f"{len(checkpoint.session_ids)} 场锦标赛"
+        )
+        checkpoint.user_ids.clear()
+        checkpoint.challenge_ids.clear()
+        checkpoint.session_ids.clear()
+        checkpoint.refreshed = True
+        checkpoint.save(checkpoint_path)
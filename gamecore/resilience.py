@@ -0,0 +1,392 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断器处于打开状态：上游服务近期持续失败，本次调用被直接拒绝，不再等待超时。
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"上游服务 {name} 暂时不可用（熔断中），请在 {retry_after:.0f} 秒后重试。")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """
+    本次请求的时间预算已经用完，不再发起新的上游调用。
+    """
+
+
+class Deadline:
+    """
+    端到端的时间预算。一个回合创建一个 Deadline，各阶段从中切出自己的份额。
+    """
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def split(self, share: float) -> 'Deadline':
+        """
+        切出剩余时间的一部分作为某个阶段的预算，其余时间留给后续阶段。
+        """
+        return Deadline(self.remaining() * share)
+
+    def timeout(self, cap: float) -> float:
+        """
+        单次调用的超时时间：不超过 cap，也不超过剩余预算。
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("请求的时间预算已用完。")
+        return min(cap, remaining)
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后打开，期间所有调用立即失败；
+    冷却时间过后进入半开状态，只放行一个试探请求，成功则关闭，失败则重新打开。
+    状态保存在当前进程内。
+    """
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.recovery_timeout or self._probing:
+                raise CircuitOpenError(self.name, max(1.0, self.recovery_timeout - elapsed))
+            # 半开：放行当前这一个试探请求
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    print(f"熔断器 {self.name} 已打开，{self.recovery_timeout:.0f} 秒内的调用将直接失败。")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """
+        试探请求被取消（没有结果）时调用，让下一次调用可以重新试探。
+        """
+        with self._lock:
+            self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+
+class LatencyTracker:
+    """
+    记录最近若干次成功调用的耗时，用于估算 p95，作为发起对冲请求的阈值。
+    """
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        with self._lock:
+            if len(self._samples) < 20:
+                # 样本太少时不估计，避免过早对冲
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+# 对冲请求使用的线程池。落后的那个请求无法中途取消，会在后台自然结束，期间一直占用线程，
+# 所以另外记录空闲的线程数：没有空闲线程时不对冲，而不是让新的调用排在被放弃的请求后面。
+_hedge_pool = None
+_hedge_pool_size = None
+_hedge_free_threads = None
+_hedge_pool_lock = threading.Lock()
+
+_breakers = {}
+_trackers = {}
+_registry_lock = threading.Lock()
+
+# 当前请求向上游发起的调用次数（见 track_upstream_attempts）
+_upstream_attempts = contextvars.ContextVar('gamecore_upstream_attempts', default=None)
+
+
+class UpstreamAttempts:
+    count = 0
+
+
+def track_upstream_attempts() -> UpstreamAttempts:
+    """
+    开始记录当前上下文中 call/acall 实际发起的上游调用次数（被熔断器拒绝的不算）。
+    在请求开始时调用；同一上下文中创建的协程任务共享同一个计数，准入控制据此判断失败的请求能否归还令牌。
+    """
+    attempts = UpstreamAttempts()
+    _upstream_attempts.set(attempts)
+    return attempts
+
+
+def _record_attempt() -> None:
+    attempts = _upstream_attempts.get()
+    if attempts is not None:
+        attempts.count += 1
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=settings.ARK_BREAKER_FAILURES,
+                recovery_timeout=settings.ARK_BREAKER_RECOVERY,
+            )
+        return _breakers[name]
+
+
+def get_tracker(name: str) -> LatencyTracker:
+    with _registry_lock:
+        return _trackers.setdefault(name, LatencyTracker())
+
+
+def _get_hedge_pool() -> tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    global _hedge_pool, _hedge_pool_size, _hedge_free_threads
+    # 每个进行中的上游调用最多占用两个线程（主请求和对冲请求），上游调用数由调度器
+    # （UPSTREAM_MAX_CONCURRENT）限制，不做调度时由 AI 接口的并发名额（AI_MAX_CONCURRENT）限制
+    size = 2 * max(1, settings.UPSTREAM_MAX_CONCURRENT or settings.AI_MAX_CONCURRENT)
+    with _hedge_pool_lock:
+        if _hedge_pool is None or _hedge_pool_size != size:
+            _hedge_pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix='gamecore-hedge')
+            _hedge_free_threads = threading.BoundedSemaphore(size)
+            _hedge_pool_size = size
+        return _hedge_pool, _hedge_free_threads
+
+
+def _submit(fn, timeout: float):
+    """
+    在对冲线程池中执行 fn(timeout)，没有空闲线程时返回 None。请求结束（包括被放弃后在后台结束）时归还线程。
+    """
+    pool, free_threads = _get_hedge_pool()
+    if not free_threads.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            return fn(timeout)
+        finally:
+            free_threads.release()
+    return pool.submit(run)
+
+
+def _reserve_hedge_slot():
+    """
+    对冲请求是一次额外的上游调用，需要另外占用一个调度名额（不排队）。返回归还名额的函数，没有空闲名额时返回 None。
+    """
+    # scheduling 依赖本模块的 Deadline，这里在调用时再导入
+    from . import scheduling
+    return scheduling.try_reserve()
+
+
+def _release_when_both_done(primary, hedge, release) -> None:
+    """
+    两个请求都结束后才归还对冲请求占用的调度名额：调用方返回时会归还自己的名额，
+    而先返回的不一定是主请求，落后的那个请求在后台继续运行期间仍占用一个名额。
+    """
+    lock = threading.Lock()
+    finished = []
+
+    def on_done(_):
+        with lock:
+            finished.append(True)
+            last = len(finished) == 2
+        if last:
+            release()
+    primary.add_done_callback(on_done)
+    hedge.add_done_callback(on_done)
+
+
+def _hedged(name: str, fn, timeout: float):
+    """
+    先发出一个请求；如果它在 p95 耗时内还没返回，就再发一个相同的请求，取先成功的那个结果。
+    没有空闲的线程或调度名额时不对冲，只等待第一个请求。
+    """
+    threshold = get_tracker(name).percentile(0.95)
+    if threshold is None or threshold >= timeout:
+        return fn(timeout)
+
+    started = time.monotonic()
+    primary = _submit(fn, timeout)
+    if primary is None:
+        return fn(timeout)
+    done, _ = wait([primary], timeout=threshold)
+    if done:
+        return primary.result()
+
+    release = _reserve_hedge_slot()
+    if release is None:
+        return primary.result()
+    hedge = _submit(fn, max(0.1, timeout - (time.monotonic() - started)))
+    if hedge is None:
+        release()
+        return primary.result()
+    _release_when_both_done(primary, hedge, release)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call(name: str, fn, deadline: Deadline | None = None, is_transient=lambda e: True,
+         timeout: float = 180.0, hedge: bool = False):
+    """
+    以熔断、重试、超时预算（以及可选的对冲请求）保护一次上游调用。
+    fn 接收本次尝试的超时时间（秒）作为唯一参数。
+    - 熔断器打开时立即抛出 CircuitOpenError；
+    - 临时错误按带随机抖动的指数退避重试，剩余预算不足以再试一次时停止；
+    - 非临时错误（如 4xx 参数错误）不重试、也不计入熔断。
+    """
+    breaker = get_breaker(name)
+    tracker = get_tracker(name)
+    deadline = deadline or Deadline(timeout)
+    attempts = settings.ARK_RETRIES + 1
+
+    for attempt in range(attempts):
+        attempt_timeout = deadline.timeout(timeout)
+        breaker.before_call()
+        _record_attempt()
+        started = time.monotonic()
+        try:
+            if hedge:
+                result = _hedged(name, fn, attempt_timeout)
+            else:
+                result = fn(attempt_timeout)
+        except Exception as e:
+            if not is_transient(e):
+                # 服务有正常响应（只是请求本身有问题），说明上游是健康的
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            delay = settings.ARK_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if attempt == attempts - 1 or deadline.remaining() <= delay:
+                raise
+            print(f"调用 {name} 失败（第 {attempt + 1} 次），{delay:.2f} 秒后重试: {e}")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        tracker.record(time.monotonic() - started)
+        return result
+
+
+async def _ahedged(name: str, fn, timeout: float):
+    """
+    _hedged 的异步版本。先返回的请求成功后，落后的那个请求会被直接取消。
+    对冲请求同样需要空闲的调度名额，两个请求都结束（或被取消）后归还。
+    """
+    threshold = get_tracker(name).percentile(0.95)
+    if threshold is None or threshold >= timeout:
+        return await fn(timeout)
+
+    started = time.monotonic()
+    primary = asyncio.ensure_future(fn(timeout))
+    done, _ = await asyncio.wait([primary], timeout=threshold)
+    if done:
+        return primary.result()
+
+    release = _reserve_hedge_slot()
+    if release is None:
+        return await primary
+    hedge = asyncio.ensure_future(fn(max(0.1, timeout - (time.monotonic() - started))))
+    _release_when_both_done(primary, hedge, release)
+    pending = {primary, hedge}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def acall(name: str, fn, deadline: Deadline | None = None, is_transient=lambda e: True,
+                timeout: float = 180.0, hedge: bool = False):
+    """
+    call 的异步版本，供 ASGI 模式下的异步视图使用：fn 是接收超时时间的协程函数，
+    重试之间的等待不占用线程。熔断器和耗时统计与同步版本共用。
+    """
+    breaker = get_breaker(name)
+    tracker = get_tracker(name)
+    deadline = deadline or Deadline(timeout)
+    attempts = settings.ARK_RETRIES + 1
+
+    for attempt in range(attempts):
+        attempt_timeout = deadline.timeout(timeout)
+        breaker.before_call()
+        _record_attempt()
+        started = time.monotonic()
+        try:
+            if hedge:
+                result = await _ahedged(name, fn, attempt_timeout)
+            else:
+                result = await fn(attempt_timeout)
+        except asyncio.CancelledError:
+            # 请求被取消（例如并行的另一个分支失败），不计入成功或失败
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if not is_transient(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            delay = settings.ARK_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if attempt == attempts - 1 or deadline.remaining() <= delay:
+                raise
+            print(f"调用 {name} 失败（第 {attempt + 1} 次），{delay:.2f} 秒后重试: {e}")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        tracker.record(time.monotonic() - started)
+        return result
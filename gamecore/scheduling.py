@@ -0,0 +1,272 @@
+"""
+上游 AI 调用（Ark 识图、文生图）的调度：按优先级通道分配名额，通道内按用户公平排队。
+
+识图和文生图除了来自玩家正在等待的回合，还来自开局后的投机执行（speculation）、锦标赛的预先计算
+和每日挑战的发布。原来这些调用直接争抢上游配额，后台任务多的时候玩家回合的延迟也会跟着变长。
+现在每次调用前先在本进程的调度器中占一个名额：
+- 通道按优先级从高到低为 interactive（玩家回合）> speculative（投机执行）> batch（锦标赛、每日挑战）；
+- 本进程同时进行的上游调用不超过 UPSTREAM_MAX_CONCURRENT 个，每个通道最多占用其中
+  UPSTREAM_LANE_SHARES 比例的名额（至少 1 个），低优先级通道占不满的部分留给玩家回合；
+- 有名额空出时先分配给优先级高的通道；同一通道内各用户轮流分配，一个用户排了很多调用也不会挡住其他用户；
+- 调用属于哪个通道、哪个用户由 lane() 设置，没有设置时按 interactive 处理；
+- 排队最多等到本次调用的时间预算（deadline）用完，然后抛出 DeadlineExceeded，与上游超时的处理方式相同。
+UPSTREAM_MAX_CONCURRENT = 0 时不做调度（原来的行为）。
+"""
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from . import metrics
+from .resilience import Deadline, DeadlineExceeded
+
+INTERACTIVE = 'interactive'
+SPECULATIVE = 'speculative'
+BATCH = 'batch'
+# 按优先级从高到低排列
+LANES = (INTERACTIVE, SPECULATIVE, BATCH)
+
+_current_lane: ContextVar[str] = ContextVar('gamecore_upstream_lane', default=INTERACTIVE)
+_current_user: ContextVar[object] = ContextVar('gamecore_upstream_user', default=None)
+
+
+@contextmanager
+def lane(name: str, user=None):
+    """
+    代码块内发起的上游调用属于 name 通道、按 user 排队（通常是用户 id，None 表示匿名或系统任务）。
+    """
+    if name not in LANES:
+        raise ValueError(f"未知的调度通道: {name}")
+    lane_token = _current_lane.set(name)
+    user_token = _current_user.set(user)
+    try:
+        yield
+    finally:
+        _current_user.reset(user_token)
+        _current_lane.reset(lane_token)
+
+
+def bind(fn):
+    """
+    返回在当前通道和用户下执行 fn 的函数。线程池中的线程不继承 contextvars，提交任务前用它包装。
+    """
+    name, user = _current_lane.get(), _current_user.get()
+
+    def run(*args, **kwargs):
+        with lane(name, user):
+            return fn(*args, **kwargs)
+    return run
+
+
+class _Waiter:
+    __slots__ = ('lane', 'user', 'notify', 'granted')
+
+    def __init__(self, lane_name: str, user, notify):
+        self.lane = lane_name
+        self.user = user
+        self.notify = notify
+        self.granted = False
+
+
+class Scheduler:
+    """
+    一个进程内的调度器。同步调用方在线程中等待，异步调用方在事件循环中等待，共用同一组名额。
+    """
+
+    def __init__(self, capacity: int, shares: dict[str, float]):
+        self.capacity = max(1, capacity)
+        self.limits = {
+            name: max(1, min(self.capacity, int(self.capacity * shares.get(name, 1.0))))
+            for name in LANES
+        }
+        self._lock = threading.Lock()
+        self._running = dict.fromkeys(LANES, 0)
+        # 每个通道：用户 -> 该用户排队中的调用；OrderedDict 的顺序即轮转顺序
+        self._queues = {name: OrderedDict() for name in LANES}
+
+    def _dispatch(self) -> None:
+        # 调用方持有 self._lock
+        while sum(self._running.values()) < self.capacity:
+            for name in LANES:
+                queue = self._queues[name]
+                if queue and self._running[name] < self.limits[name]:
+                    user, waiters = next(iter(queue.items()))
+                    waiter = waiters.popleft()
+                    if waiters:
+                        # 这个用户还有排队的调用，排到本通道的队尾，下次先轮到其他用户
+                        queue.move_to_end(user)
+                    else:
+                        del queue[user]
+                    self._running[name] += 1
+                    waiter.granted = True
+                    waiter.notify()
+                    break
+            else:
+                return
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        with self._lock:
+            self._queues[waiter.lane].setdefault(waiter.user, deque()).append(waiter)
+            self._dispatch()
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """
+        放弃排队。返回 False 表示在放弃之前已经分配到名额（调用方需要归还）。
+        """
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[waiter.lane]
+            waiters = queue[waiter.user]
+            waiters.remove(waiter)
+            if not waiters:
+                del queue[waiter.user]
+            return True
+
+    def try_acquire(self, lane_name: str) -> bool:
+        """
+        不排队地占用一个名额：有调用在排队、或者没有空闲名额时返回 False。
+        """
+        with self._lock:
+            if any(self._queues[name] for name in LANES):
+                return False
+            if sum(self._running.values()) >= self.capacity or self._running[lane_name] >= self.limits[lane_name]:
+                return False
+            self._running[lane_name] += 1
+            return True
+
+    def release(self, lane_name: str) -> None:
+        with self._lock:
+            self._running[lane_name] -= 1
+            self._dispatch()
+
+    def acquire(self, lane_name: str, user, timeout: float) -> None:
+        event = threading.Event()
+        waiter = _Waiter(lane_name, user, event.set)
+        self._enqueue(waiter)
+        if not event.wait(max(0.0, timeout)) and self._abandon(waiter):
+            raise DeadlineExceeded(f"等待上游调用名额超时（{lane_name} 通道）。")
+
+    async def aacquire(self, lane_name: str, user, timeout: float) -> None:
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def resolve():
+            if not granted.done():
+                granted.set_result(None)
+
+        # 名额可能由其他线程中释放名额的调用方分配，通过 call_soon_threadsafe 回到本事件循环
+        waiter = _Waiter(lane_name, user, lambda: loop.call_soon_threadsafe(resolve))
+        self._enqueue(waiter)
+        if waiter.granted:
+            return
+        try:
+            await asyncio.wait_for(granted, timeout=max(0.0, timeout))
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise DeadlineExceeded(f"等待上游调用名额超时（{lane_name} 通道）。") from None
+        except asyncio.CancelledError:
+            # 请求在排队时被取消：已经分配到的名额要立即归还
+            if not self._abandon(waiter):
+                self.release(lane_name)
+            raise
+
+    def stats(self) -> list[tuple[tuple, int]]:
+        with self._lock:
+            samples = []
+            for name in LANES:
+                samples.append(((name, 'running'), self._running[name]))
+                samples.append(((name, 'queued'), sum(len(w) for w in self._queues[name].values())))
+            return samples
+
+
+_scheduler = None
+_scheduler_config = None
+_scheduler_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return settings.UPSTREAM_MAX_CONCURRENT > 0
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler, _scheduler_config
+    # 配置变化时（如压测命令用 override_settings 调整名额）重新创建；
+    # 已经占到名额的调用仍然归还给原来的调度器
+    config = (settings.UPSTREAM_MAX_CONCURRENT, tuple(sorted(settings.UPSTREAM_LANE_SHARES.items())))
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_config != config:
+            _scheduler = Scheduler(settings.UPSTREAM_MAX_CONCURRENT, settings.UPSTREAM_LANE_SHARES)
+            _scheduler_config = config
+        return _scheduler
+
+
+def _timeout(deadline: Deadline | None) -> float:
+    # 没有时间预算的调用最多排队 ARK_TIMEOUT 秒
+    return deadline.timeout(settings.ARK_TIMEOUT) if deadline is not None else settings.ARK_TIMEOUT
+
+
+@contextmanager
+def slot(deadline: Deadline | None = None):
+    """
+    占用一个上游调用名额，代码块结束时归还。deadline 用完仍未分配到名额时抛出 DeadlineExceeded。
+    """
+    if not enabled():
+        yield
+        return
+    scheduler = get_scheduler()
+    name, user = _current_lane.get(), _current_user.get()
+    with metrics.timed(f'upstream_queue_{name}'):
+        scheduler.acquire(name, user, _timeout(deadline))
+    try:
+        yield
+    finally:
+        scheduler.release(name)
+
+
+@asynccontextmanager
+async def aslot(deadline: Deadline | None = None):
+    """
+    slot 的异步版本：排队等待期间不占用线程。
+    """
+    if not enabled():
+        yield
+        return
+    scheduler = get_scheduler()
+    name, user = _current_lane.get(), _current_user.get()
+    with metrics.timed(f'upstream_queue_{name}'):
+        await scheduler.aacquire(name, user, _timeout(deadline))
+    try:
+        yield
+    finally:
+        scheduler.release(name)
+
+
+def try_reserve():
+    """
+    不排队地为当前通道占用一个名额（用于对冲请求这类可有可无的额外调用），返回归还名额的函数；
+    没有空闲名额时返回 None。不做调度时总是成功。
+    """
+    if not enabled():
+        return lambda: None
+    scheduler = get_scheduler()
+    name = _current_lane.get()
+    if not scheduler.try_acquire(name):
+        return None
+    return lambda: scheduler.release(name)
+
+
+def scheduler_stats() -> list[tuple[tuple, int]]:
+    # 还没有发生过上游调用时没有调度器，也就没有数据
+    return _scheduler.stats() if _scheduler is not None else []
+
+
+upstream_calls = metrics.registry.register(metrics.Gauge(
+    'gamecore_upstream_calls',
+    'Upstream AI calls in this process by scheduling lane and state (running/queued).',
+    callback=scheduler_stats,
+    labelnames=('lane', 'state'),
+))
@@ -0,0 +1,238 @@
+"""
+CLIP 打分进程池。
+
+CLIP 编码是 CPU 密集的计算，在请求线程中执行时会与同一进程中的其他请求争抢 GIL，
+有回合正在打分时，排行榜、历史记录这些轻量接口的延迟也会跟着变高。配置 SCORING_WORKERS > 0 时：
+- 图片解码和 CLIP 编码在独立的进程池中执行，每个工作进程启动时加载一次模型；
+  Web 进程只提交图片、等待结果，不导入 torch 也不加载模型，内存占用小；
+- 同时提交（排队 + 执行中）的任务不超过 SCORING_QUEUE_SIZE 个，队列已满时最多等待
+  SCORING_QUEUE_TIMEOUT 秒，仍然没有空位就放弃本次打分（ScoringBusy）；
+- 每个任务最多等待 SCORING_TIMEOUT 秒（超时抛出 ScoringTimeout）；工作进程异常退出时丢弃进程池，下次提交时重建。
+ScoringBusy 和 ScoringTimeout 表示打分进程暂时忙不过来，视图把它们映射为 503（带 Retry-After）。
+SCORING_WORKERS = 0 时在当前进程中加载模型并直接计算（原来的行为）。
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from django.conf import settings
+
+
+class ScoringBusy(RuntimeError):
+    """
+    打分队列已满，在 SCORING_QUEUE_TIMEOUT 秒内没有等到空位。
+    """
+
+
+class ScoringTimeout(TimeoutError):
+    """
+    打分任务在 SCORING_TIMEOUT 秒内没有完成。
+    """
+
+
+# --- 计算（Web 进程与打分进程共用） ---
+
+def load_image(content: bytes) -> Image.Image:
+    """
+    把图片预处理为 CLIP 的输入尺寸（224x224 RGB）。
+    """
+    img = Image.open(BytesIO(content))
+    img = img.convert("RGB")
+    if img.size != (224, 224):
+        img = img.resize((224, 224))
+    return img
+
+
+def similarity_with(model, image_1: bytes, image_2: bytes) -> float:
+    """
+    用 model 计算两张图片的相似度得分（余弦相似度 x 100，截断到 0~100，保留两位小数）。
+    """
+    from sentence_transformers import util
+
+    embeddings = model.encode([load_image(image_1), load_image(image_2)], convert_to_tensor=True)
+    cosine_scores = util.cos_sim(embeddings[0], embeddings[1])
+    similarity_score = cosine_scores.item() * 100
+    return round(max(0.0, min(similarity_score, 100.0)), 2)
+
+
+def encode_with(model, images: list[bytes], batch_size: int | None = None) -> np.ndarray:
+    """
+    用 model 批量编码图片，返回 L2 归一化后的 float32 矩阵（每行一张图片）。
+    """
+    loaded = [load_image(content) for content in images]
+    embeddings = model.encode(loaded, batch_size=batch_size or len(loaded), convert_to_numpy=True)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+# --- 打分进程 ---
+# 每个打分进程启动时加载一次模型；任务返回 (模型是否已加载, 结果)，
+# Web 进程据此得知模型状态（用于 score_model_name），不需要自己加载模型。
+_worker_model = None
+
+
+def _init_worker(model_name: str) -> None:
+    global _worker_model
+    try:
+        from sentence_transformers import SentenceTransformer
+        _worker_model = SentenceTransformer(model_name)
+        print(f"打分进程 {os.getpid()}：CLIP 模型 '{model_name}' 已加载。")
+    except Exception as e:
+        print(f"打分进程 {os.getpid()}：加载 CLIP 模型时发生错误: {e}")
+
+
+def _ping() -> tuple[bool, None]:
+    return _worker_model is not None, None
+
+
+def similarity_task(image_1: bytes, image_2: bytes) -> tuple[bool, float]:
+    # 与 calculate_image_similarity 一致：模型未加载时得分为 0
+    if _worker_model is None:
+        return False, 0.0
+    return True, similarity_with(_worker_model, image_1, image_2)
+
+
+def encode_task(images: list[bytes], batch_size: int | None = None) -> tuple[bool, np.ndarray | None]:
+    # 与 encode_images 一致：模型未加载时返回 None
+    if _worker_model is None:
+        return False, None
+    return True, encode_with(_worker_model, images, batch_size)
+
+
+# --- 进程池 ---
+# 与图片处理进程池一样使用 spawn 方式启动，不继承 Web 进程的线程和连接。
+# 记录创建进程池的进程 id：Web 进程被 fork（如 gunicorn --preload）后在子进程中重新创建。
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# 排队和执行中的打分任务名额，第一次打分时按 SCORING_QUEUE_SIZE 创建，配置变化时重新创建
+# （已经占到的名额仍然归还给原来的信号量）
+_slots = None
+_slots_size = None
+_slots_lock = threading.Lock()
+
+# 打分进程最近一次报告的模型加载状态，None 表示还没有收到结果
+model_loaded: bool | None = None
+
+
+def enabled() -> bool:
+    return settings.SCORING_WORKERS > 0
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.SCORING_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(settings.CLIP_MODEL_NAME,),
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start() -> None:
+    """
+    启动进程池，并让每个打分进程立即加载模型，避免第一个回合等待模型加载。
+    由 wsgi.py / asgi.py 在服务启动时调用；未启用进程池时什么也不做。
+    """
+    if not enabled():
+        return
+    pool = _get_pool()
+    for _ in range(settings.SCORING_WORKERS):
+        pool.submit(_ping)
+
+
+def _get_slots() -> threading.BoundedSemaphore:
+    global _slots, _slots_size
+    size = max(1, settings.SCORING_QUEUE_SIZE)
+    with _slots_lock:
+        if _slots is None or _slots_size != size:
+            _slots = threading.BoundedSemaphore(size)
+            _slots_size = size
+        return _slots
+
+
+def _submit(slots: threading.BoundedSemaphore, task, *args):
+    """
+    在已经占到名额后提交任务，任务结束时归还名额。返回 (进程池, Future)。
+    """
+    pool = _get_pool()
+    try:
+        future = pool.submit(task, *args)
+    except (BrokenProcessPool, RuntimeError):
+        slots.release()
+        _discard_pool(pool)
+        raise
+    future.add_done_callback(lambda f: slots.release())
+    return pool, future
+
+
+def _unwrap(outcome) -> object:
+    global model_loaded
+    model_loaded, value = outcome
+    return value
+
+
+def run(task, *args):
+    """
+    在打分进程中执行 task(*args) 并等待结果。
+    """
+    slots = _get_slots()
+    if not slots.acquire(timeout=settings.SCORING_QUEUE_TIMEOUT):
+        raise ScoringBusy(f"打分队列已满（{settings.SCORING_QUEUE_SIZE} 个任务）。")
+    pool, future = _submit(slots, task, *args)
+    try:
+        return _unwrap(future.result(timeout=settings.SCORING_TIMEOUT))
+    except FutureTimeoutError:
+        future.cancel()
+        raise ScoringTimeout(f"打分超过 {settings.SCORING_TIMEOUT} 秒。") from None
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+
+async def arun(task, *args):
+    """
+    run 的异步版本：等待空位和结果时不占用事件循环，也不占用线程（只在队列已满时用一个线程等待空位）。
+    """
+    slots = _get_slots()
+    if not slots.acquire(blocking=False):
+        waiter = asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(slots.acquire, timeout=settings.SCORING_QUEUE_TIMEOUT)
+        )
+        try:
+            acquired = await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # 请求在排队时被取消：等到的空位要立即归还
+            waiter.add_done_callback(lambda f: f.result() and slots.release())
+            raise
+        if not acquired:
+            raise ScoringBusy(f"打分队列已满（{settings.SCORING_QUEUE_SIZE} 个任务）。")
+    pool, future = _submit(slots, task, *args)
+    try:
+        # 等待超时或请求被取消时，wrap_future 会连带取消还没开始执行的任务
+        return _unwrap(await asyncio.wait_for(asyncio.wrap_future(future), timeout=settings.SCORING_TIMEOUT))
+    except asyncio.TimeoutError:
+        raise ScoringTimeout(f"打分超过 {settings.SCORING_TIMEOUT} 秒。") from None
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
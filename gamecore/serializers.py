@@ -1,6 +1,8 @@
 from rest_framework import serializers  # 从 DRF 库中导入 serializers 工具
-from .models import GameRound  # 从当前应用的 models.py 中导入我们定义的 GameRound 模型
+from django.conf import settings
+from .models import ChallengeEntry, DailyChallenge, GameRound, TournamentRound, TournamentSession, UserStats  # 从当前应用的 models.py 中导入我们定义的 GameRound 模型
 import re  # 导入 Python 的 re 模块，用于正则表达式操作
+from .uploads import inspect_image_header  # 只读取文件头的图片检查
 
 class PlayerTurnInputSerializer(serializers.Serializer):
     # 定义一个名为 original_image_url 的字段，我们期望它是一个URL。
@@ -36,8 +38,20 @@ class GameRoundResultSerializer(serializers.ModelSerializer):
         fields = '__all__' # 告诉序列化器，将模型中的所有字段都包含在输出结果里。
 
 class GameStartSerializer(serializers.Serializer):
-    # ImageField 用于处理文件上传。`required=False`表示这个字段是可选的。
-    uploaded_image = serializers.ImageField(required=False)
+    # 使用 FileField 而不是 ImageField：ImageField 会完整解码一遍图片来校验，
+    # 这里只读取文件头检查格式和尺寸，真正的解码放到图片处理进程池中只做一次。
+    # `required=False`表示这个字段是可选的。
+    uploaded_image = serializers.FileField(required=False)
+    # 本局使用的语言和字符数限制，用于在开局后提前执行 AI 一方（提交回合时需要使用相同的值）
+    language = serializers.ChoiceField(choices=['en', 'zh'], default='en')
+    char_limit = serializers.IntegerField(min_value=1, max_value=200, default=20)
+
+    def validate_uploaded_image(self, value):
+        try:
+            inspect_image_header(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
 
 # 为排行榜创建序列化器
 class LeaderboardSerializer(serializers.Serializer):
@@ -56,4 +70,188 @@ class GameEventSerializer(serializers.Serializer):
     用于格式化埋点数据的序列化器。
     """
     event_type = serializers.CharField(max_length=50)
-    event_data = serializers.JSONField(required=False)
\ No newline at end of file
+    event_data = serializers.JSONField(required=False)
+
+
+# --- 锦标赛模式 ---
+class TournamentStartSerializer(serializers.Serializer):
+    """
+    开始一场锦标赛：轮数、AI 识图使用的语言和字符数限制，以及可选的前几轮原图。
+    """
+    rounds = serializers.IntegerField(min_value=1, max_value=settings.TOURNAMENT_MAX_ROUNDS, default=5)
+    language = serializers.ChoiceField(choices=['en', 'zh'], default='en')
+    char_limit = serializers.IntegerField(min_value=1, max_value=200, default=20)
+    original_image_urls = serializers.ListField(
+        child=serializers.URLField(max_length=1000),
+        required=False,
+        default=list,
+    )
+
+    def validate(self, data):
+        if len(data['original_image_urls']) > data['rounds']:
+            raise serializers.ValidationError("指定的原图数量超过了轮数。")
+        return data
+
+
+class TournamentTurnSerializer(serializers.Serializer):
+    index = serializers.IntegerField(min_value=0)
+    player_prompt = serializers.CharField(max_length=500)
+
+
+class TournamentTurnsSerializer(serializers.Serializer):
+    """
+    一次提交锦标赛的一轮或多轮。提示词长度按锦标赛设定的 char_limit 检查（通过 context['session'] 传入）。
+    """
+    turns = serializers.ListField(
+        child=TournamentTurnSerializer(),
+        min_length=1,
+        max_length=settings.TOURNAMENT_MAX_ROUNDS,
+    )
+
+    def validate_turns(self, turns):
+        session = self.context['session']
+        indexes = [turn['index'] for turn in turns]
+        if len(set(indexes)) != len(indexes):
+            raise serializers.ValidationError("同一轮不能重复提交。")
+        for turn in turns:
+            if turn['index'] >= session.round_count:
+                raise serializers.ValidationError(f"轮次 {turn['index']} 不存在。")
+            if len(turn['player_prompt']) > session.char_limit:
+                raise serializers.ValidationError(
+                    f"第 {turn['index'] + 1} 轮的提示词超过了本场设定的最大字符数 ({session.char_limit})。"
+                )
+        return turns
+
+
+class TournamentRoundSerializer(serializers.ModelSerializer):
+    """
+    锦标赛的一轮。AI 一方的结果在玩家提交本轮之前不返回，避免提前看到 AI 的提示词。
+    """
+    player_prompt = serializers.CharField(source='game_round.player_prompt', read_only=True, default=None)
+    player_generated_image_url = serializers.CharField(source='game_round.player_generated_image_url', read_only=True, default=None)
+    player_similarity_score = serializers.FloatField(source='game_round.player_similarity_score', read_only=True, default=None)
+    winner = serializers.CharField(source='game_round.winner', read_only=True, default=None)
+
+    class Meta:
+        model = TournamentRound
+        fields = [
+            'index',
+            'original_image_url',
+            'image_renditions',
+            'ai_generated_prompt_from_image',
+            'ai_generated_image_url',
+            'ai_similarity_score',
+            'game_round',
+            'player_prompt',
+            'player_generated_image_url',
+            'player_similarity_score',
+            'winner',
+        ]
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.game_round_id is None:
+            for field in ('ai_generated_prompt_from_image', 'ai_generated_image_url', 'ai_similarity_score'):
+                data[field] = None
+            data['image_renditions'] = {
+                key: value for key, value in data['image_renditions'].items() if key != 'ai'
+            }
+        else:
+            # 玩家图片转存后，GameRound 中保存的是最新的衍生图 URL
+            data['image_renditions'] = instance.game_round.image_renditions
+        return data
+
+
+class TournamentSessionSerializer(serializers.ModelSerializer):
+    rounds = TournamentRoundSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = TournamentSession
+        fields = [
+            'id',
+            'status',
+            'error',
+            'language',
+            'char_limit',
+            'round_count',
+            'rounds_played',
+            'player_total_score',
+            'ai_total_score',
+            'player_wins',
+            'ai_wins',
+            'draws',
+            'winner',
+            'created_at',
+            'finished_at',
+            'rounds',
+        ]
+
+
+# --- 每日挑战 ---
+class DailyChallengeSerializer(serializers.ModelSerializer):
+    """
+    每日挑战的公开信息。AI 一方的结果在玩家提交回合后随回合结果返回，这里不包含。
+    """
+    original_renditions = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DailyChallenge
+        fields = ['date', 'original_image_url', 'original_renditions', 'language', 'char_limit', 'play_count']
+
+    def get_original_renditions(self, obj):
+        return obj.image_renditions.get('original', {})
+
+
+class ChallengePlaySerializer(serializers.Serializer):
+    """
+    提交每日挑战的一个回合。提示词长度按挑战设定的 char_limit 检查（通过 context['challenge'] 传入）。
+    """
+    player_prompt = serializers.CharField(max_length=500)
+
+    def validate_player_prompt(self, value):
+        char_limit = self.context['challenge'].char_limit
+        if len(value) > char_limit:
+            raise serializers.ValidationError(f"提示词超过了本次挑战设定的最大字符数 ({char_limit})。")
+        return value
+
+
+class ChallengeLeaderboardSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = ChallengeEntry
+        fields = ['username', 'best_score', 'attempts', 'best_at']
+
+
+# --- 用户统计 ---
+class UserStatsSerializer(serializers.ModelSerializer):
+    average_score = serializers.FloatField(read_only=True)
+    win_rate = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = UserStats
+        fields = [
+            'total_rounds',
+            'wins',
+            'losses',
+            'draws',
+            'win_rate',
+            'average_score',
+            'best_score',
+            'current_streak',
+            'longest_streak',
+            'last_played_at',
+        ]
+
+
+# --- 数据导出 ---
+class ExportQuerySerializer(serializers.Serializer):
+    """
+    导出接口的查询参数：输出格式、时间范围（since 含、until 不含）、增量导出的起始 id 和是否 gzip 压缩。
+    格式参数不能叫 format，DRF 会把 ?format= 当作选择渲染器的参数。
+    """
+    output = serializers.ChoiceField(choices=['csv', 'jsonl'], default='csv')
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    since_id = serializers.IntegerField(min_value=0, required=False)
+    gzip = serializers.BooleanField(default=False)
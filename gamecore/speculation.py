@@ -0,0 +1,241 @@
+"""
+开局后在后台预先执行 AI 一方（投机执行）。
+
+AI 一方（识图 -> 生图 -> 与原图比较打分）与玩家的提示词无关，但原来要等玩家提交后才开始。
+现在 StartGameAPIView 发出原图后立即把 AI 一方提交到后台，结果按 (原图 URL, language, char_limit)
+保存在 'speculation' 缓存中；玩家提交时如果命中，就只剩玩家一方需要执行。
+
+- 缓存默认是本机的文件缓存，同一台机器上的所有工作进程共享，结果在 SPECULATION_TTL 秒后过期；
+- 同时进行中的投机任务数量有上限，超过上限时不再投机（提交时照常完整执行）；
+- 投机执行的识图和生图与玩家回合一样计入各模型的全局令牌桶，令牌不足时不投机；
+  玩家提交时命中结果，回合只需要计入玩家自己的一次生图（视图归还 AI_BRANCH_CALLS）；
+- 排队时间过长的任务（玩家可能已经离开）直接放弃，不再调用上游，并归还令牌；
+- 提交时任务仍在进行中，就等待它完成（最多 SPECULATION_WAIT 秒），不重复调用上游。
+  进行中的条目记录了所属进程，所属进程已经退出（如崩溃、重启）时视为没有结果，不再等待。
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import ai_services
+from . import background
+from . import image_processing
+from . import metrics
+from . import scheduling
+from .admission import consume_model_quota, refund_model_quota
+from .resilience import Deadline
+
+# AI 一方的上游调用：一次识图、一次生图
+AI_BRANCH_CALLS = {'vision': 1, 'image_generation': 1}
+
+# 本进程中进行中的投机任务：缓存键 -> Future
+_pending: dict[str, Future] = {}
+_pending_lock = threading.Lock()
+
+
+def _cache():
+    return caches['speculation']
+
+
+def cache_key(original_image_url: str, language: str, char_limit: int) -> str:
+    digest = hashlib.sha1(original_image_url.encode('utf-8')).hexdigest()
+    return f"ai-branch:{digest}:{language}:{char_limit}"
+
+
+def start(original_image_url: str, language: str = 'en', char_limit: int = 20, user=None) -> bool:
+    """
+    为刚发出的原图在后台开始执行 AI 一方。已有结果、任务已在进行、达到并发上限
+    或模型的全局令牌不足时不提交。user 为开局玩家的 id，上游调用在 speculative 通道中以该玩家排队。
+    返回是否提交了新任务。
+    """
+    if not settings.SPECULATIVE_AI_BRANCH:
+        return False
+    key = cache_key(original_image_url, language, char_limit)
+    with _pending_lock:
+        if key in _pending or len(_pending) >= settings.SPECULATION_MAX_PENDING:
+            return False
+        # add 只在键不存在时写入：其他进程已经在计算或已有结果时放弃。
+        # 进行中的条目只保留到任务最迟结束的时间，结果写入时再按 SPECULATION_TTL 保存
+        pending = {'status': 'pending', 'owner': os.getpid()}
+        if not _cache().add(key, pending, timeout=_pending_timeout()):
+            return False
+        # 投机执行同样消耗 Ark 配额，令牌不足时放弃投机，玩家提交时照常完整执行
+        if consume_model_quota(AI_BRANCH_CALLS):
+            _cache().delete(key)
+            metrics.record_cache('speculation_quota', False)
+            return False
+        future = background.submit(_run, key, original_image_url, language, char_limit, user, time.monotonic())
+        _pending[key] = future
+    future.add_done_callback(lambda f: _forget(key, f))
+    return True
+
+
+def _pending_timeout() -> int:
+    # 任务最多在队列中等待 SPECULATION_MAX_QUEUE_DELAY 秒，执行最多 TURN_DEADLINE 秒
+    return int(settings.SPECULATION_MAX_QUEUE_DELAY + settings.TURN_DEADLINE) + 1
+
+
+def _forget(key: str, future: Future) -> None:
+    with _pending_lock:
+        if _pending.get(key) is future:
+            del _pending[key]
+
+
+def _run(key: str, original_image_url: str, language: str, char_limit: int, user,
+         queued_at: float) -> dict | None:
+    try:
+        if time.monotonic() - queued_at > settings.SPECULATION_MAX_QUEUE_DELAY:
+            # 在后台队列里等得太久，玩家很可能已经离开，放弃以节省上游配额
+            _cache().delete(key)
+            refund_model_quota(AI_BRANCH_CALLS)
+            metrics.record_cache('speculation_expired', True)
+            return None
+        # 投机执行的上游调用排在玩家回合之后，只使用 speculative 通道的名额
+        with metrics.timed('speculation'), scheduling.lane(scheduling.SPECULATIVE, user=user):
+            result = _compute(original_image_url, language, char_limit)
+        _cache().set(key, result, timeout=settings.SPECULATION_TTL)
+        return result
+    except Exception as e:
+        print(f"投机执行 AI 回合失败: {e}")
+        _cache().delete(key)
+        return None
+
+
+def _compute(original_image_url: str, language: str, char_limit: int) -> dict:
+    """
+    执行 AI 一方：识图、生图、打分，并把 AI 图片转存到本站（之后不需要再下载或转存）。
+    """
+    deadline = Deadline(settings.TURN_DEADLINE)
+    ai_prompt = ai_services.get_ai_prompt_from_image(
+        image_url=original_image_url,
+        language=language,
+        char_limit=char_limit,
+        deadline=deadline.split(0.4),
+    )
+    if ai_prompt is None:
+        raise RuntimeError("AI 识图失败。")
+    ai_image_url = ai_services.get_image_from_prompt(ai_prompt, deadline=deadline.split(0.85))
+    if not ai_image_url:
+        raise RuntimeError("AI 生成图片失败。")
+
+    original_renditions = image_processing.rendition_urls_for(original_image_url)
+    original_image_bytes = image_processing.fetch_image_bytes(
+        original_renditions.get(image_processing.SCORE_RENDITION, original_image_url),
+        deadline=deadline,
+    )
+    ai_image_bytes = image_processing.fetch_image_bytes(ai_image_url, deadline=deadline)
+    ai_similarity_score = ai_services.calculate_image_similarity(original_image_bytes, ai_image_bytes)
+    if ai_similarity_score is None:
+        raise RuntimeError("计算 AI 图片相似度失败。")
+
+    saved_paths = image_processing.save_renditions(ai_image_bytes, prefix='generated', keep_source=True)
+    ai_renditions = {name: image_processing.media_url(path) for name, path in saved_paths.items()}
+    return {
+        'status': 'done',
+        'ai_generated_prompt_from_image': ai_prompt,
+        'ai_generated_image_url': ai_renditions[image_processing.MAIN_RENDITION],
+        'ai_similarity_score': ai_similarity_score,
+        'ai_renditions': ai_renditions,
+        'score_model': ai_services.score_model_name(),
+    }
+
+
+def _orphaned(key: str, result: dict) -> bool:
+    """
+    进行中的条目所属的进程已经退出（崩溃或重启），这个条目不会再有结果。
+    """
+    owner = result.get('owner')
+    if owner is None or os.name != 'posix':
+        return False
+    if owner == os.getpid():
+        # 本进程的任务都登记在 _pending 中；不在其中说明是 pid 相同的旧进程留下的
+        with _pending_lock:
+            return key not in _pending
+    try:
+        os.kill(owner, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _still_pending(key: str, result: dict | None) -> bool:
+    """
+    条目是否仍在计算中、值得继续等待。所属进程已经退出的条目直接删除，让之后的开局可以重新投机。
+    """
+    if result is None or result.get('status') != 'pending':
+        return False
+    if _orphaned(key, result):
+        _cache().delete(key)
+        metrics.record_cache('speculation_orphaned', True)
+        return False
+    return True
+
+
+def _hit(result: dict | None) -> dict | None:
+    hit = result is not None and result.get('status') == 'done'
+    metrics.record_cache('speculation', hit)
+    return result if hit else None
+
+
+def claim(original_image_url: str, language: str, char_limit: int, wait: float | None = None) -> dict | None:
+    """
+    取出原图对应的 AI 一方结果。任务仍在进行时最多等待 wait 秒（默认 SPECULATION_WAIT）；
+    没有结果、任务失败或等待超时返回 None，调用方照常完整执行 AI 一方。
+    """
+    if not settings.SPECULATIVE_AI_BRANCH:
+        return None
+    key = cache_key(original_image_url, language, char_limit)
+    wait = settings.SPECULATION_WAIT if wait is None else wait
+    expires_at = time.monotonic() + wait
+
+    with _pending_lock:
+        future = _pending.get(key)
+    with metrics.timed('speculation_wait'):
+        if future is not None:
+            # 任务在本进程中：直接等待 Future
+            try:
+                return _hit(future.result(timeout=wait))
+            except Exception:
+                return _hit(None)
+
+        # 任务可能在其他进程中：轮询共享缓存
+        result = _cache().get(key)
+        while _still_pending(key, result) and time.monotonic() < expires_at:
+            time.sleep(0.2)
+            result = _cache().get(key)
+    return _hit(result)
+
+
+async def aclaim(original_image_url: str, language: str, char_limit: int, wait: float | None = None) -> dict | None:
+    """
+    claim 的异步版本：等待期间不占用线程。
+    """
+    if not settings.SPECULATIVE_AI_BRANCH:
+        return None
+    key = cache_key(original_image_url, language, char_limit)
+    wait = settings.SPECULATION_WAIT if wait is None else wait
+    expires_at = time.monotonic() + wait
+
+    with _pending_lock:
+        future = _pending.get(key)
+    with metrics.timed('speculation_wait'):
+        if future is not None:
+            try:
+                # shield：等待超时或请求被取消时，不能连带取消还在排队的后台任务
+                return _hit(await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=wait))
+            except Exception:
+                return _hit(None)
+
+        result = await _cache().aget(key)
+        while _still_pending(key, result) and time.monotonic() < expires_at:
+            await asyncio.sleep(0.2)
+            result = await _cache().aget(key)
+    return _hit(result)
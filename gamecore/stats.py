@@ -0,0 +1,80 @@
+"""
+用户战绩汇总（UserStats）的维护。
+
+- 每创建一个 GameRound，由 post_save 信号调用 record_round 增量更新一次，api/me/stats/ 读取时只需一次主键查询；
+- 删除回合或回合得分被修改（如重新打分）后调用 rebuild_user_stats，按时间顺序重放该用户的全部回合；
+- rebuild_user_stats 管理命令用于补齐已有数据。
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .models import GameRound, UserStats
+
+
+def _apply(stats: UserStats, winner: str | None, player_similarity_score: float | None, timestamp) -> None:
+    """
+    把一个回合计入汇总（只修改内存中的对象）。
+    """
+    stats.total_rounds += 1
+    if winner == 'player':
+        stats.wins += 1
+        stats.current_streak += 1
+        stats.longest_streak = max(stats.longest_streak, stats.current_streak)
+    elif winner == 'ai':
+        stats.losses += 1
+        stats.current_streak = 0
+    elif winner == 'draw':
+        stats.draws += 1
+        stats.current_streak = 0
+
+    if player_similarity_score is not None:
+        stats.scored_rounds += 1
+        stats.score_sum += player_similarity_score
+        if stats.best_score is None or player_similarity_score > stats.best_score:
+            stats.best_score = player_similarity_score
+
+    if stats.last_played_at is None or timestamp > stats.last_played_at:
+        stats.last_played_at = timestamp
+
+
+def record_round(game_round: GameRound) -> None:
+    """
+    把新创建的回合增量计入用户的汇总。锁住该用户的汇总行，避免同一用户的并发回合互相覆盖。
+    """
+    with transaction.atomic():
+        stats, _ = UserStats.objects.select_for_update().get_or_create(user_id=game_round.user_id)
+        _apply(stats, game_round.winner, game_round.player_similarity_score, game_round.timestamp)
+        stats.save()
+
+
+def rebuild_user_stats(user_id: int) -> UserStats:
+    """
+    按时间顺序重放用户的全部回合，重新计算汇总。
+    先锁住该用户的汇总行再读取回合，直到写回结果才释放：重算期间并发的 record_round 会等待，
+    然后在重算结果的基础上增量计入，不会被重算覆盖掉。
+    """
+    with transaction.atomic():
+        UserStats.objects.select_for_update().get_or_create(user_id=user_id)
+        rebuilt = UserStats(user_id=user_id)
+        rounds = GameRound.objects.filter(user_id=user_id).order_by('timestamp', 'id').values_list(
+            'winner', 'player_similarity_score', 'timestamp'
+        )
+        for winner, player_similarity_score, timestamp in rounds.iterator(chunk_size=2000):
+            _apply(rebuilt, winner, player_similarity_score, timestamp)
+        rebuilt.save(force_update=True)
+    return rebuilt
+
+
+def on_round_saved(sender, instance, created, **kwargs):
+    if created:
+        record_round(instance)
+
+
+def on_round_deleted(sender, instance, **kwargs):
+    # 删除回合很少发生（后台管理操作），直接重算该用户的汇总；用户本身被删除时汇总会级联删除
+    transaction.on_commit(lambda: _rebuild_if_user_exists(instance.user_id))
+
+
+def _rebuild_if_user_exists(user_id: int) -> None:
+    if get_user_model().objects.filter(pk=user_id).exists():
+        rebuild_user_stats(user_id)
@@ -0,0 +1,185 @@
+"""
+本地的 Ark 桩服务，用于在没有真实 API Key、不消耗配额的情况下测试容错逻辑和压测。
+实现了识图（/chat/completions）和文生图（/images/generations）两个接口，
+可以配置响应延迟，并按比例注入 5xx 错误、429 限流和超时。
+另外提供一个确定性的 CLIP 替身模型，压测时可以不加载真实模型。
+
+启动方式：python manage.py run_stub_ark --port 8001 --error-rate 0.2
+然后设置 ARK_BASE_URL=http://127.0.0.1:8001/api/v3 启动 Django。
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+@dataclass
+class StubConfig:
+    # 每次请求的基础延迟（秒）和随机抖动（对数正态分布的 sigma）
+    latency: float = 0.2
+    jitter: float = 0.3
+    # 文生图接口的额外延迟（秒），真实服务里文生图比识图慢得多
+    image_latency: float = 0.5
+    # 注入故障的比例：返回 500、返回 429、挂起直到客户端超时
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    hang_rate: float = 0.0
+    # 挂起的时长（秒）
+    hang_seconds: float = 300.0
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server_version = 'StubArk/1.0'
+
+    def log_message(self, format, *args):
+        # 桩服务默认不输出访问日志，避免压测时刷屏
+        pass
+
+    def _send_json(self, status_code: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_faults(self, extra_latency: float = 0.0) -> bool:
+        """
+        按配置模拟延迟和故障。返回 True 表示已经发送了故障响应。
+        """
+        config = self.server.config
+        time.sleep(config.latency * random.lognormvariate(0, config.jitter) + extra_latency)
+        roll = random.random()
+        if roll < config.hang_rate:
+            time.sleep(config.hang_seconds)
+            return True
+        roll -= config.hang_rate
+        if roll < config.error_rate:
+            self._send_json(500, {'error': {'code': 'InternalServiceError', 'message': 'injected fault'}})
+            return True
+        roll -= config.error_rate
+        if roll < config.rate_limit_rate:
+            self._send_json(429, {'error': {'code': 'RateLimitExceeded', 'message': 'injected rate limit'}})
+            return True
+        return False
+
+    def do_GET(self):
+        # /images/<seed>.png：返回一张由 seed 决定颜色的图片
+        if self.path.startswith('/images/') and self.path.endswith('.png'):
+            seed = self.path[len('/images/'):-len('.png')]
+            self._send_png(seed)
+            return
+        if self.path == '/_config':
+            self._send_json(200, asdict(self.server.config))
+            return
+        self._send_json(404, {'error': {'message': 'not found'}})
+
+    def _send_png(self, seed: str):
+        digest = hashlib.sha256(seed.encode()).digest()
+        image = Image.new('RGB', (512, 512), tuple(digest[:3]))
+        # 左上角画一块与 seed 相关的色块，让不同图片之间的相似度有差异
+        image.paste(tuple(digest[3:6]), (0, 0, 128 + digest[6], 128 + digest[7]))
+        buffer = BytesIO()
+        image.save(buffer, format='PNG')
+        body = buffer.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        self.server.record_request(self.path)
+
+        if self.path == '/_config':
+            # 运行时修改故障注入配置，便于在一次测试中模拟服务恢复
+            for key, value in payload.items():
+                if hasattr(self.server.config, key):
+                    setattr(self.server.config, key, float(value))
+            self._send_json(200, asdict(self.server.config))
+            return
+
+        if self.path.endswith('/chat/completions'):
+            if self._inject_faults():
+                return
+            self._send_json(200, {
+                'id': uuid.uuid4().hex,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': payload.get('model', 'stub-vision'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': f"stub prompt {uuid.uuid4().hex[:8]}"},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+            })
+            return
+
+        if self.path.endswith('/images/generations'):
+            if self._inject_faults(self.server.config.image_latency):
+                return
+            seed = hashlib.sha1(str(payload.get('prompt', '')).encode()).hexdigest()
+            host, port = self.server.server_address[:2]
+            self._send_json(200, {
+                'model': payload.get('model', 'stub-image'),
+                'created': int(time.time()),
+                'data': [{'url': f"http://{host}:{port}/images/{seed}.png"}],
+                'usage': {'generated_images': 1},
+            })
+            return
+
+        self._send_json(404, {'error': {'message': 'not found'}})
+
+
+class StubArkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, config: StubConfig | None = None):
+        super().__init__((host, port), _StubHandler)
+        self.config = config or StubConfig()
+        # 各接口收到的请求数（按路径最后一段统计，如 'completions'、'generations'），测试中用于检查重试次数
+        self.request_counts = Counter()
+        self._counts_lock = threading.Lock()
+
+    def record_request(self, path: str) -> None:
+        with self._counts_lock:
+            self.request_counts[path.rstrip('/').rsplit('/', 1)[-1]] += 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v3"
+
+    def start_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name='stub-ark', daemon=True)
+        thread.start()
+        return thread
+
+
+class DeterministicClipModel:
+    """
+    CLIP 模型的确定性替身：把图片缩小为 16x16 的像素向量作为“嵌入”。
+    接口与 SentenceTransformer.encode 一致，相同图片总是得到相同的分数，编码开销可以忽略。
+    """
+
+    def encode(self, images, convert_to_tensor=False, **kwargs):
+        vectors = np.stack([
+            np.asarray(image.convert('RGB').resize((16, 16)), dtype=np.float32).reshape(-1) / 255.0
+            for image in images
+        ])
+        if convert_to_tensor:
+            import torch
+            return torch.from_numpy(vectors)
+        return vectors
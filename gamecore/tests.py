@@ -1,3 +1,1131 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import gzip
+import importlib.util
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import numpy as np
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from volcenginesdkarkruntime import Ark
+
+from . import ai_services
+from . import authentication
+from . import background
+from . import challenges
+from . import db
+from . import exports
+from . import image_processing
+from . import mirroring
+from . import resilience
+from . import scheduling
+from . import scoring
+from . import speculation
+from . import tournaments
+from .admission import ServiceOverloaded, TokenBucket, consume_model_quota
+from .fast_serializers import game_round_rows, leaderboard_rows
+from .models import ChallengeEntry, GameRound, TournamentSession, UserStats
+from .renderers import FastJSONRenderer
+from .rescoring import Checkpoint, Rescorer
+from .resilience import CircuitOpenError, Deadline, DeadlineExceeded
+from .serializers import GameRoundResultSerializer, LeaderboardSerializer
+from .stats import rebuild_user_stats
+from .stub_ark import DeterministicClipModel, StubArkServer, StubConfig
+from .throttles import AIAdmissionThrottle
+from .tournaments import PreparedRound
+from .uploads import CappedTemporaryFileUploadHandler, UploadTooLarge
+from .views import leaderboard_queryset, start_game_upstream_calls
+
+
+def create_round(user, winner='player', player_score=60.0, ai_score=40.0, **fields):
+    return GameRound.objects.create(
+        user=user,
+        original_image_url=fields.pop('original_image_url', 'http://example.com/original.jpg'),
+        player_prompt=fields.pop('player_prompt', 'a cat'),
+        player_generated_image_url=fields.pop('player_generated_image_url', 'http://example.com/player.jpg'),
+        player_similarity_score=player_score,
+        ai_generated_prompt_from_image=fields.pop('ai_generated_prompt_from_image', 'a dog'),
+        ai_generated_image_url=fields.pop('ai_generated_image_url', 'http://example.com/ai.jpg'),
+        ai_similarity_score=ai_score,
+        winner=winner,
+        **fields,
+    )
+
+
+def image_bytes(size=(32, 32), color=(200, 0, 0), image_format='PNG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+class AdmissionStateMixin:
+    """
+    令牌桶和并发名额的状态放到临时目录和进程内缓存中，不影响开发环境的状态。
+    """
+
+    def setUp(self):
+        super().setUp()
+        state_dir = tempfile.mkdtemp(prefix='gamecore-test-admission-')
+        self.addCleanup(shutil.rmtree, state_dir, ignore_errors=True)
+        caches_setting = {
+            **settings.CACHES,
+            'admission': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': state_dir},
+        }
+        override = override_settings(ADMISSION_STATE_DIR=state_dir, CACHES=caches_setting)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def tokens(self, key):
+        entry = caches['admission'].get(key)
+        return None if entry is None else entry[0]
+
+
+# --- 上游调用的容错（熔断、重试、时间预算），使用本地 Ark 桩服务 ---
+
+@override_settings(ARK_RETRIES=2, ARK_RETRY_BACKOFF=0.0, ARK_BREAKER_FAILURES=3,
+                   ARK_BREAKER_RECOVERY=60.0, ARK_HEDGE_OPERATIONS=[])
+class ResilienceTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubArkServer(config=StubConfig(latency=0.0, jitter=0.0, image_latency=0.0, hang_seconds=2.0))
+        cls.stub.start_in_background()
+        # 没有配置 ARK_API_KEY 时模块里没有客户端和模型名，这里一并替换
+        cls.patcher = mock.patch.multiple(
+            ai_services, create=True,
+            client=Ark(base_url=cls.stub.base_url, api_key='stub', max_retries=0),
+            vision_model='stub-vision', image_generation_model='stub-image',
+        )
+        cls.patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.patcher.stop()
+        cls.stub.shutdown()
+        cls.stub.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.stub.config = StubConfig(latency=0.0, jitter=0.0, image_latency=0.0, hang_seconds=2.0)
+        self.stub.request_counts.clear()
+        # 熔断器按 settings 创建，每个测试重新创建
+        resilience._breakers.clear()
+
+    def describe(self):
+        return ai_services.get_ai_prompt_from_image('http://example.com/original.jpg', deadline=Deadline(10))
+
+    def test_success(self):
+        self.assertTrue(self.describe().startswith('stub prompt'))
+        self.assertEqual(self.stub.request_counts['completions'], 1)
+
+    def test_transient_errors_are_retried(self):
+        self.stub.config.error_rate = 1.0
+        self.assertIsNone(self.describe())
+        self.assertEqual(self.stub.request_counts['completions'], settings.ARK_RETRIES + 1)
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        self.stub.config.error_rate = 1.0
+        self.assertIsNone(self.describe())
+        self.assertTrue(resilience.get_breaker('vision').is_open)
+
+        # 熔断期间不再请求上游，立即失败
+        self.stub.config.error_rate = 0.0
+        with self.assertRaises(CircuitOpenError):
+            self.describe()
+        self.assertEqual(self.stub.request_counts['completions'], settings.ARK_RETRIES + 1)
+
+    @override_settings(ARK_BREAKER_RECOVERY=0.0)
+    def test_breaker_closes_after_successful_probe(self):
+        self.stub.config.error_rate = 1.0
+        self.describe()
+        self.stub.config.error_rate = 0.0
+        self.assertTrue(self.describe().startswith('stub prompt'))
+        self.assertFalse(resilience.get_breaker('vision').is_open)
+
+    def test_deadline_bounds_hanging_upstream(self):
+        self.stub.config.hang_rate = 1.0
+        started = time.monotonic()
+        try:
+            result = ai_services.get_ai_prompt_from_image('http://example.com/original.jpg', deadline=Deadline(0.5))
+        except DeadlineExceeded:
+            result = None
+        self.assertIsNone(result)
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_expired_deadline_does_not_call_upstream(self):
+        with self.assertRaises(DeadlineExceeded):
+            ai_services.get_ai_prompt_from_image('http://example.com/original.jpg', deadline=Deadline(0))
+        self.assertEqual(self.stub.request_counts['completions'], 0)
+
+
+# --- 准入限流：令牌桶和各请求的调用成本 ---
+
+@override_settings(AI_USER_RATE='10/min', AI_USER_BURST=2,
+                   ARK_MODEL_RATES={'vision': '60/min', 'image_generation': '3/min'})
+class AdmissionTests(AdmissionStateMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username='alice', password='secret')
+        self.factory = APIRequestFactory()
+
+    def test_token_bucket_cost_and_refund(self):
+        bucket = TokenBucket('60/min', burst=3)
+        key = f"test:{uuid.uuid4().hex}"
+        self.assertEqual(bucket.consume(key, 2), 0)
+        # 剩 1 个令牌，再取 2 个需要等 1 个令牌补充的时间（每秒补充 1 个）
+        self.assertAlmostEqual(bucket.consume(key, 2), 1.0, delta=0.1)
+        bucket.refund(key, 2)
+        self.assertEqual(bucket.consume(key, 3), 0)
+
+    def test_model_quota_is_all_or_nothing(self):
+        self.assertEqual(consume_model_quota({'vision': 1, 'image_generation': 3}), 0)
+        vision_left = self.tokens('ai-model:vision')
+        self.assertGreater(consume_model_quota({'vision': 1, 'image_generation': 1}), 0)
+        # image_generation 不足时，已经取出的 vision 令牌归还
+        self.assertAlmostEqual(self.tokens('ai-model:vision'), vision_left, delta=0.1)
+
+    def test_start_game_cost_depends_on_the_upload(self):
+        upload = BytesIO()
+        Image.new('RGB', (8, 8)).save(upload, format='PNG')
+        upload.name = 'upload.png'
+        with_file = self.factory.post('/api/start_game/', {'uploaded_image': upload}, format='multipart')
+        without_file = self.factory.post('/api/start_game/', {'language': 'en'}, format='multipart')
+        as_json = self.factory.post('/api/start_game/', {}, format='json')
+        parsers = [MultiPartParser(), JSONParser()]
+        self.assertEqual(start_game_upstream_calls(Request(with_file, parsers=parsers)), {'image_generation': 0})
+        self.assertEqual(start_game_upstream_calls(Request(without_file, parsers=parsers)), {'image_generation': 1})
+        self.assertEqual(start_game_upstream_calls(Request(as_json, parsers=parsers)), {'image_generation': 1})
+
+    def test_model_rejection_refunds_user_token(self):
+        class View:
+            def get_upstream_calls(self, request):
+                return {'image_generation': 4}
+
+        request = self.factory.post('/api/play_turn/')
+        request.user = self.user
+        with self.assertRaises(ServiceOverloaded):
+            AIAdmissionThrottle().allow_request(request, View())
+        self.assertAlmostEqual(self.tokens(f"ai-user:user:{self.user.pk}"), settings.AI_USER_BURST, delta=0.1)
+        self.assertIsNone(self.tokens('ai-model:vision'))
+
+    def test_invalid_request_does_not_consume_quota(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/play_turn/', {'player_prompt': 'a cat'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertAlmostEqual(self.tokens(f"ai-user:user:{self.user.pk}"), settings.AI_USER_BURST, delta=0.1)
+        self.assertAlmostEqual(self.tokens('ai-model:image_generation'), 3, delta=0.1)
+
+    def test_user_bucket_limits_requests(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        statuses = [
+            client.post('/api/play_turn/', {'player_prompt': 'a cat'}, format='json').status_code
+            for _ in range(3)
+        ]
+        # 参数无效的请求归还令牌，不会因此被限流
+        self.assertEqual(statuses, [400, 400, 400])
+
+    def play_turn(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post('/api/play_turn/', {
+            'original_image_url': 'http://example.com/original.jpg', 'player_prompt': 'a cat',
+        }, format='json')
+
+    def assertQuotaUntouched(self):
+        self.assertAlmostEqual(self.tokens(f"ai-user:user:{self.user.pk}"), settings.AI_USER_BURST, delta=0.1)
+        self.assertAlmostEqual(self.tokens('ai-model:image_generation'), 3, delta=0.1)
+        self.assertAlmostEqual(self.tokens('ai-model:vision'), 60, delta=0.1)
+
+    def test_gate_rejection_does_not_consume_quota(self):
+        with mock.patch('gamecore.views.gate') as gate:
+            gate.return_value.slot.side_effect = ServiceOverloaded(wait=1)
+            response = self.play_turn()
+        self.assertEqual(response.status_code, 503)
+        self.assertQuotaUntouched()
+
+    def test_open_breaker_before_any_call_does_not_consume_quota(self):
+        with mock.patch.object(ai_services, 'get_image_from_prompt', side_effect=CircuitOpenError('image_generation', 30)):
+            response = self.play_turn()
+        self.assertEqual(response.status_code, 503)
+        self.assertQuotaUntouched()
+
+    def test_failure_after_an_upstream_call_keeps_quota(self):
+        def call_then_fail(prompt, deadline=None):
+            resilience._record_attempt()
+            raise CircuitOpenError('vision', 30)
+
+        with mock.patch.object(ai_services, 'get_image_from_prompt', side_effect=call_then_fail):
+            response = self.play_turn()
+        self.assertEqual(response.status_code, 503)
+        self.assertAlmostEqual(self.tokens('ai-model:image_generation'), 1, delta=0.1)
+
+    def test_failure_reading_the_request_refunds_user_token(self):
+        class View:
+            def get_upstream_calls(self, request):
+                raise UploadTooLarge()
+
+        request = self.factory.post('/api/start_game/')
+        request.user = self.user
+        with self.assertRaises(UploadTooLarge):
+            AIAdmissionThrottle().allow_request(request, View())
+        self.assertAlmostEqual(self.tokens(f"ai-user:user:{self.user.pk}"), settings.AI_USER_BURST, delta=0.1)
+
+
+# --- 调度器：优先级、按用户轮转、放弃排队 ---
+
+class SchedulerTests(SimpleTestCase):
+
+    def enqueue(self, scheduler, lane_name, user, granted):
+        waiter = scheduling._Waiter(lane_name, user, lambda: granted.append((lane_name, user)))
+        scheduler._enqueue(waiter)
+        return waiter
+
+    def test_round_robin_between_users(self):
+        scheduler = scheduling.Scheduler(1, {})
+        scheduler.acquire(scheduling.INTERACTIVE, 'holder', timeout=1)
+        granted = []
+        for user in ('a', 'a', 'a', 'b'):
+            self.enqueue(scheduler, scheduling.INTERACTIVE, user, granted)
+        for _ in range(4):
+            scheduler.release(scheduling.INTERACTIVE)
+        self.assertEqual([user for _, user in granted], ['a', 'b', 'a', 'a'])
+
+    def test_higher_priority_lane_first(self):
+        scheduler = scheduling.Scheduler(1, {})
+        scheduler.acquire(scheduling.INTERACTIVE, 'holder', timeout=1)
+        granted = []
+        self.enqueue(scheduler, scheduling.BATCH, 'a', granted)
+        self.enqueue(scheduler, scheduling.SPECULATIVE, 'b', granted)
+        self.enqueue(scheduler, scheduling.INTERACTIVE, 'c', granted)
+        scheduler.release(scheduling.INTERACTIVE)
+        scheduler.release(scheduling.INTERACTIVE)
+        scheduler.release(scheduling.SPECULATIVE)
+        self.assertEqual([lane for lane, _ in granted], [scheduling.INTERACTIVE, scheduling.SPECULATIVE, scheduling.BATCH])
+
+    def test_background_lanes_leave_room_for_players(self):
+        scheduler = scheduling.Scheduler(4, {scheduling.BATCH: 0.25})
+        granted = []
+        for user in ('a', 'b', 'c'):
+            self.enqueue(scheduler, scheduling.BATCH, user, granted)
+        self.assertEqual(len(granted), 1)
+        self.enqueue(scheduler, scheduling.INTERACTIVE, 'player', granted)
+        self.assertIn((scheduling.INTERACTIVE, 'player'), granted)
+
+    def test_timed_out_waiter_leaves_the_queue(self):
+        scheduler = scheduling.Scheduler(1, {})
+        scheduler.acquire(scheduling.INTERACTIVE, 'holder', timeout=1)
+        with self.assertRaises(DeadlineExceeded):
+            scheduler.acquire(scheduling.INTERACTIVE, 'late', timeout=0.05)
+        scheduler.release(scheduling.INTERACTIVE)
+        self.assertEqual(dict(scheduler.stats()), {
+            (lane, state): 0 for lane in scheduling.LANES for state in ('running', 'queued')
+        })
+
+    def test_cancelled_async_waiter_returns_its_slot(self):
+        scheduler = scheduling.Scheduler(1, {})
+        scheduler.acquire(scheduling.INTERACTIVE, 'holder', timeout=1)
+
+        async def wait_then_cancel():
+            task = asyncio.ensure_future(scheduler.aacquire(scheduling.INTERACTIVE, 'late', timeout=5))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(wait_then_cancel())
+        scheduler.release(scheduling.INTERACTIVE)
+        self.assertEqual(sum(count for _, count in scheduler.stats()), 0)
+
+    def test_try_acquire_does_not_jump_the_queue(self):
+        scheduler = scheduling.Scheduler(2, {})
+        self.assertTrue(scheduler.try_acquire(scheduling.INTERACTIVE))
+        self.assertTrue(scheduler.try_acquire(scheduling.INTERACTIVE))
+        self.assertFalse(scheduler.try_acquire(scheduling.INTERACTIVE))
+        granted = []
+        self.enqueue(scheduler, scheduling.BATCH, 'a', granted)
+        scheduler.release(scheduling.INTERACTIVE)
+        self.assertEqual(granted, [(scheduling.BATCH, 'a')])
+
+
+# --- 用户战绩汇总 ---
+
+class UserStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='bob', password='secret')
+
+    def play(self, *results):
+        for winner, score in results:
+            create_round(self.user, winner=winner, player_score=score)
+
+    def test_incremental_stats(self):
+        self.play(('player', 80.0), ('player', 70.0), ('draw', 50.0), ('player', 90.0), ('ai', None))
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual((stats.total_rounds, stats.wins, stats.losses, stats.draws), (5, 3, 1, 1))
+        self.assertEqual((stats.current_streak, stats.longest_streak), (0, 2))
+        # 没有得分的回合不计入平均分
+        self.assertEqual(stats.scored_rounds, 4)
+        self.assertEqual(stats.average_score, 72.5)
+        self.assertEqual(stats.best_score, 90.0)
+        self.assertEqual(stats.win_rate, 0.6)
+
+    def test_streak_continues_until_broken(self):
+        self.play(('ai', 10.0), ('player', 60.0), ('player', 61.0), ('player', 62.0))
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual((stats.current_streak, stats.longest_streak), (3, 3))
+
+    def test_rebuild_matches_incremental(self):
+        self.play(('player', 80.0), ('ai', 20.0), ('player', 75.5), ('player', 66.0), ('draw', 50.0))
+        expected = UserStats.objects.get(user=self.user)
+        UserStats.objects.filter(user=self.user).update(total_rounds=0, wins=0, longest_streak=9, score_sum=0)
+
+        rebuilt = rebuild_user_stats(self.user.pk)
+        stored = UserStats.objects.get(user=self.user)
+        for stats in (rebuilt, stored):
+            for field in ('total_rounds', 'wins', 'losses', 'draws', 'scored_rounds', 'score_sum',
+                          'best_score', 'current_streak', 'longest_streak', 'last_played_at'):
+                self.assertEqual(getattr(stats, field), getattr(expected, field), field)
+
+    def test_rebuild_creates_missing_row(self):
+        self.play(('player', 80.0))
+        UserStats.objects.filter(user=self.user).delete()
+        rebuild_user_stats(self.user.pk)
+        self.assertEqual(UserStats.objects.get(user=self.user).wins, 1)
+
+    def test_deleting_a_round_rebuilds(self):
+        self.play(('player', 80.0), ('player', 70.0))
+        with self.captureOnCommitCallbacks(execute=True):
+            GameRound.objects.filter(user=self.user).order_by('id').last().delete()
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual((stats.total_rounds, stats.wins, stats.longest_streak), (1, 1, 1))
+
+
+# --- 历史记录和排行榜的快速序列化与 DRF 序列化器逐字节相同 ---
+
+class FastSerializerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='carol', password='secret')
+        other = User.objects.create_user(username='卡罗尔', password='secret')
+        create_round(cls.user, 'player', 81.25, 40.0, player_prompt='一只在沙发上的猫 "quoted"')
+        create_round(cls.user, 'ai', 10.0, 99.99, ai_generated_prompt_from_image=None,
+                     image_renditions={'original': {'play_jpg': 'http://example.com/a.jpg'}})
+        create_round(cls.user, 'draw', 50.0, 50.0, player_prompt='emoji 🐱\n\ttab')
+        create_round(other, 'player', 100.0, 0.0)
+        create_round(other, 'player', 0.1, 0.0, player_generated_image_url=None)
+
+    def test_history_is_byte_identical(self):
+        history = GameRound.objects.filter(user=self.user).order_by('-timestamp')
+        expected = JSONRenderer().render(GameRoundResultSerializer(history, many=True).data)
+        self.assertEqual(FastJSONRenderer().render(game_round_rows.serialize_queryset(history)), expected)
+
+    def test_leaderboard_is_byte_identical(self):
+        expected = JSONRenderer().render(LeaderboardSerializer(leaderboard_queryset(), many=True).data)
+        self.assertEqual(FastJSONRenderer().render(leaderboard_rows.serialize_dicts(leaderboard_queryset())), expected)
+
+    def test_history_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/history/')
+        self.assertEqual(response.status_code, 200)
+        history = GameRound.objects.filter(user=self.user).order_by('-timestamp')
+        self.assertEqual(response.content, JSONRenderer().render(GameRoundResultSerializer(history, many=True).data))
+
+
+# --- 重新打分：检查点与中断后继续 ---
+
+class RescoringTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='gamecore-test-media-')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.checkpoint_path = os.path.join(media_root, 'checkpoint.json')
+
+        self.user = get_user_model().objects.create_user(username='dave', password='secret')
+        self.rounds = [
+            create_round(
+                self.user, winner='ai', player_score=0.0, ai_score=0.0, score_model='old-model',
+                original_image_url=self.save_image(f"original-{i}", (200, 10 * i, 0)),
+                player_generated_image_url=self.save_image(f"player-{i}", (190, 10 * i, 0)),
+                ai_generated_image_url=self.save_image(f"ai-{i}", (0, 0, 200)),
+            )
+            for i in range(5)
+        ]
+        self.model = DeterministicClipModel()
+
+    def save_image(self, name, color):
+        buffer = BytesIO()
+        Image.new('RGB', (32, 32), color).save(buffer, format='PNG')
+        path = default_storage.save(f"uploads/{name}.png", ContentFile(buffer.getvalue()))
+        return image_processing.media_url(path)
+
+    def rescorer(self, **kwargs):
+        return Rescorer(self.model, 'test-model', chunk_size=2, fetch_workers=2, log=lambda message: None, **kwargs)
+
+    def test_resume_from_checkpoint(self):
+        checkpoint = self.rescorer().run(Checkpoint(model='test-model'), self.checkpoint_path, limit=2)
+        self.assertEqual((checkpoint.processed, checkpoint.updated, checkpoint.failed), (2, 2, 0))
+        self.assertEqual(checkpoint.last_id, self.rounds[1].id)
+        self.assertEqual(GameRound.objects.filter(score_model='test-model').count(), 2)
+
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['last_id'], self.rounds[1].id)
+
+        resumed = Checkpoint.load(self.checkpoint_path, 'test-model')
+        checkpoint = self.rescorer().run(resumed, self.checkpoint_path)
+        self.assertEqual((checkpoint.processed, checkpoint.updated), (5, 5))
+        self.assertEqual(GameRound.objects.exclude(score_model='test-model').count(), 0)
+        self.assertTrue(checkpoint.refreshed)
+
+        # 玩家的图片与原图接近，AI 的图片差得远
+        for game_round in GameRound.objects.all():
+            self.assertGreater(game_round.player_similarity_score, game_round.ai_similarity_score)
+            self.assertEqual(game_round.winner, 'player')
+        self.assertEqual(UserStats.objects.get(user=self.user).wins, 5)
+
+    def test_checkpoint_belongs_to_one_model(self):
+        self.rescorer().run(Checkpoint(model='test-model'), self.checkpoint_path, limit=2)
+        with self.assertRaises(ValueError):
+            Checkpoint.load(self.checkpoint_path, 'another-model')
+
+    def test_rescored_rounds_are_skipped_unless_forced(self):
+        self.rescorer().run(Checkpoint(model='test-model'))
+        self.assertEqual(self.rescorer().run(Checkpoint(model='test-model')).processed, 0)
+        self.assertEqual(self.rescorer(force=True).run(Checkpoint(model='test-model')).processed, 5)
+
+    def test_same_inputs_give_same_scores(self):
+        self.rescorer().run(Checkpoint(model='test-model'))
+        first = list(GameRound.objects.order_by('id').values_list('player_similarity_score', 'ai_similarity_score'))
+        self.rescorer(force=True).run(Checkpoint(model='test-model'))
+        second = list(GameRound.objects.order_by('id').values_list('player_similarity_score', 'ai_similarity_score'))
+        self.assertEqual(first, second)
+
+
+# --- 锦标赛 ---
+
+class TournamentBackgroundTests(SimpleTestCase):
+
+    def test_preparation_does_not_block_short_background_tasks(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        # 比 batch 线程池大得多的一批长时间运行的准备任务
+        blocked = [background.submit_batch(release.wait, 5) for _ in range(settings.BACKGROUND_WORKERS * 2)]
+        self.assertEqual(background.submit(lambda: 'done').result(timeout=1), 'done')
+        release.set()
+        for future in blocked:
+            self.assertTrue(future.result(timeout=5))
+
+
+@override_settings(MIRROR_GENERATED_IMAGES=False)
+class TournamentTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='frank', password='secret')
+
+    def test_round_trip_from_preparation_to_final_result(self):
+        prepared = [
+            PreparedRound(
+                original_image_url=f"http://example.com/original-{i}.jpg", original_renditions={},
+                original_image_bytes=b'', ai_prompt=f"prompt {i}",
+                ai_renditions={image_processing.MAIN_RENDITION: f"http://example.com/ai-{i}.jpg"}, ai_image_bytes=b'',
+            )
+            for i in range(2)
+        ]
+        original = np.array([1.0, 0.0], dtype=np.float32)
+        ai = np.array([0.6, 0.8], dtype=np.float32)
+        player = np.array([[0.8, 0.6], [0.0, 1.0]], dtype=np.float32)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            session = tournaments.create_session(self.user, round_count=2)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(session.status, 'preparing')
+
+        with mock.patch.object(tournaments, 'prepare_ai_side', side_effect=prepared), \
+                mock.patch.object(ai_services, 'encode_images',
+                                  side_effect=[np.stack([original, original, ai, ai]), player]), \
+                mock.patch.object(ai_services, 'score_model_name', return_value='clip-test'), \
+                mock.patch.object(ai_services, 'get_image_from_prompt', return_value='http://example.com/player.jpg'), \
+                mock.patch.object(image_processing, 'fetch_image_bytes', return_value=b'player'):
+            tournaments.prepare_session(session.pk)
+            session.refresh_from_db()
+            self.assertEqual(session.status, 'ready')
+            self.assertEqual([r.ai_similarity_score for r in session.rounds.order_by('index')], [60.0, 60.0])
+
+            game_rounds = tournaments.play_turns(session, [
+                {'index': 0, 'player_prompt': 'a red square'},
+                {'index': 1, 'player_prompt': 'a blue circle'},
+            ], deadline=Deadline(30))
+
+        self.assertEqual([r.winner for r in game_rounds], ['player', 'ai'])
+        self.assertEqual(game_rounds[1].ai_generated_prompt_from_image, 'prompt 1')
+        session = TournamentSession.objects.get(pk=session.pk)
+        self.assertEqual(session.status, 'finished')
+        self.assertEqual((session.player_total_score, session.ai_total_score), (80.0, 120.0))
+        self.assertEqual((session.player_wins, session.ai_wins, session.winner), (1, 1, 'ai'))
+        # 已经完成的轮次不能再次提交
+        with self.assertRaises(tournaments.TournamentConflict):
+            tournaments.play_turns(session, [{'index': 0, 'player_prompt': 'again'}], deadline=Deadline(30))
+
+
+# --- 每日挑战 ---
+
+class ChallengeTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='erin', password='secret')
+        self.yesterday = timezone.localdate() - datetime.timedelta(days=1)
+
+    def publish(self, date, name, replace=False, embeddings=None):
+        prepared = PreparedRound(
+            original_image_url=f"http://example.com/{name}.jpg", original_renditions={},
+            original_image_bytes=b'', ai_prompt=f"{name} prompt",
+            ai_renditions={image_processing.MAIN_RENDITION: f"http://example.com/{name}-ai.jpg"}, ai_image_bytes=b'',
+        )
+        with mock.patch.object(challenges, 'prepare_ai_side', return_value=prepared), \
+                mock.patch.object(ai_services, 'encode_images', return_value=embeddings), \
+                mock.patch.object(ai_services, 'score_model_name', return_value='clip-test'):
+            return challenges.publish_challenge(date, replace=replace)
+
+    def test_replacing_detaches_rounds_played_on_the_old_challenge(self):
+        challenge = self.publish(self.yesterday, 'old')
+        with transaction.atomic():
+            game_round = create_round(self.user, daily_challenge=challenge)
+            challenges.record_entry(challenge, self.user, game_round)
+
+        with self.assertRaises(ValueError):
+            self.publish(self.yesterday, 'new')
+        replaced = self.publish(self.yesterday, 'new', replace=True)
+
+        self.assertEqual(replaced.pk, challenge.pk)
+        self.assertEqual(replaced.original_image_url, 'http://example.com/new.jpg')
+        game_round.refresh_from_db()
+        self.assertIsNone(game_round.daily_challenge_id)
+        # 重新打分后重建成绩，旧回合不会回到新挑战的排行榜上
+        challenges.rebuild_entries(replaced.pk)
+        self.assertFalse(ChallengeEntry.objects.filter(challenge=replaced).exists())
+
+    def test_todays_challenge_cannot_be_replaced(self):
+        self.publish(timezone.localdate(), 'today')
+        with self.assertRaises(ValueError):
+            self.publish(timezone.localdate(), 'again', replace=True)
+
+    @override_settings(MIRROR_GENERATED_IMAGES=False)
+    def test_play_records_attempts_and_keeps_the_best_round(self):
+        challenge = self.publish(timezone.localdate(), 'today', embeddings=np.array([[1.0, 0.0], [0.6, 0.8]]))
+        self.assertEqual(challenge.ai_similarity_score, 60.0)
+
+        game_rounds = []
+        with mock.patch.object(ai_services, 'get_image_from_prompt', return_value='http://example.com/player.jpg'), \
+                mock.patch.object(image_processing, 'fetch_image_bytes', return_value=b'player'), \
+                mock.patch.object(ai_services, 'score_model_name', return_value='clip-test'):
+            for player_embedding in ([0.8, 0.6], [0.0, 1.0], [0.9, 0.19 ** 0.5]):
+                with mock.patch.object(ai_services, 'encode_images', return_value=np.array([player_embedding])):
+                    game_rounds.append(challenges.play_challenge(challenge, self.user, 'a prompt', Deadline(30)))
+
+        self.assertEqual([r.player_similarity_score for r in game_rounds], [80.0, 0.0, 90.0])
+        self.assertEqual([r.winner for r in game_rounds], ['player', 'ai', 'player'])
+        entry = ChallengeEntry.objects.get(challenge=challenge, user=self.user)
+        self.assertEqual((entry.attempts, entry.best_score, entry.best_round_id), (3, 90.0, game_rounds[2].pk))
+        challenge.refresh_from_db()
+        self.assertEqual(challenge.play_count, 3)
+
+        # 过去的挑战不能再提交回合
+        challenge.date = self.yesterday
+        with self.assertRaises(challenges.ChallengeClosed):
+            challenges.play_challenge(challenge, self.user, 'a prompt', Deadline(30))
+
+
+# --- 异步（ASGI）模式 ---
+
+class AsyncServiceTests(SimpleTestCase):
+
+    def test_failed_download_degrades_like_the_sync_path(self):
+        failing = mock.AsyncMock(side_effect=OSError('connection reset'))
+        with mock.patch.object(image_processing, 'afetch_image_bytes', failing):
+            score = asyncio.run(ai_services.acalculate_image_similarity('http://example.com/a.jpg', b'image'))
+        self.assertIsNone(score)
+
+
+# --- 图片处理：衍生图和下载 ---
+
+class ImageProcessingTests(SimpleTestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='gamecore-test-media-')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def open_saved(self, path):
+        with default_storage.open(path, 'rb') as f:
+            image = Image.open(BytesIO(f.read()))
+            image.load()
+        return image
+
+    def test_rendition_sizes_and_formats(self):
+        saved = image_processing.save_renditions(image_bytes(size=(1024, 768)))
+        self.assertEqual(set(saved), {f"{name}_{ext}" for name in ('play', 'score', 'preview') for ext in ('jpg', 'webp')})
+        # 主图沿用旧的文件名格式
+        self.assertRegex(saved[image_processing.MAIN_RENDITION], r'^uploads/[0-9a-f]{32}\.jpg$')
+
+        expected_sizes = {'play': (512, 384), 'score': (224, 224), 'preview': (128, 96)}
+        for key, path in saved.items():
+            name, ext = key.rsplit('_', 1)
+            image = self.open_saved(path)
+            self.assertEqual(image.size, expected_sizes[name], key)
+            self.assertEqual(image.format, {'jpg': 'JPEG', 'webp': 'WEBP'}[ext], key)
+
+        main_url = image_processing.media_url(saved[image_processing.MAIN_RENDITION])
+        self.assertEqual(
+            image_processing.rendition_urls_for(main_url),
+            {key: image_processing.media_url(path) for key, path in saved.items()},
+        )
+
+    def test_small_images_are_not_upscaled(self):
+        saved = image_processing.save_renditions(image_bytes(size=(100, 50)), keep_source=True)
+        self.assertEqual(self.open_saved(saved['play_jpg']).size, (100, 50))
+        self.assertEqual(self.open_saved(saved['preview_webp']).size, (100, 50))
+        # 打分图总是拉伸到 CLIP 的输入尺寸
+        self.assertEqual(self.open_saved(saved['score_jpg']).size, (224, 224))
+        self.assertTrue(saved[image_processing.SOURCE_RENDITION].endswith('_source.png'))
+
+    def test_process_pool_matches_in_process_rendering(self):
+        source = image_bytes(size=(800, 600), image_format='JPEG')
+        with override_settings(IMAGE_PROCESSING_WORKERS=0):
+            in_process = image_processing.build_renditions(source)
+        with override_settings(IMAGE_PROCESSING_WORKERS=1):
+            self.assertEqual(image_processing.build_renditions(source), in_process)
+
+    def test_download_concurrency_follows_settings(self):
+        with override_settings(IMAGE_DOWNLOAD_CONCURRENCY=3):
+            slots = image_processing._get_download_slots()
+            self.assertEqual(slots._initial_value, 3)
+        self.assertEqual(image_processing._get_download_slots()._initial_value, settings.IMAGE_DOWNLOAD_CONCURRENCY)
+
+
+# --- CLIP 打分进程池 ---
+
+class ScoringPoolTests(SimpleTestCase):
+
+    def test_queue_size_follows_settings(self):
+        with override_settings(SCORING_QUEUE_SIZE=5):
+            self.assertEqual(scoring._get_slots()._initial_value, 5)
+        self.assertEqual(scoring._get_slots()._initial_value, max(1, settings.SCORING_QUEUE_SIZE))
+
+
+@override_settings(SCORING_WORKERS=1, SCORING_QUEUE_SIZE=1, SCORING_QUEUE_TIMEOUT=0.05, SCORING_TIMEOUT=5)
+class ScoringRunTests(SimpleTestCase):
+    """
+    打分任务在线程池中执行（与进程池的接口相同），不需要启动加载模型的打分进程。
+    """
+
+    def setUp(self):
+        pool = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(pool.shutdown)
+        for patcher in (
+            mock.patch.object(scoring, '_get_pool', return_value=pool),
+            mock.patch.object(scoring, '_worker_model', DeterministicClipModel()),
+            mock.patch.object(scoring, 'model_loaded', None),
+            mock.patch.object(ai_services, 'clip_model', None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_encode_runs_in_the_pool_and_reports_the_model_state(self):
+        embeddings = ai_services.encode_images([image_bytes(color=(200, 0, 0)), image_bytes(color=(200, 0, 0))])
+        self.assertEqual(embeddings.shape, (2, 16 * 16 * 3))
+        self.assertAlmostEqual(ai_services.similarity_from_embeddings(embeddings[0], embeddings[1]), 100.0)
+        self.assertTrue(scoring.model_loaded)
+        self.assertTrue(ai_services.score_model_name())
+        # 任务结束后名额已经归还
+        self.assertTrue(scoring._get_slots().acquire(blocking=False))
+        scoring._get_slots().release()
+
+    def test_full_queue_raises_scoring_busy(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        holder = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(holder.shutdown)
+        running = holder.submit(scoring.run, lambda: (True, release.wait(5)))
+        time.sleep(0.05)
+        with self.assertRaises(scoring.ScoringBusy):
+            scoring.run(scoring.encode_task, [image_bytes()])
+        release.set()
+        self.assertTrue(running.result(timeout=5))
+        self.assertEqual(scoring.run(scoring.encode_task, [image_bytes()]).shape, (1, 16 * 16 * 3))
+
+    @override_settings(SCORING_TIMEOUT=0.05)
+    def test_slow_task_raises_scoring_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with self.assertRaises(scoring.ScoringTimeout):
+            scoring.run(lambda: (True, release.wait(5)))
+
+
+# --- 上传：大小上限和图片头检查 ---
+
+@override_settings(MAX_UPLOAD_SIZE=4096, MAX_UPLOAD_PIXELS=64 * 64)
+class UploadTests(AdmissionStateMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username='frank', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        generate = mock.patch.object(ai_services, 'get_image_from_prompt')
+        save = mock.patch.object(image_processing, 'save_renditions')
+        self.generate = generate.start()
+        self.save_renditions = save.start()
+        self.addCleanup(generate.stop)
+        self.addCleanup(save.stop)
+
+    def upload(self, content, name='upload.png'):
+        return self.client.post('/api/start_game/', {'uploaded_image': ContentFile(content, name=name)},
+                                format='multipart')
+
+    def assertNothingProcessed(self):
+        self.generate.assert_not_called()
+        self.save_renditions.assert_not_called()
+
+    def test_oversized_content_length_is_rejected(self):
+        response = self.upload(b'0' * 8192)
+        self.assertEqual(response.status_code, 413)
+        self.assertNothingProcessed()
+        # 被拒绝的上传不占用 AI 限流的配额
+        self.assertAlmostEqual(self.tokens(f"ai-user:user:{self.user.pk}"), settings.AI_USER_BURST, delta=0.1)
+
+    def test_streamed_bytes_are_capped_without_content_length(self):
+        handler = CappedTemporaryFileUploadHandler(max_size=100)
+        # Content-Length 缺失时不能提前拒绝，按实际写入的字节数检查
+        handler.handle_raw_input(None, {}, None, 'boundary')
+        handler.new_file('uploaded_image', 'upload.png', 'image/png', None)
+        self.addCleanup(handler.file.close)
+        handler.receive_data_chunk(b'0' * 64, 0)
+        with self.assertRaises(UploadTooLarge):
+            handler.receive_data_chunk(b'0' * 64, 64)
+
+    def test_non_image_is_rejected(self):
+        response = self.upload(b'not an image, just some text', name='upload.png')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('uploaded_image', response.json())
+        self.assertNothingProcessed()
+
+    def test_unsupported_format_is_rejected(self):
+        response = self.upload(image_bytes(image_format='GIF'), name='upload.gif')
+        self.assertEqual(response.status_code, 400)
+        self.assertNothingProcessed()
+
+    def test_too_many_pixels_is_rejected(self):
+        response = self.upload(image_bytes(size=(65, 64)))
+        self.assertEqual(response.status_code, 400)
+        self.assertNothingProcessed()
+
+    def test_valid_upload_is_processed(self):
+        self.save_renditions.return_value = {image_processing.MAIN_RENDITION: 'uploads/upload.jpg'}
+        with mock.patch.object(speculation, 'start'):
+            response = self.upload(image_bytes(size=(64, 64)))
+        self.assertEqual(response.status_code, 200)
+        self.save_renditions.assert_called_once()
+        self.generate.assert_not_called()
+
+
+# --- Token 认证缓存 ---
+
+class TokenCacheTests(TestCase):
+
+    def setUp(self):
+        authentication._token_cache.clear()
+        self.addCleanup(authentication._token_cache.clear)
+        self.user = get_user_model().objects.create_user(username='grace', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(self.client.get('/api/history/').status_code, 200)
+        self.assertIn(self.token.key, authentication._token_cache)
+
+    def test_cached_token_authenticates_without_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/history/').status_code, 200)
+        self.assertFalse([query for query in queries.captured_queries if 'authtoken_token' in query['sql']])
+
+    def test_deleted_token_is_rejected(self):
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/history/').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.client.get('/api/history/').status_code, 401)
+
+    def test_password_change_revokes_tokens(self):
+        self.user.set_password('new secret')
+        self.user.save()
+        self.assertEqual(self.client.get('/api/history/').status_code, 401)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+
+    def test_login_keeps_the_cache_entry(self):
+        update_last_login(None, self.user)
+        self.assertIn(self.token.key, authentication._token_cache)
+        self.assertEqual(self.client.get('/api/history/').status_code, 200)
+
+    def test_password_hash_upgrade_keeps_tokens(self):
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.must_update', return_value=True):
+            self.assertTrue(self.user.check_password('secret'))
+        self.assertTrue(Token.objects.filter(user=self.user).exists())
+
+
+# --- 开局后投机执行 AI 一方 ---
+
+@override_settings(SPECULATIVE_AI_BRANCH=True, MIRROR_GENERATED_IMAGES=False, AI_USER_BURST=10,
+                   ARK_MODEL_RATES={'vision': '60/min', 'image_generation': '60/min'})
+class SpeculationTests(AdmissionStateMixin, TestCase):
+    original_image_url = 'http://example.com/original.jpg'
+
+    def setUp(self):
+        super().setUp()
+        caches_setting = {
+            **settings.CACHES,
+            'speculation': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'speculation-tests'},
+        }
+        override = override_settings(CACHES=caches_setting)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(caches['speculation'].clear)
+
+        self.user = get_user_model().objects.create_user(username='heidi', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for name, value in (
+            ('get_image_from_prompt', 'http://example.com/generated.jpg'),
+            ('get_ai_prompt_from_image', 'fresh prompt'),
+            ('calculate_image_similarity', 0.5),
+        ):
+            patcher = mock.patch.object(ai_services, name, return_value=value)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(image_processing, 'fetch_image_bytes', return_value=b'image')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def speculate(self, **compute):
+        result = {
+            'status': 'done',
+            'ai_generated_prompt_from_image': 'speculated prompt',
+            'ai_generated_image_url': 'http://testserver/media/generated/ai.jpg',
+            'ai_similarity_score': 0.25,
+            'ai_renditions': {image_processing.MAIN_RENDITION: 'http://testserver/media/generated/ai.jpg'},
+            'score_model': 'test-model',
+        }
+        with mock.patch.object(speculation, '_compute', return_value=result, **compute):
+            self.assertTrue(speculation.start(self.original_image_url, user=self.user.pk))
+            key = speculation.cache_key(self.original_image_url, 'en', 20)
+            future = speculation._pending.get(key)
+            if future is not None:
+                future.result(timeout=5)
+
+    def play_turn(self):
+        response = self.client.post('/api/play_turn/', {
+            'original_image_url': self.original_image_url, 'player_prompt': 'a cat',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def assertModelTokens(self, vision, image_generation):
+        self.assertAlmostEqual(self.tokens('ai-model:vision'), vision, delta=0.1)
+        self.assertAlmostEqual(self.tokens('ai-model:image_generation'), image_generation, delta=0.1)
+
+    def test_turn_reuses_the_speculated_ai_side(self):
+        self.speculate()
+        self.assertModelTokens(59, 59)
+
+        result = self.play_turn()
+        self.assertEqual(result['ai_generated_prompt_from_image'], 'speculated prompt')
+        self.assertEqual(result['ai_similarity_score'], 0.25)
+        self.get_ai_prompt_from_image.assert_not_called()
+        self.assertEqual(self.get_image_from_prompt.call_count, 1)
+        # 开局时扣除的 AI 一方，加上回合中玩家的一次生图；回合多扣的 AI 一方只归还一次
+        self.assertModelTokens(59, 58)
+
+    @override_settings(SPECULATION_MAX_QUEUE_DELAY=-1)
+    def test_expired_speculation_falls_back_to_the_full_ai_branch(self):
+        self.speculate()
+        # 放弃的投机任务归还令牌
+        self.assertModelTokens(60, 60)
+
+        result = self.play_turn()
+        self.assertEqual(result['ai_generated_prompt_from_image'], 'fresh prompt')
+        self.get_ai_prompt_from_image.assert_called_once()
+        self.assertEqual(self.get_image_from_prompt.call_count, 2)
+        self.assertModelTokens(59, 58)
+
+    def test_failed_speculation_falls_back_to_the_full_ai_branch(self):
+        self.speculate(side_effect=RuntimeError('AI 识图失败。'))
+
+        result = self.play_turn()
+        self.assertEqual(result['ai_generated_prompt_from_image'], 'fresh prompt')
+        self.get_ai_prompt_from_image.assert_called_once()
+        self.assertEqual(self.get_image_from_prompt.call_count, 2)
+
+
+# --- 生成图片转存到本站 ---
+
+class MirroringTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='gamecore-test-media-')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = get_user_model().objects.create_user(username='ivan', password='secret')
+
+    def test_mirror_rewrites_round_urls(self):
+        original = {'play_jpg': 'http://testserver/media/uploads/original.jpg'}
+        game_round = create_round(
+            self.user,
+            player_generated_image_url='https://provider.example.com/player.jpg?expires=1',
+            ai_generated_image_url='https://provider.example.com/ai.jpg?expires=1',
+            image_renditions={'original': original},
+        )
+        content = image_bytes(size=(600, 600))
+        mirroring.mirror_round_images(game_round.id, {'player': content, 'ai': None})
+
+        game_round.refresh_from_db()
+        player = game_round.image_renditions['player']
+        self.assertEqual(game_round.player_generated_image_url, player[image_processing.MAIN_RENDITION])
+        self.assertRegex(image_processing.media_path_from_url(game_round.player_generated_image_url), r'^generated/')
+        # 没有内容的图片保持原来的 URL，已有的衍生图记录保留
+        self.assertEqual(game_round.ai_generated_image_url, 'https://provider.example.com/ai.jpg?expires=1')
+        self.assertEqual(game_round.image_renditions['original'], original)
+        # 原样保存的原始图片与打分时使用的内容相同
+        self.assertEqual(image_processing.read_local_media(player[image_processing.SOURCE_RENDITION]), content)
+
+
+# --- 数据库连接复用 ---
+
+class DatabaseSettingsTests(SimpleTestCase):
+
+    def load_settings(self, pool_installed=True, **env):
+        """
+        按给定的环境变量重新执行一遍 settings 模块，返回其中的 DATABASES 配置。
+        """
+        find_spec = importlib.util.find_spec
+
+        def fake_find_spec(name, *args, **kwargs):
+            if name == 'dj_db_conn_pool':
+                return find_spec('os') if pool_installed else None
+            return find_spec(name, *args, **kwargs)
+
+        defaults = {'DB_POOL': 'False', 'GAMECORE_ASYNC_VIEWS': 'False', 'DB_CONN_MAX_AGE': '', 'DB_POOL_SIZE': '10'}
+        environ = {name: value for name, value in {**defaults, **env}.items() if value}
+        with mock.patch.dict(os.environ, environ), mock.patch('importlib.util.find_spec', fake_find_spec), \
+                mock.patch('builtins.print'):
+            for name in set(defaults) - set(environ):
+                os.environ.pop(name, None)
+            return runpy.run_module('game_django.settings')['DATABASES']['default']
+
+    def test_persistent_connections_by_default(self):
+        database = self.load_settings()
+        self.assertEqual(database['ENGINE'], 'django.db.backends.mysql')
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+        self.assertNotIn('POOL_OPTIONS', database)
+
+    def test_async_views_disable_thread_persistent_connections(self):
+        self.assertEqual(self.load_settings(GAMECORE_ASYNC_VIEWS='True')['CONN_MAX_AGE'], 0)
+
+    def test_pool_replaces_persistent_connections(self):
+        database = self.load_settings(DB_POOL='True', DB_POOL_SIZE='4')
+        self.assertEqual(database['ENGINE'], 'dj_db_conn_pool.backends.mysql')
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['POOL_OPTIONS']['POOL_SIZE'], 4)
+        self.assertTrue(database['POOL_OPTIONS']['PRE_PING'])
+
+    def test_pool_falls_back_when_not_installed(self):
+        database = self.load_settings(pool_installed=False, DB_POOL='True')
+        self.assertEqual(database['ENGINE'], 'django.db.backends.mysql')
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+
+    def test_pool_stats(self):
+        pool = mock.Mock(**{
+            'size.return_value': 4, 'checkedout.return_value': 3,
+            'checkedin.return_value': 1, 'overflow.return_value': -1,
+        })
+        container = mock.MagicMock(**{'items.return_value': [('default', pool)]})
+        with mock.patch.object(db, 'pool_container', container):
+            self.assertEqual(db.pool_stats(), [
+                (('default', 'size'), 4), (('default', 'checked_out'), 3),
+                (('default', 'idle'), 1), (('default', 'overflow'), 0),
+            ])
+        with mock.patch.object(db, 'pool_container', None):
+            self.assertEqual(db.pool_stats(), [])
+
+
+# --- 数据导出 ---
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='grace', password='secret')
+        self.rounds = [create_round(self.user, player_prompt=f"prompt, {i}") for i in range(5)]
+
+    def test_csv_export_pages_through_all_rows_by_primary_key(self):
+        export = exports.Export('rounds', chunk_size=2)
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(export.lines('csv'))
+        # 每批一块：2 + 2 + 1 行，最后一批不满一批就不再查询
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(queries), 3)
+        rows = list(csv.reader(''.join(chunks).splitlines()))
+        self.assertEqual(rows[0], exports.EXPORTS['rounds'][1])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [r.pk for r in self.rounds])
+        self.assertEqual(rows[1][2], 'grace')
+        self.assertEqual(rows[3][5], 'prompt, 2')
+        self.assertEqual((export.row_count, export.last_id), (5, self.rounds[-1].pk))
+
+    def test_incremental_jsonl_export_continues_from_since_id(self):
+        export = exports.Export('rounds', since_id=self.rounds[2].pk, chunk_size=2)
+        data = b''.join(exports.encode_chunks(export.lines('jsonl'), compress=True))
+        rows = [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines()]
+        self.assertEqual([row['id'] for row in rows], [r.pk for r in self.rounds[3:]])
+        self.assertEqual(rows[0]['player_prompt'], 'prompt, 3')
+        self.assertEqual(export.last_id, self.rounds[-1].pk)
+
+    def test_empty_csv_export_still_has_a_header(self):
+        export = exports.Export('rounds', since_id=self.rounds[-1].pk)
+        self.assertEqual(''.join(export.lines('csv')).strip(), ','.join(exports.EXPORTS['rounds'][1]))
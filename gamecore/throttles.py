@@ -0,0 +1,58 @@
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .admission import TokenBucket, ServiceOverloaded, consume_model_quota, refund_model_quota
+
+
+class AIAdmissionThrottle(BaseThrottle):
+    """
+    AI 接口的准入限流，依次检查两类令牌桶：
+    1. 按用户的令牌桶：防止单个用户（或脚本）刷爆 AI 接口，超限时由 DRF 返回 429 并带上 Retry-After；
+    2. 按模型的全局令牌桶：保护整个服务共享的 Ark 配额，耗尽时返回 503（服务繁忙）。
+    视图通过 get_upstream_calls(request) 声明本次请求会调用哪些模型、各调用几次。
+    任何一个桶拒绝时，已经从其他桶取出的令牌都会归还；放行时把扣除的令牌记在 request 上，
+    请求最终失败且没有发起上游调用（例如参数校验失败、拿不到并发名额）时由视图调用 refund_admission 归还。
+    """
+
+    def __init__(self):
+        self.user_bucket = TokenBucket(settings.AI_USER_RATE, settings.AI_USER_BURST)
+        self._wait = None
+
+    def allow_request(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f"user:{request.user.pk}"
+        else:
+            ident = f"anon:{self.get_ident(request)}"
+        user_key = f"ai-user:{ident}"
+        self._wait = self.user_bucket.consume(user_key)
+        if self._wait:
+            return False
+
+        try:
+            calls = view.get_upstream_calls(request)
+        except Exception:
+            # 例如读取上传文件时超过大小上限（413），请求不会继续处理
+            self.user_bucket.refund(user_key)
+            raise
+        wait = consume_model_quota(calls)
+        if wait:
+            self.user_bucket.refund(user_key)
+            raise ServiceOverloaded(wait=wait)
+        request._ai_admission_charge = (user_key, calls)
+        return True
+
+    def wait(self):
+        return self._wait
+
+
+def refund_admission(request) -> None:
+    """
+    归还 AIAdmissionThrottle 为本次请求扣除的所有令牌（用户桶和各模型的全局桶）。重复调用只归还一次。
+    """
+    charge = getattr(request, '_ai_admission_charge', None)
+    if charge is None:
+        return
+    request._ai_admission_charge = None
+    user_key, calls = charge
+    TokenBucket(settings.AI_USER_RATE, settings.AI_USER_BURST).refund(user_key)
+    refund_model_quota(calls)
@@ -0,0 +1,439 @@
+"""
+锦标赛模式：玩家连续挑战 N 张图片。
+
+- 开局时只创建 TournamentSession 和 N 个 TournamentRound，AI 一方（识图提示词、AI 生成图、
+  原图嵌入和 AI 得分）提交到后台，由 prepare_session 批量预先计算；各轮单独记录成败，失败的轮次重试；
+- 准备任务在 batch 后台线程池中执行，同时准备的锦标赛数量有上限（BACKGROUND_BATCH_WORKERS），
+  其余的在内存中排队，进程重启会丢失正在准备的锦标赛，由 requeue_tournaments 命令重新准备；
+- 各轮之间互不依赖，识图、生图和下载按轮并发执行，所有图片的 CLIP 嵌入用一次 encode 批量计算；
+- 玩家提交时只需要生成自己的图片，和预先保存的原图嵌入比较打分，一次可以提交多轮，同样批量编码。
+"""
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import ai_services
+from . import background
+from . import image_processing
+from . import metrics
+from . import mirroring
+from . import scheduling
+from . import scoring
+from .models import GameRound, TournamentRound, TournamentSession, decide_winner
+from .resilience import CircuitOpenError, Deadline, DeadlineExceeded
+
+# 嵌入以小端 float32 的原始字节保存在 BinaryField 中
+EMBEDDING_DTYPE = '<f4'
+
+
+class TournamentConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = '锦标赛当前状态不允许这个操作。'
+    default_code = 'tournament_conflict'
+
+
+class TurnFailed(Exception):
+    """
+    玩家回合的图片生成、下载或打分失败。
+    """
+
+
+def embedding_to_bytes(embedding: np.ndarray) -> bytes:
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def embedding_from_bytes(content) -> np.ndarray:
+    return np.frombuffer(bytes(content), dtype=EMBEDDING_DTYPE)
+
+
+def reembed_ai_side(target, model=None, model_name: str = '') -> None:
+    """
+    重新计算预先保存的原图嵌入和 AI 得分并写回数据库，用于更换打分模型之后。
+    target 为 TournamentRound 或 DailyChallenge，打分输入与实时打分相同（见 image_processing.scoring_source）。
+    model 默认为当前的 CLIP 模型，此时模型名称取 score_model_name()；传入其他模型时需要同时给出 model_name。
+    """
+    renditions = target.image_renditions or {}
+    images = [
+        image_processing.fetch_image_bytes(
+            image_processing.scoring_source(renditions, 'original', target.original_image_url)
+        ),
+        image_processing.fetch_image_bytes(
+            image_processing.scoring_source(renditions, 'ai', target.ai_generated_image_url)
+        ),
+    ]
+    embeddings = ai_services.encode_images(images, model=model)
+    if embeddings is None:
+        # 与 calculate_image_similarity 一致：CLIP 模型未加载时得分为 0
+        target.original_embedding = None
+        target.ai_similarity_score = 0.0
+        target.embedding_model = ''
+    else:
+        target.original_embedding = embedding_to_bytes(embeddings[0])
+        target.ai_similarity_score = ai_services.similarity_from_embeddings(embeddings[0], embeddings[1])
+        target.embedding_model = model_name if model is not None else ai_services.score_model_name()
+    target.save(update_fields=['original_embedding', 'ai_similarity_score', 'embedding_model'])
+
+
+def _save_as_renditions(content: bytes, prefix: str, keep_source: bool = False) -> dict[str, str]:
+    saved_paths = image_processing.save_renditions(content, prefix=prefix, keep_source=keep_source)
+    return {name: image_processing.media_url(path) for name, path in saved_paths.items()}
+
+
+def create_session(user, round_count: int, language: str = 'en', char_limit: int = 20,
+                   original_image_urls: list[str] | None = None) -> TournamentSession:
+    """
+    创建锦标赛及其各轮记录，事务提交后在后台开始预先计算 AI 一方。
+    original_image_urls 可以指定前几轮的原图，其余轮次在准备阶段随机生成。
+    """
+    original_image_urls = list(original_image_urls or [])
+    with transaction.atomic():
+        session = TournamentSession.objects.create(
+            user=user,
+            language=language,
+            char_limit=char_limit,
+            round_count=round_count,
+        )
+        TournamentRound.objects.bulk_create([
+            TournamentRound(
+                session=session,
+                index=index,
+                original_image_url=original_image_urls[index] if index < len(original_image_urls) else '',
+            )
+            for index in range(round_count)
+        ])
+        transaction.on_commit(lambda: background.submit_batch(prepare_session, session.pk))
+    return session
+
+
+@dataclass
+class PreparedRound:
+    """
+    一张原图预先计算好的 AI 一方，图片内容留给后续批量编码。
+    """
+    original_image_url: str
+    original_renditions: dict
+    original_image_bytes: bytes
+    ai_prompt: str
+    ai_renditions: dict
+    ai_image_bytes: bytes
+
+
+def prepare_ai_side(original_image_url: str, language: str, char_limit: int,
+                    deadline: Deadline) -> PreparedRound:
+    """
+    计算一张原图的 AI 一方（不写数据库）：未指定原图时先生成一张，然后识图，按提示词生成 AI 图片并下载。
+    锦标赛的每一轮和每日挑战都使用这个函数。
+    """
+    if original_image_url:
+        original_renditions = image_processing.rendition_urls_for(original_image_url)
+    else:
+        generated_url = ai_services.get_image_from_prompt(ai_services.random_start_prompt(), deadline=deadline)
+        if not generated_url:
+            raise RuntimeError("生成原图失败。")
+        content = image_processing.fetch_image_bytes(generated_url, deadline=deadline)
+        original_renditions = _save_as_renditions(content, 'uploads')
+        original_image_url = original_renditions[image_processing.MAIN_RENDITION]
+
+    # 与 PlayTurnAPIView 相同：优先使用预先生成的 224px 打分图
+    original_image_bytes = image_processing.fetch_image_bytes(
+        original_renditions.get(image_processing.SCORE_RENDITION, original_image_url),
+        deadline=deadline,
+    )
+
+    ai_prompt = ai_services.get_ai_prompt_from_image(
+        image_url=original_image_url,
+        language=language,
+        char_limit=char_limit,
+        deadline=deadline,
+    )
+    if ai_prompt is None:
+        raise RuntimeError("AI 识图失败。")
+    ai_image_url = ai_services.get_image_from_prompt(ai_prompt, deadline=deadline)
+    if not ai_image_url:
+        raise RuntimeError("AI 生成图片失败。")
+    ai_image_bytes = image_processing.fetch_image_bytes(ai_image_url, deadline=deadline)
+
+    # 服务商返回的 URL 会过期，AI 图片在玩家看到之前就转存到本站
+    return PreparedRound(
+        original_image_url=original_image_url,
+        original_renditions=original_renditions,
+        original_image_bytes=original_image_bytes,
+        ai_prompt=ai_prompt,
+        ai_renditions=_save_as_renditions(ai_image_bytes, 'generated', keep_source=True),
+        ai_image_bytes=ai_image_bytes,
+    )
+
+
+def _prepare_round(tournament_round: TournamentRound, session: TournamentSession,
+                   deadline: Deadline) -> PreparedRound | Exception:
+    """
+    计算一轮的 AI 一方。失败时返回异常而不是抛出，其他轮次不受影响。
+    """
+    try:
+        return prepare_ai_side(tournament_round.original_image_url, session.language, session.char_limit, deadline)
+    except Exception as e:
+        print(f"准备锦标赛 {session.pk} 第 {tournament_round.index + 1} 轮时发生错误: {e}")
+        return e
+
+
+def _prepare_rounds(session: TournamentSession, rounds: list[TournamentRound], prepared: dict,
+                    deadline: Deadline) -> None:
+    """
+    准备一批轮次：各轮并发计算 AI 一方，成功的轮次把原图和 AI 图片放进一次 encode 批量编码后保存；
+    失败的轮次记录错误信息。prepared（轮次 id -> PreparedRound）在重试之间保留，
+    上游调用已经成功、只是编码失败的轮次重试时不再重复调用上游。
+    """
+    todo = [r for r in rounds if r.pk not in prepared]
+    if todo:
+        workers = max(1, min(len(todo), settings.TOURNAMENT_PREPARE_WORKERS))
+        prepare_round = scheduling.bind(lambda r: _prepare_round(r, session, deadline))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gamecore-tournament') as pool:
+            for tournament_round, outcome in zip(todo, pool.map(prepare_round, todo)):
+                if isinstance(outcome, Exception):
+                    tournament_round.error = str(outcome) or type(outcome).__name__
+                else:
+                    prepared[tournament_round.pk] = outcome
+
+    ready = [r for r in rounds if r.pk in prepared]
+    if ready:
+        batch = [prepared[r.pk] for r in ready]
+        try:
+            # 原图在前、AI 图片在后，一次批量编码
+            embeddings = ai_services.encode_images(
+                [p.original_image_bytes for p in batch] + [p.ai_image_bytes for p in batch]
+            )
+        except Exception as e:
+            print(f"编码锦标赛 {session.pk} 的图片时发生错误: {e}")
+            traceback.print_exc()
+            for tournament_round in ready:
+                tournament_round.error = str(e) or type(e).__name__
+            ready = []
+        else:
+            embedding_model = '' if embeddings is None else ai_services.score_model_name()
+            for i, (tournament_round, p) in enumerate(zip(ready, batch)):
+                tournament_round.original_image_url = p.original_image_url
+                renditions = {'ai': p.ai_renditions}
+                if p.original_renditions:
+                    renditions['original'] = p.original_renditions
+                tournament_round.image_renditions = renditions
+                tournament_round.ai_generated_prompt_from_image = p.ai_prompt
+                tournament_round.ai_generated_image_url = p.ai_renditions[image_processing.MAIN_RENDITION]
+                if embeddings is None:
+                    # 与 calculate_image_similarity 一致：CLIP 模型未加载时得分为 0
+                    tournament_round.original_embedding = None
+                    tournament_round.ai_similarity_score = 0.0
+                else:
+                    tournament_round.original_embedding = embedding_to_bytes(embeddings[i])
+                    tournament_round.ai_similarity_score = ai_services.similarity_from_embeddings(
+                        embeddings[i], embeddings[len(batch) + i]
+                    )
+                tournament_round.embedding_model = embedding_model
+                tournament_round.error = ''
+                del prepared[tournament_round.pk]
+
+    TournamentRound.objects.bulk_update(rounds, fields=[
+        'original_image_url',
+        'image_renditions',
+        'ai_generated_prompt_from_image',
+        'ai_generated_image_url',
+        'original_embedding',
+        'ai_similarity_score',
+        'embedding_model',
+        'error',
+    ])
+
+
+def unprepared_rounds(session: TournamentSession):
+    """
+    还没有准备好（AI 图片还没有生成）的轮次。
+    """
+    return session.rounds.filter(ai_generated_image_url='')
+
+
+def prepare_session(session_id: int) -> None:
+    """
+    在后台预先计算整场锦标赛的 AI 一方，只处理还没有准备好的轮次（重新排队时已经准备好的轮次不再重复计算）。
+    每一轮单独记录成败：成功的轮次立即保存，失败的轮次在时间预算内重试，最多 TOURNAMENT_PREPARE_ATTEMPTS 次。
+    全部轮次准备好后锦标赛变为 ready；重试后仍有失败的轮次时标记为 failed 并记录各轮的错误信息，
+    已经准备好的轮次保留，之后可以用 requeue_tournaments 命令只重新准备失败的轮次。
+    """
+    session = TournamentSession.objects.get(pk=session_id)
+    if session.status != 'preparing':
+        return
+    deadline = Deadline(settings.TOURNAMENT_PREPARE_DEADLINE)
+    prepared = {}
+
+    try:
+        # 预先计算的上游调用走 batch 通道，只使用空闲的名额，不影响正在进行的玩家回合
+        with metrics.timed('tournament_prepare'), scheduling.lane(scheduling.BATCH, user=session.user_id):
+            for attempt in range(settings.TOURNAMENT_PREPARE_ATTEMPTS):
+                rounds = list(unprepared_rounds(session))
+                if not rounds or deadline.expired():
+                    break
+                if attempt:
+                    print(f"锦标赛 {session_id} 有 {len(rounds)} 轮准备失败，第 {attempt + 1} 次尝试。")
+                _prepare_rounds(session, rounds, prepared, deadline)
+
+        failed = list(unprepared_rounds(session).values_list('index', 'error'))
+        if failed:
+            session.status = 'failed'
+            session.error = '\n'.join(f"第 {index + 1} 轮：{error or '超出时间预算'}" for index, error in failed)
+        else:
+            session.status = 'ready'
+            session.error = ''
+        session.save(update_fields=['status', 'error'])
+
+    except Exception as e:
+        print(f"准备锦标赛 {session_id} 时发生错误: {e}")
+        traceback.print_exc()
+        session.status = 'failed'
+        session.error = str(e) or type(e).__name__
+        session.save(update_fields=['status', 'error'])
+
+
+def requeue_session(session: TournamentSession) -> None:
+    """
+    把准备中断（进程重启）或准备失败的锦标赛重新标记为 preparing 并重新准备，已经准备好的轮次保留。
+    在调用方的线程中执行。
+    """
+    TournamentSession.objects.filter(pk=session.pk).update(status='preparing', error='')
+    prepare_session(session.pk)
+
+
+def generate_player_image(player_prompt: str, deadline: Deadline) -> tuple[str, bytes]:
+    image_url = ai_services.get_image_from_prompt(player_prompt, deadline=deadline)
+    if not image_url:
+        raise TurnFailed("AI failed to generate one or more images. Check server logs for details.")
+    return image_url, image_processing.fetch_image_bytes(image_url, deadline=deadline)
+
+
+def play_turns(session: TournamentSession, turns: list[dict], deadline: Deadline) -> list[GameRound]:
+    """
+    处理玩家提交的一轮或多轮：并发生成并下载玩家图片，批量编码后与预先保存的原图嵌入比较打分，
+    为每一轮创建 GameRound，并更新锦标赛的汇总结果。turns 为 [{'index': 轮次, 'player_prompt': 提示词}, ...]。
+    """
+    if session.status != 'ready':
+        raise TournamentConflict("锦标赛还没有准备好或已经结束。")
+    rounds = {
+        r.index: r
+        for r in session.rounds.filter(index__in=[turn['index'] for turn in turns], game_round__isnull=True)
+    }
+    if len(rounds) != len(turns):
+        raise TournamentConflict("提交的轮次不存在或已经完成。")
+
+    # 1. 并发生成并下载玩家图片。整个请求只占用一个 gate('ai') 名额，同时进行的生图调用数也要有上限
+    try:
+        workers = max(1, min(len(turns), settings.TOURNAMENT_TURN_WORKERS))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gamecore-tournament') as pool:
+            # 线程池中的线程不继承请求的调度通道和用户，用 bind 带过去
+            generate = scheduling.bind(lambda turn: generate_player_image(turn['player_prompt'], deadline))
+            generated = list(pool.map(generate, turns))
+    except (CircuitOpenError, DeadlineExceeded, TurnFailed):
+        raise
+    except Exception as e:
+        print(f"下载图片时发生错误: {e}")
+        raise TurnFailed("Failed to download images for scoring. Check server logs for details.") from e
+
+    # 2. 一次批量编码所有玩家图片，与预先保存的原图嵌入比较打分。
+    # 原图嵌入不是用当前模型计算的（更换模型后还没有重新打分），先用当前模型重新计算这一轮的 AI 一方
+    try:
+        embeddings = ai_services.encode_images([content for _, content in generated])
+        if embeddings is not None:
+            model_name = ai_services.score_model_name()
+            for turn in turns:
+                tournament_round = rounds[turn['index']]
+                if tournament_round.original_embedding is None or tournament_round.embedding_model != model_name:
+                    reembed_ai_side(tournament_round)
+    except (scoring.ScoringBusy, scoring.ScoringTimeout):
+        raise
+    except Exception as e:
+        print(f"计算图片相似度时发生错误: {e}")
+        traceback.print_exc()
+        raise TurnFailed("Failed to calculate images similarity. Check server logs for details.") from e
+
+    scores = []
+    for i, turn in enumerate(turns):
+        original_embedding = rounds[turn['index']].original_embedding
+        if embeddings is None or original_embedding is None:
+            scores.append(0.0)
+        else:
+            scores.append(ai_services.similarity_from_embeddings(
+                embedding_from_bytes(original_embedding), embeddings[i]
+            ))
+
+    # 3. 写入数据库。锁住锦标赛后再检查一次，防止同一轮被并发请求重复提交
+    with metrics.timed('db_write'), transaction.atomic():
+        session = TournamentSession.objects.select_for_update().get(pk=session.pk)
+        locked = {
+            r.index: r
+            for r in session.rounds.filter(index__in=list(rounds), game_round__isnull=True)
+        }
+        if session.status != 'ready' or len(locked) != len(turns):
+            raise TournamentConflict("提交的轮次已经完成。")
+
+        game_rounds = []
+        for turn, (player_image_url, _), player_similarity_score in zip(turns, generated, scores):
+            tournament_round = locked[turn['index']]
+            game_round = GameRound.objects.create(
+                user=session.user,
+                original_image_url=tournament_round.original_image_url,
+                player_prompt=turn['player_prompt'],
+                player_generated_image_url=player_image_url,
+                player_similarity_score=player_similarity_score,
+                ai_generated_prompt_from_image=tournament_round.ai_generated_prompt_from_image,
+                ai_generated_image_url=tournament_round.ai_generated_image_url,
+                ai_similarity_score=tournament_round.ai_similarity_score,
+                winner=decide_winner(player_similarity_score, tournament_round.ai_similarity_score),
+                score_model=ai_services.score_model_name(),
+                image_renditions=tournament_round.image_renditions,
+            )
+            tournament_round.game_round = game_round
+            tournament_round.save(update_fields=['game_round'])
+            game_rounds.append(game_round)
+
+        update_totals(session)
+
+    # 4. 后台转存玩家图片（AI 图片在准备阶段已经转存）
+    if settings.MIRROR_GENERATED_IMAGES:
+        for game_round, (_, content) in zip(game_rounds, generated):
+            mirroring.schedule_mirror(game_round.id, {'player': content})
+
+    return game_rounds
+
+
+def update_totals(session: TournamentSession) -> None:
+    """
+    根据已完成的轮次重新计算锦标赛的汇总结果；所有轮次完成后按总分判定胜负。
+    """
+    totals = GameRound.objects.filter(tournament_round__session=session).aggregate(
+        rounds_played=Count('id'),
+        player_total_score=Sum('player_similarity_score'),
+        ai_total_score=Sum('ai_similarity_score'),
+        player_wins=Count('id', filter=Q(winner='player')),
+        ai_wins=Count('id', filter=Q(winner='ai')),
+        draws=Count('id', filter=Q(winner='draw')),
+    )
+    session.rounds_played = totals['rounds_played']
+    session.player_total_score = round(totals['player_total_score'] or 0.0, 2)
+    session.ai_total_score = round(totals['ai_total_score'] or 0.0, 2)
+    session.player_wins = totals['player_wins']
+    session.ai_wins = totals['ai_wins']
+    session.draws = totals['draws']
+    update_fields = ['rounds_played', 'player_total_score', 'ai_total_score', 'player_wins', 'ai_wins', 'draws']
+
+    if session.rounds_played >= session.round_count:
+        session.status = 'finished'
+        session.winner = decide_winner(session.player_total_score, session.ai_total_score)
+        # 重新打分时保留原来的结束时间
+        if session.finished_at is None:
+            session.finished_at = timezone.now()
+        update_fields += ['status', 'winner', 'finished_at']
+    session.save(update_fields=update_fields)
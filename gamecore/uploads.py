@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import MultiPartParser, DataAndFiles
+from django.http.multipartparser import MultiPartParser as DjangoMultiPartParser, MultiPartParserError
+from PIL import Image, UnidentifiedImageError
+
+# 允许上传的图片格式（Pillow 的格式名）
+ALLOWED_UPLOAD_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP'}
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = '上传的文件过大。'
+    default_code = 'upload_too_large'
+
+
+class CappedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    把上传内容边接收边写入临时文件（不在内存中缓冲整个文件），
+    请求体声明的长度或实际写入的字节数超过上限时立即中止，不再继续读取。
+    """
+
+    def __init__(self, request=None, max_size: int | None = None):
+        super().__init__(request)
+        self.max_size = max_size or settings.MAX_UPLOAD_SIZE
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # 在读取请求体之前，先根据 Content-Length 快速拒绝
+        if content_length and content_length > self.max_size:
+            raise UploadTooLarge(f"上传的文件不能超过 {self.max_size // (1024 * 1024)} MB。")
+
+    def receive_data_chunk(self, raw_data, start):
+        # Content-Length 可能缺失或不可信，按实际写入的字节数再检查一次
+        if start + len(raw_data) > self.max_size:
+            self.upload_interrupted()
+            raise UploadTooLarge(f"上传的文件不能超过 {self.max_size // (1024 * 1024)} MB。")
+        return super().receive_data_chunk(raw_data, start)
+
+
+class StreamingImageMultiPartParser(MultiPartParser):
+    """
+    只使用 CappedTemporaryFileUploadHandler 的 multipart 解析器：
+    上传的图片直接流式写入临时文件，大小超限时返回 413。
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        request = parser_context['request']
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        meta = request.META.copy()
+        meta['CONTENT_TYPE'] = media_type
+        upload_handlers = [CappedTemporaryFileUploadHandler(request)]
+
+        try:
+            parser = DjangoMultiPartParser(meta, stream, upload_handlers, encoding)
+            data, files = parser.parse()
+            return DataAndFiles(data, files)
+        except MultiPartParserError as exc:
+            raise ParseError('Multipart form parse error - %s' % str(exc))
+
+
+def inspect_image_header(uploaded_file) -> tuple[str, tuple[int, int]]:
+    """
+    只读取文件头，获取图片格式和尺寸，不解码像素数据。
+    格式不支持或像素数超过 MAX_UPLOAD_PIXELS（防止解压炸弹）时抛出 ValueError。
+    """
+    uploaded_file.seek(0)
+    try:
+        with Image.open(uploaded_file) as image:
+            image_format, size = image.format, image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ValueError("无法识别的图片文件。") from e
+    finally:
+        uploaded_file.seek(0)
+
+    if image_format not in ALLOWED_UPLOAD_FORMATS:
+        raise ValueError(f"不支持的图片格式：{image_format}。")
+    if size[0] * size[1] > settings.MAX_UPLOAD_PIXELS:
+        raise ValueError(f"图片尺寸过大（{size[0]}x{size[1]}）。")
+    return image_format, size
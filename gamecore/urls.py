@@ -1,6 +1,22 @@
+from django.conf import settings
 from django.urls import path
 from . import views  # 从当前目录导入 views.py
 
+# 通过 ASGI 部署时使用异步视图（需要安装 adrf），否则使用同步视图
+if settings.GAMECORE_ASYNC_VIEWS:
+    from . import async_views
+    StartGameView = async_views.AsyncStartGameAPIView
+    PlayTurnView = async_views.AsyncPlayTurnAPIView
+    HistoryView = async_views.AsyncGameRoundHistoryAPIView
+    LeaderboardView = async_views.AsyncLeaderboardAPIView
+    GameEventView = async_views.AsyncGameEventAPIView
+else:
+    StartGameView = views.StartGameAPIView
+    PlayTurnView = views.PlayTurnAPIView
+    HistoryView = views.GameRoundHistoryAPIView
+    LeaderboardView = views.LeaderboardAPIView
+    GameEventView = views.GameEventAPIView
+
 
 urlpatterns = [
 
@@ -9,19 +25,38 @@ urlpatterns = [
 
     # 创建一个 API 端点，用于处理游戏的开始。
     # 这个端点将处理 POST 请求，并且使用 MultiPartParser 和 FormParser 来解析包含文件的表单数据。
-    path('api/start_game/', views.StartGameAPIView.as_view(), name='api_start_game'),
+    path('api/start_game/', StartGameView.as_view(), name='api_start_game'),
 
     # 创建一个 API 端点，用于处理游戏回合。
-    path('api/play_turn/', views.PlayTurnAPIView.as_view(), name='api_play_turn'),
+    path('api/play_turn/', PlayTurnView.as_view(), name='api_play_turn'),
 
     # 创建一个 API 端点，用于处理历史记录的获取。
-    path('api/history/', views.GameRoundHistoryAPIView.as_view(), name='api_history'),
+    path('api/history/', HistoryView.as_view(), name='api_history'),
 
     # 创建一个 API 端点，用于处理排行榜的获取。
-    path('api/leaderboard/', views.LeaderboardAPIView.as_view(), name='api_leaderboard'),
+    path('api/leaderboard/', LeaderboardView.as_view(), name='api_leaderboard'),
 
     # 创建一个 API 端点，用于处理数据埋点的记录。
-    path('api/log_event/', views.GameEventAPIView.as_view(), name='api_log_event'),
+    path('api/log_event/', GameEventView.as_view(), name='api_log_event'),
+
+    # 锦标赛模式：开始一场锦标赛、查看状态和结果、提交一轮或多轮（两种部署方式都使用同步视图）。
+    path('api/tournaments/', views.TournamentStartAPIView.as_view(), name='api_tournament_start'),
+    path('api/tournaments/<int:pk>/', views.TournamentDetailAPIView.as_view(), name='api_tournament_detail'),
+    path('api/tournaments/<int:pk>/turns/', views.TournamentTurnsAPIView.as_view(), name='api_tournament_turns'),
+
+    # 创建一个 API 端点，用于获取当前用户的战绩汇总。
+    path('api/me/stats/', views.MyStatsAPIView.as_view(), name='api_my_stats'),
+
+    # 每日挑战：day 为 YYYY-MM-DD 或 today。查看挑战、提交回合、查看挑战排行榜。
+    path('api/challenges/<str:day>/', views.DailyChallengeAPIView.as_view(), name='api_challenge_detail'),
+    path('api/challenges/<str:day>/play/', views.ChallengePlayAPIView.as_view(), name='api_challenge_play'),
+    path('api/challenges/<str:day>/leaderboard/', views.ChallengeLeaderboardAPIView.as_view(), name='api_challenge_leaderboard'),
+
+    # 管理员使用的数据导出端点，kind 为 rounds 或 events。
+    path('api/export/<str:kind>/', views.ExportAPIView.as_view(), name='api_export'),
+
+    # 创建一个端点，以 Prometheus 格式导出各阶段耗时等指标。
+    path('metrics', views.metrics_view, name='metrics'),
 
 ]
 
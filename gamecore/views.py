@@ -1,30 +1,55 @@
 # 导入必要的模块
 from rest_framework.views import APIView # 从DRF导入APIView，这是创建API视图的基础类
-from rest_framework.generics import ListAPIView  # 从DRF导入ListAPIView，用于创建只读的API视图
+from rest_framework.generics import ListAPIView, RetrieveAPIView, get_object_or_404  # 从DRF导入只读的通用API视图
 from rest_framework.response import Response  # 从DRF导入Response对象，用于返回API响应
 from rest_framework import status  # 从DRF导入HTTP状态码，如 400 BAD REQUEST
-from rest_framework.parsers import MultiPartParser, FormParser, JSONParser  # 用于解析包含文件的表单数据
-from rest_framework.permissions import IsAuthenticated  # 用于确保只有经过身份验证的用户才能访问视图
-from django.core.files.storage import default_storage  # 用于管理文件存储
-from django.core.files.base import ContentFile  # 用于创建文件对象
-import random  # 用于生成随机提示词
-import requests  # 用于发送HTTP请求
-import uuid  # 用于生成唯一标识符
-from io import BytesIO  # 用于处理二进制数据
-from PIL import Image  # 用于处理图像
+from rest_framework.parsers import FormParser, JSONParser  # 用于解析表单和 JSON 数据
+from rest_framework.permissions import IsAdminUser, IsAuthenticated  # 用于确保只有经过身份验证的用户（或管理员）才能访问视图
+from rest_framework.renderers import BrowsableAPIRenderer  # 可浏览的 API 页面
+from contextlib import ExitStack  # 用于在请求结束时释放并发名额
+from django.http import Http404, HttpResponse, StreamingHttpResponse  # 用于返回纯文本的指标数据和流式导出
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 # 导入创建的模型和序列化器
-from .models import GameRound, GameEvent  # 导入模型
+from .models import GameRound, GameEvent, TournamentRound, TournamentSession, DailyChallenge, UserStats, decide_winner  # 导入模型
 from .serializers import PlayerTurnInputSerializer, GameRoundResultSerializer, GameStartSerializer, LeaderboardSerializer, GameEventSerializer # 导入序列化器
+from .serializers import TournamentStartSerializer, TournamentTurnsSerializer, TournamentSessionSerializer
+from .serializers import DailyChallengeSerializer, ChallengePlaySerializer, ChallengeLeaderboardSerializer, UserStatsSerializer
+from .serializers import ExportQuerySerializer
+# 高频只读接口的快速序列化与 orjson 渲染
+from .fast_serializers import game_round_rows, leaderboard_rows
+from .renderers import FastJSONRenderer
 
 # 导入AI服务模块
 from . import ai_services
+# 导入上传解析器
+from .uploads import StreamingImageMultiPartParser
+
+# 导入图片处理与转存模块
+from . import image_processing
+from . import mirroring
+from . import resilience
+from . import scheduling
+from . import speculation
+from . import tournaments
+from . import challenges
+from . import exports
+
+# 导入指标收集
+from . import metrics
+from . import scoring
+
+# 导入准入控制与容错
+from .admission import gate, refund_model_quota, ServiceOverloaded, UpstreamTimeout
+from .throttles import AIAdmissionThrottle, refund_admission
+from .resilience import CircuitOpenError, Deadline, DeadlineExceeded
 
 # 导入Django的配置设置
 from django.conf import settings
 
 # 导入数据库聚合、分组功能
-from django.db.models import Count, Avg, F
+from django.db.models import Count, Avg, F, Prefetch
 
 # 使用 React 渲染游戏页面，不需要这个视图
 # def game_view(request):
@@ -36,58 +61,150 @@ from django.db.models import Count, Avg, F
 #     return render(request, 'gamecore/index.html')
 
 
-class StartGameAPIView(APIView):
+class InstrumentedViewMixin:
+    """
+    记录视图的总耗时；启用 METRICS_TRACE_LOG 时输出本次请求各阶段耗时的追踪日志。
+    """
+
+    def initial(self, request, *args, **kwargs):
+        # 先开始追踪，再执行认证、限流等步骤，这样排队等待的时间也会被记录
+        self._trace = metrics.start_trace()
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        trace = getattr(self, '_trace', None)
+        if trace is not None:
+            self._trace = None
+            metrics.finish_trace(
+                trace,
+                view=type(self).__name__,
+                status_code=response.status_code,
+                user=getattr(request.user, 'pk', None),
+            )
+        return response
+
+
+class AIUpstreamMixin:
+    """
+    会调用上游 AI 服务的视图共用的部分（同步和异步视图都使用）：
+    AIAdmissionThrottle 的令牌桶限流，以及把上游熔断、打分进程池繁忙、时间预算耗尽映射为 503/504。
+    限流在参数校验之前扣除令牌；请求最终失败（参数无效、并发名额已满、熔断等）且没有向上游发起过调用时归还，
+    被拒绝的请求不占用用户和模型的配额。
+    """
+    throttle_classes = [AIAdmissionThrottle]
+    # 本视图每次请求调用各模型的次数，子类覆盖
+    upstream_calls = {}
+
+    def get_upstream_calls(self, request):
+        return self.upstream_calls
+
+    def initial(self, request, *args, **kwargs):
+        # 在限流之前开始记录，之后本请求中的上游调用都计入这里
+        self._upstream_attempts = resilience.track_upstream_attempts()
+        super().initial(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        # 熔断中的上游服务快速失败为 503，时间预算耗尽为 504，交给 DRF 生成统一的错误响应
+        if isinstance(exc, CircuitOpenError):
+            exc = ServiceOverloaded(str(exc), wait=exc.retry_after)
+        elif isinstance(exc, (scoring.ScoringBusy, scoring.ScoringTimeout)):
+            exc = ServiceOverloaded(str(exc), wait=settings.SCORING_QUEUE_TIMEOUT)
+        elif isinstance(exc, DeadlineExceeded):
+            exc = UpstreamTimeout()
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        attempts = getattr(self, '_upstream_attempts', None)
+        if response.status_code >= 400 and (attempts is None or attempts.count == 0):
+            refund_admission(request)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class AIAdmissionMixin(AIUpstreamMixin):
+    """
+    同步视图的准入控制：先经过令牌桶限流，再占用一个跨进程的并发名额，直到响应生成后释放。
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._admission = ExitStack()
+        if any(self.get_upstream_calls(request).values()):
+            # 拿不到名额时直接抛出 ServiceOverloaded（503 + Retry-After），并归还限流扣除的令牌
+            try:
+                with metrics.timed('admission_wait'):
+                    self._admission.enter_context(gate('ai').slot())
+            except ServiceOverloaded:
+                refund_admission(request)
+                raise
+            # 本次请求发起的上游调用按玩家回合的优先级、以当前用户排队（见 scheduling.py）
+            self._admission.enter_context(scheduling.lane(scheduling.INTERACTIVE, user=request.user.pk))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        admission = getattr(self, '_admission', None)
+        if admission is not None:
+            admission.close()
+            self._admission = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def round_renditions(original_renditions: dict, speculated: dict | None) -> dict:
+    """
+    新回合的 image_renditions：原图的衍生图，以及投机执行时已经转存的 AI 图片的衍生图。
+    """
+    renditions = {}
+    if original_renditions:
+        renditions['original'] = original_renditions
+    if speculated:
+        renditions['ai'] = speculated['ai_renditions']
+    return renditions
+
+
+def start_game_upstream_calls(request) -> dict:
+    """
+    开局请求的上游调用（同步和异步视图共用）：上传了图片时不调用 AI，否则需要生成一张原图。
+    是否上传以请求中实际带有的文件为准，不带文件的 multipart 表单同样按随机开局计入限流。
+    """
+    if request.content_type.startswith('multipart/') and request.FILES.get('uploaded_image'):
+        return {'image_generation': 0}
+    return {'image_generation': 1}
+
+
+class StartGameAPIView(InstrumentedViewMixin, AIAdmissionMixin, APIView):
     """
     处理游戏开始。职责：接收图片（上传或AI生成），优化处理后，返回优化后图片的URL。
     此视图不创建GameRound记录。
     """
-    parser_classes = [MultiPartParser, FormParser, JSONParser]
+    # 上传的图片流式写入临时文件，超过大小上限时直接返回 413
+    parser_classes = [StreamingImageMultiPartParser, FormParser, JSONParser]
     permission_classes = [IsAuthenticated]
 
+    def get_upstream_calls(self, request):
+        return start_game_upstream_calls(request)
+
     def post(self, request, *args, **kwargs):
         serializer = GameStartSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         uploaded_image = serializer.validated_data.get('uploaded_image')
-        source_image = None
+        image_source = None
 
         try:
             # 统一图片来源
             if uploaded_image:
-                # 来源：用户上传
-                source_image = Image.open(uploaded_image)
+                # 来源：用户上传。上传内容已经流式写入临时文件，只把文件路径交给图片处理进程
+                if hasattr(uploaded_image, 'temporary_file_path'):
+                    image_source = uploaded_image.temporary_file_path()
+                else:
+                    uploaded_image.seek(0)
+                    image_source = uploaded_image.read()
             else:
                 # --- 场景2：随机生成图片 ---
-                # 这里我们使用一个简单的随机生成器来模拟生成图片的过程。
-                styles = [
-                    "写实", "抽象", "印象派", "超现实主义", "复古", "现代", "简约",
-                    "时尚", "浪漫", "暗黑", "梦幻", "蒸汽朋克", "赛博朋克"
-                ]
-                subjects = [
-                    "自然风光", "城市街景", "建筑奇观", "动物世界", "美食佳肴",
-                    "时尚穿搭", "历史场景", "科技产品", "运动瞬间", "节日庆典",
-                    "人物肖像", "静物特写", "抽象图案"
-                ]
-                mediums = [
-                    "油画", "水彩画", "丙烯画", "素描", "数字绘画", "摄影作品",
-                    "3D 渲染", "插画", "拼贴画", "版画"
-                ]
-                moods = [
-                    "欢快", "宁静", "神秘", "温馨", "悲伤", "震撼", "幽默",
-                    "优雅", "紧张", "浪漫", "孤独", "励志"
-                ]
-
-                random_style = random.choice(styles)
-                random_subject = random.choice(subjects)
-                random_medium = random.choice(mediums)
-                random_mood = random.choice(moods)
-
-                prompt = (
-                    f"一张{random_style}风格的{random_subject}主题{random_medium}作品，传达出{random_mood}的情绪，画面细节和构图随机"
-                )
+                prompt = ai_services.random_start_prompt()
 
-                image_url_from_ai = ai_services.get_image_from_prompt(prompt)
+                deadline = Deadline(settings.TURN_DEADLINE)
+                image_url_from_ai = ai_services.get_image_from_prompt(prompt, deadline=deadline.split(0.85))
 
                 if not image_url_from_ai:
                     return Response(
@@ -95,42 +212,48 @@ class StartGameAPIView(APIView):
                         status=status.HTTP_500_INTERNAL_SERVER_ERROR
                     )
 
-                response = requests.get(image_url_from_ai, timeout=60)
-                response.raise_for_status()
-                source_image = Image.open(BytesIO(response.content))
-
-            # 统一优化流程
-            if source_image.mode != 'RGB':
-                source_image = source_image.convert('RGB')
-
-            source_image.thumbnail((512, 512))  # 等比缩放
-
-            thumb_io = BytesIO()
-            source_image.save(thumb_io, format='JPEG', quality=85)
+                image_source = image_processing.fetch_image_bytes(image_url_from_ai, deadline=deadline)
 
-            # 使用UUID生成安全的文件名
-            optimized_filename = f"{uuid.uuid4().hex}.jpg"
+            # 统一优化流程：在进程池中生成所有衍生图（512px 主图、224px 打分图、缩略图，各含 JPEG 与 WebP）
+            saved_paths = image_processing.save_renditions(image_source)
+            renditions = {
+                name: image_processing.media_url(path, request) for name, path in saved_paths.items()
+            }
 
-            # 使用Django的存储系统保存优化后的文件
-            saved_path = default_storage.save(f"uploads/{optimized_filename}", ContentFile(thumb_io.getvalue()))
-
-            # 构建并返回优化后图片的完整、可公开访问的URL
-            final_image_url = request.build_absolute_uri(f"{settings.MEDIA_URL}{saved_path}")
+            # 在后台提前执行 AI 一方，玩家提交时只剩玩家一方
+            speculation.start(
+                renditions[image_processing.MAIN_RENDITION],
+                serializer.validated_data['language'],
+                serializer.validated_data['char_limit'],
+                user=request.user.pk,
+            )
 
-            return Response({"original_image_url": final_image_url}, status=status.HTTP_200_OK)
+            # original_image_url 仍然返回 512px 的 JPEG 主图，保持与旧版客户端兼容
+            return Response(
+                {
+                    "original_image_url": renditions[image_processing.MAIN_RENDITION],
+                    "renditions": renditions,
+                },
+                status=status.HTTP_200_OK
+            )
 
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
         except Exception as e:
             return Response({"error": f"An error occurred while processing the image: {str(e)}"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class PlayTurnAPIView(APIView):
+class PlayTurnAPIView(InstrumentedViewMixin, AIAdmissionMixin, APIView):
     """
     处理游戏回合的核心 API。
     """
 
     # 指定该视图需要经过身份验证
     permission_classes = [IsAuthenticated]
+    # 每回合调用一次识图，两次文生图（玩家一次、AI 一次）；
+    # 命中投机执行的结果时，AI 一方的调用已经在开局时计入，归还多扣的令牌
+    upstream_calls = {'vision': 1, 'image_generation': 2}
     # 定义序列化器
     serializer_class = PlayerTurnInputSerializer
 
@@ -147,25 +270,42 @@ class PlayTurnAPIView(APIView):
         language = validated_data['language']
         char_limit = validated_data['char_limit']
 
+        # 整个回合的端到端时间预算，按顺序切分给各个阶段，剩余部分留给后续阶段
+        deadline = Deadline(settings.TURN_DEADLINE)
+
         # 1. 玩家回合：根据玩家提示词生成图片
-        player_generated_image_url = ai_services.get_image_from_prompt(player_prompt)
-
-        # 2. AI 回合：AI识图 -> AI生成图片
-        # 将 language 和 char_limit 参数都传递给服务函数
-        ai_prompt_from_image = ai_services.get_ai_prompt_from_image(
-            image_url=original_image_url,
-            language=language,
-            char_limit=char_limit
+        player_generated_image_url = ai_services.get_image_from_prompt(
+            player_prompt, deadline=deadline.split(0.4)
         )
-        # 检查是否成功获取到提示词
-        if ai_prompt_from_image is None:
-            return Response(
-                {"error": "AI failed to generate a prompt from the images. Check server logs for details."},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        # 2. AI 回合：开局时已经在后台执行过的，直接取结果；否则 AI识图 -> AI生成图片
+        speculated = speculation.claim(
+            original_image_url, language, char_limit,
+            wait=min(settings.SPECULATION_WAIT, deadline.remaining() * 0.5)
+        )
+        if speculated:
+            refund_model_quota(speculation.AI_BRANCH_CALLS)
+            ai_prompt_from_image = speculated['ai_generated_prompt_from_image']
+            ai_generated_image_url = speculated['ai_generated_image_url']
+        else:
+            # 将 language 和 char_limit 参数都传递给服务函数
+            ai_prompt_from_image = ai_services.get_ai_prompt_from_image(
+                image_url=original_image_url,
+                language=language,
+                char_limit=char_limit,
+                deadline=deadline.split(0.3)
             )
+            # 检查是否成功获取到提示词
+            if ai_prompt_from_image is None:
+                return Response(
+                    {"error": "AI failed to generate a prompt from the images. Check server logs for details."},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
 
-        # AI 生成的提示词也应该被用来生成图片
-        ai_generated_image_url = ai_services.get_image_from_prompt(ai_prompt_from_image)
+            # AI 生成的提示词也应该被用来生成图片
+            ai_generated_image_url = ai_services.get_image_from_prompt(
+                ai_prompt_from_image, deadline=deadline.split(0.85)
+            )
         # 确保图片都生成成功
         if not all([player_generated_image_url, ai_generated_image_url]):
              return Response(
@@ -173,13 +313,40 @@ class PlayTurnAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-        # 3. 计算相似度
+        # 3. 下载图片并计算相似度
+        # 每张图片只下载一次：同一份内容既用于两次打分，也交给后台转存，不再重复下载。
+        # 原图如果有预先生成的 224px 打分图，就直接用它，省去下载和解码 512px 主图。
+        original_renditions = image_processing.rendition_urls_for(original_image_url)
+        scoring_image_url = original_renditions.get(image_processing.SCORE_RENDITION, original_image_url)
+        try:
+            original_image_bytes = image_processing.fetch_image_bytes(
+                scoring_image_url, deadline=deadline
+            )
+            player_image_bytes = image_processing.fetch_image_bytes(
+                player_generated_image_url, deadline=deadline
+            )
+            # 投机执行时 AI 图片已经打过分并转存到本站，不需要再下载
+            ai_image_bytes = None if speculated else image_processing.fetch_image_bytes(
+                ai_generated_image_url, deadline=deadline
+            )
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"下载图片时发生错误: {e}")
+            return Response(
+                {"error": "Failed to download images for scoring. Check server logs for details."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
         player_similarity_score = ai_services.calculate_image_similarity(
-            original_image_url, player_generated_image_url
-        )
-        ai_similarity_score = ai_services.calculate_image_similarity(
-            original_image_url, ai_generated_image_url
+            original_image_bytes, player_image_bytes
         )
+        if speculated:
+            ai_similarity_score = speculated['ai_similarity_score']
+        else:
+            ai_similarity_score = ai_services.calculate_image_similarity(
+                original_image_bytes, ai_image_bytes
+            )
         # --- 确保相似度计算成功 ---
         if player_similarity_score is None or ai_similarity_score is None:
             return Response(
@@ -188,32 +355,39 @@ class PlayTurnAPIView(APIView):
             )
 
         # 4. 判定胜负
-        winner = 'draw'
-        if player_similarity_score > ai_similarity_score:
-            winner = 'player'
-        elif ai_similarity_score > player_similarity_score:
-            winner = 'ai'
+        winner = decide_winner(player_similarity_score, ai_similarity_score)
 
         # 5. 创建并保存 GameRound 记录到数据库
-        game_round = GameRound.objects.create(
-            user=request.user,
-            original_image_url=original_image_url,
-            player_prompt=player_prompt,
-            player_generated_image_url=player_generated_image_url,
-            player_similarity_score=player_similarity_score,
-            ai_generated_prompt_from_image=ai_prompt_from_image,
-            ai_generated_image_url=ai_generated_image_url,
-            ai_similarity_score=ai_similarity_score,
-            winner=winner
-        )
+        with metrics.timed('db_write'):
+            game_round = GameRound.objects.create(
+                user=request.user,
+                original_image_url=original_image_url,
+                player_prompt=player_prompt,
+                player_generated_image_url=player_generated_image_url,
+                player_similarity_score=player_similarity_score,
+                ai_generated_prompt_from_image=ai_prompt_from_image,
+                ai_generated_image_url=ai_generated_image_url,
+                ai_similarity_score=ai_similarity_score,
+                winner=winner,
+                score_model=ai_services.score_model_name(),
+                image_renditions=round_renditions(original_renditions, speculated),
+            )
+
+        # 6. 在后台把生成的图片转存到本站存储，并改写本轮记录中的图片 URL
+        if settings.MIRROR_GENERATED_IMAGES:
+            mirroring.schedule_mirror(game_round.id, {'player': player_image_bytes, 'ai': ai_image_bytes})
 
-        # 6. 准备并返回响应
+        # 7. 准备并返回响应
         output_serializer = GameRoundResultSerializer(game_round)
         return Response(output_serializer.data, status=status.HTTP_201_CREATED)
 
 
+# 历史记录和排行榜的渲染器：JSON 用 orjson 输出（与 DRF 的输出逐字节相同），可浏览 API 页面保持不变
+FAST_RENDERER_CLASSES = [FastJSONRenderer, BrowsableAPIRenderer]
+
+
 # 历史记录 API 视图
-class GameRoundHistoryAPIView(ListAPIView):
+class GameRoundHistoryAPIView(InstrumentedViewMixin, ListAPIView):
     """
     显示用户的游戏历史记录。
     只读接口，只响应 GET 请求。
@@ -222,6 +396,7 @@ class GameRoundHistoryAPIView(ListAPIView):
     serializer_class = GameRoundResultSerializer
     # 指定这个视图需要用户登录才能访问
     permission_classes = [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get_queryset(self):
         """
@@ -233,8 +408,33 @@ class GameRoundHistoryAPIView(ListAPIView):
         # 通过 user 对象，查询所有与他关联的 GameRound 记录，并按时间倒序排列
         return GameRound.objects.filter(user=user).order_by('-timestamp')
 
+    def list(self, request, *args, **kwargs):
+        # 直接按列读取并序列化，不逐行创建模型对象；输出与 serializer_class 完全相同
+        return Response(game_round_rows.serialize_queryset(self.get_queryset()))
+
+def leaderboard_queryset():
+    """
+    构建一个复杂的数据库查询来生成排行榜数据（同步和异步视图共用）。
+    """
+    # F() 对象允许我们在查询中直接引用模型的字段值
+    win_margin = F('player_similarity_score') - F('ai_similarity_score')
+
+    queryset = GameRound.objects.filter(
+        winner='player'  # 1. 首先，只筛选出玩家获胜的记录
+    ).values(
+        username = F('user__username') # 2. 按用户名进行分组
+    ).annotate(
+        win_count=Count('id'), # 3. 为每个分组（即每个用户）计算获胜次数
+        avg_win_margin=Avg(win_margin) # 4. 为每个分组计算平均净胜分
+    ).order_by(
+        '-win_count', '-avg_win_margin' # 5. 首先按获胜次数降序排，次数相同再按平均净胜分降序排
+    )[:7] # 6. 最后，只取排名前 7 的记录
+
+    return queryset
+
+
 # 排行榜 API 视图
-class LeaderboardAPIView(ListAPIView):
+class LeaderboardAPIView(InstrumentedViewMixin, ListAPIView):
     """
     获取战胜 AI 次数最多的用户排行榜。
     这是一个公开的、只读的接口。
@@ -242,29 +442,19 @@ class LeaderboardAPIView(ListAPIView):
     # 使用我们为排行榜创建的专用序列化器
     serializer_class = LeaderboardSerializer
     # 无需 permission_classes，因为排行榜是公开的
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get_queryset(self):
         """
         构建一个复杂的数据库查询来生成排行榜数据。
         """
-        # F() 对象允许我们在查询中直接引用模型的字段值
-        win_margin = F('player_similarity_score') - F('ai_similarity_score')
-
-        queryset = GameRound.objects.filter(
-            winner='player'  # 1. 首先，只筛选出玩家获胜的记录
-        ).values(
-            username = F('user__username') # 2. 按用户名进行分组
-        ).annotate(
-            win_count=Count('id'), # 3. 为每个分组（即每个用户）计算获胜次数
-            avg_win_margin=Avg(win_margin) # 4. 为每个分组计算平均净胜分
-        ).order_by(
-            '-win_count', '-avg_win_margin' # 5. 首先按获胜次数降序排，次数相同再按平均净胜分降序排
-        )[:7] # 6. 最后，只取排名前 7 的记录
-
-        return queryset
+        return leaderboard_queryset()
+
+    def list(self, request, *args, **kwargs):
+        return Response(leaderboard_rows.serialize_dicts(self.get_queryset()))
 
 # 数据埋点 API 视图
-class GameEventAPIView(APIView):
+class GameEventAPIView(InstrumentedViewMixin, APIView):
     """
     用于记录用户行为的 API 视图。
     公开接口，无需登录即可调用
@@ -277,10 +467,10 @@ class GameEventAPIView(APIView):
         # 验证输入数据是否符合我们定义的序列化器要求
         serializer = GameEventSerializer(data=request.data)
         if serializer.is_valid():
-            # 检查是否登录
-            user = request.user if request.user else None
-            # 获取 Session ID
-            session_id = request.session.session_key
+            # 检查是否登录（未登录时 request.user 是 AnonymousUser，不能直接存入外键）
+            user = request.user if request.user.is_authenticated else None
+            # 获取 Session ID（使用 Token 认证的客户端没有会话，记为空字符串）
+            session_id = request.session.session_key or ''
             # 创建 GameEvent 记录
             GameEvent.objects.create(
                 user=user,
@@ -291,4 +481,211 @@ class GameEventAPIView(APIView):
             # 返回 204 No Content，表示请求成功，但没有返回任何内容
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+# --- 锦标赛模式 ---
+def _requested_count(value, default: int) -> int:
+    """
+    限流时估算请求涉及的轮数（此时请求还没有经过序列化器校验）。
+    """
+    try:
+        return max(1, min(int(value), settings.TOURNAMENT_MAX_ROUNDS))
+    except (TypeError, ValueError):
+        return default
+
+
+def tournament_queryset(user):
+    """
+    用户的锦标赛，连同各轮及其游戏记录一起查询（不读取原图嵌入）。
+    """
+    return TournamentSession.objects.filter(user=user).prefetch_related(
+        Prefetch('rounds', queryset=TournamentRound.objects.select_related('game_round').defer('original_embedding'))
+    )
+
+
+class TournamentStartAPIView(InstrumentedViewMixin, AIUpstreamMixin, APIView):
+    """
+    开始一场锦标赛。AI 一方在后台批量预先计算，本接口立即返回 202，
+    客户端轮询 TournamentDetailAPIView，状态变为 ready 后开始提交。
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_upstream_calls(self, request):
+        # 每轮一次识图，一次 AI 生图，未指定原图时再加一次原图生成；按最多的情况计入限流
+        rounds = _requested_count(request.data.get('rounds'), 5)
+        return {'vision': rounds, 'image_generation': 2 * rounds}
+
+    def post(self, request, *args, **kwargs):
+        serializer = TournamentStartSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        validated_data = serializer.validated_data
+        session = tournaments.create_session(
+            user=request.user,
+            round_count=validated_data['rounds'],
+            language=validated_data['language'],
+            char_limit=validated_data['char_limit'],
+            original_image_urls=validated_data['original_image_urls'],
+        )
+        return Response(TournamentSessionSerializer(session).data, status=status.HTTP_202_ACCEPTED)
+
+
+class TournamentDetailAPIView(InstrumentedViewMixin, RetrieveAPIView):
+    """
+    查看一场锦标赛的状态、各轮和汇总结果。
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = TournamentSessionSerializer
+
+    def get_queryset(self):
+        return tournament_queryset(self.request.user)
+
+
+class TournamentTurnsAPIView(InstrumentedViewMixin, AIAdmissionMixin, APIView):
+    """
+    提交锦标赛的一轮或多轮。AI 一方已经预先算好，这里只生成玩家图片并批量打分。
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_upstream_calls(self, request):
+        turns = request.data.get('turns')
+        return {'image_generation': _requested_count(len(turns) if isinstance(turns, list) else 1, 1)}
+
+    def post(self, request, pk, *args, **kwargs):
+        session = get_object_or_404(TournamentSession, pk=pk, user=request.user)
+        serializer = TournamentTurnsSerializer(data=request.data, context={'session': session})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            tournaments.play_turns(
+                session, serializer.validated_data['turns'], deadline=Deadline(settings.TURN_DEADLINE)
+            )
+        except tournaments.TurnFailed as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        session = tournament_queryset(request.user).get(pk=pk)
+        return Response(TournamentSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+
+# --- 每日挑战 ---
+def challenge_for_day(day: str) -> DailyChallenge:
+    """
+    按日期（YYYY-MM-DD）或 today 查找每日挑战，不存在时返回 404。
+    """
+    if day == 'today':
+        date = timezone.localdate()
+    else:
+        date = parse_date(day)
+        if date is None:
+            raise Http404
+    return get_object_or_404(DailyChallenge.objects.defer('original_embedding'), date=date)
+
+
+class DailyChallengeAPIView(InstrumentedViewMixin, APIView):
+    """
+    获取某一天的每日挑战（原图和提示词限制），公开接口。
+    """
+
+    def get(self, request, day, *args, **kwargs):
+        return Response(DailyChallengeSerializer(challenge_for_day(day)).data)
+
+
+class ChallengePlayAPIView(InstrumentedViewMixin, AIAdmissionMixin, APIView):
+    """
+    提交每日挑战的一个回合。AI 一方在发布挑战时已经算好，每回合只调用一次文生图。
+    """
+    permission_classes = [IsAuthenticated]
+    upstream_calls = {'image_generation': 1}
+
+    def post(self, request, day, *args, **kwargs):
+        challenge = challenge_for_day(day)
+        # 打分需要原图嵌入，challenge_for_day 没有读取它
+        challenge.refresh_from_db(fields=['original_embedding'])
+        serializer = ChallengePlaySerializer(data=request.data, context={'challenge': challenge})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            game_round = challenges.play_challenge(
+                challenge,
+                request.user,
+                serializer.validated_data['player_prompt'],
+                deadline=Deadline(settings.TURN_DEADLINE),
+            )
+        except tournaments.TurnFailed as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response(GameRoundResultSerializer(game_round).data, status=status.HTTP_201_CREATED)
+
+
+class ChallengeLeaderboardAPIView(InstrumentedViewMixin, ListAPIView):
+    """
+    每日挑战的排行榜，数据来自每回合增量更新的 ChallengeEntry，公开接口。
+    """
+    serializer_class = ChallengeLeaderboardSerializer
+
+    def get_queryset(self):
+        return challenges.challenge_leaderboard(challenge_for_day(self.kwargs['day']))
+
+
+# --- 用户统计 ---
+class MyStatsAPIView(InstrumentedViewMixin, APIView):
+    """
+    当前用户的战绩汇总（胜负、胜率、平均分和最高分、连胜），由每回合增量更新，读取只需一次查询。
+    客户端不必再下载完整的历史记录自己统计。
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        # 还没有玩过的用户返回全零的汇总，不写入数据库
+        user_stats = UserStats.objects.filter(user=request.user).first() or UserStats(user=request.user)
+        return Response(UserStatsSerializer(user_stats).data)
+
+
+# --- 数据导出 ---
+class ExportAPIView(InstrumentedViewMixin, APIView):
+    """
+    以 CSV 或 JSONL 流式导出游戏回合（rounds）或埋点事件（events），仅限管理员。
+    数据按主键分批读取、边读边输出，内存占用与表的大小无关。
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, kind, *args, **kwargs):
+        if kind not in exports.EXPORTS:
+            raise Http404
+        serializer = ExportQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+
+        export = exports.Export(
+            kind,
+            since=params.get('since'),
+            until=params.get('until'),
+            since_id=params.get('since_id'),
+        )
+        chunks = exports.encode_chunks(export.lines(params['output']), compress=params['gzip'])
+        if settings.GAMECORE_ASYNC_VIEWS:
+            chunks = exports.aiterate(chunks)
+
+        filename = f"{kind}.{params['output']}" + ('.gz' if params['gzip'] else '')
+        response = StreamingHttpResponse(
+            chunks,
+            content_type='application/gzip' if params['gzip'] else f"{exports.FORMATS[params['output']]}; charset=utf-8",
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+# 指标导出视图
+def metrics_view(request):
+    """
+    以 Prometheus 文本格式导出当前进程的指标。
+    配置了 METRICS_TOKEN 时，要求请求头携带 Authorization: Bearer <token>。
+    """
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')